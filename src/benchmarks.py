@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the hot paths of ourCode and of the evolution loop.
+
+Genomes are synthetic: genes of the same length, evenly spaced, with random
+orientations, and barriers placed between them. The evolution benchmark
+uses SyntheticSimulator, so no TwisTranscripT checkout is needed.
+
+Results are saved as JSON, so that runs on different commits can be
+compared:
+
+    python benchmarks.py --genes 10,100,1000,10000 --output new.json
+    python benchmarks.py --output new.json --compare old.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import timeit
+
+import numpy as np
+
+import ourCode
+
+
+def synthetic_genome(nb_genes, nb_barriers, genome_size, seed=0):
+    """
+    Build a synthetic genome.
+
+    Parameters
+    ----------
+    nb_genes : int
+        Number of genes.
+    nb_barriers : int
+        Number of barriers.
+    genome_size : int
+        Genome size in base pair.
+    seed : int, optional
+        Seed of the gene orientations.
+
+    Returns
+    -------
+    genome : ourCode.Genome
+        Genes of genome_size / (4 * nb_genes) base pairs, evenly spaced,
+        and barriers evenly spread in the free space.
+    """
+
+    rng = np.random.RandomState(seed)
+    spacing = genome_size // nb_genes
+    gene_length = spacing // 4
+    starts = np.arange(nb_genes) * spacing + spacing // 4
+    ends = starts + gene_length
+    # Reverse the orientation of half of the genes
+    reverse = rng.rand(nb_genes) < .5
+    starts[reverse], ends[reverse] = ends[reverse], starts[reverse].copy()
+    # Barriers in the middle of the space following genes
+    barrier_genes = np.linspace(0, nb_genes, nb_barriers, endpoint=False)
+    barriers = (barrier_genes.astype(int) * spacing + spacing // 4
+                + gene_length + spacing // 4)
+    return ourCode.Genome(genome_size, starts, ends, barriers)
+
+
+def time_call(function, min_time=0.2):
+    """
+    Time a function call.
+
+    Parameters
+    ----------
+    function : callable
+        Function called without arguments.
+    min_time : float, optional
+        Minimal total duration of the measure, in seconds.
+
+    Returns
+    -------
+    seconds : float
+        Best time per call over 3 measures.
+    calls : int
+        Number of calls per measure.
+    """
+
+    timer = timeit.Timer(function)
+    calls, duration = timer.autorange()
+    calls = max(calls, int(calls * min_time / max(duration, 1e-9)))
+    return min(timer.repeat(3, calls)) / calls, calls
+
+
+def benchmark_genome(nb_genes, nb_barriers, genome_size, u, folder):
+    """
+    Time the hot paths of ourCode on one synthetic genome.
+
+    Returns
+    -------
+    results : list of dicts
+        One result per benchmarked function.
+    """
+
+    genome = synthetic_genome(nb_genes, nb_barriers, genome_size)
+    size, start, end, barr = genome.as_tuple()
+    out = ourCode.pos_out_from_pos_lists(start, end, barr)
+    rng = np.random.default_rng(0)
+    inversion_positions = np.sort(genome.sampler(u).draw(2, rng))
+    expression = ourCode.SyntheticSimulator().simulate(size, start, end,
+                                                       barr)
+    target = np.full(nb_genes, 1. / nb_genes)
+    # Simulation output, with transcription units in reverse order
+    simulation_output = "".join(
+            "%d  1  1  1 %d\n" % (k, position)
+            for k, position in enumerate(start[::-1]))
+    simulation_output += "".join("Transcript ID %d : %d\n" % (k, count)
+                                 for k, count in enumerate(expression))
+
+    # Genome files, and the .ini file referencing them
+    genome_files = [os.path.join(folder, name) for name in
+                    ["genome.gff", "TSS.dat", "TTS.dat", "prot.dat"]]
+    ourCode.update_files(size, start, end, barr, *genome_files)
+    params_file = os.path.join(folder, "params.ini")
+    with open(params_file, "w") as params:
+        params.write("[INPUTS]\n")
+        for key, name in zip(["GFF", "TSS", "TTS", "BARR_FIX"],
+                             ["genome.gff", "TSS.dat", "TTS.dat",
+                              "prot.dat"]):
+            params.write(key + " = " + name + "\n")
+
+    benchmarks = {
+        "sample": lambda: ourCode.sample(out, size, u, rng),
+        "indel": lambda: ourCode.indel(u, size, start, end, barr, out, .5,
+                                       rng=rng),
+        "genome_inversion": lambda: ourCode.genome_inversion(
+                size, start, end, barr, *inversion_positions),
+        "pos_out_from_pos_lists": lambda: ourCode.pos_out_from_pos_lists(
+                start, end, barr),
+        "update_files": lambda: ourCode.update_files(size, start, end, barr,
+                                                     *genome_files),
+        "pos_out_genes": lambda: ourCode.pos_out_genes(params_file,
+                                                       folder + os.sep),
+        "parse_simulation_output": lambda: ourCode.map_transcripts(
+                ourCode.read_transcript_records(simulation_output), start),
+        "compute_fitness": lambda: ourCode.compute_fitness(expression,
+                                                           target)}
+    results = []
+    for name, function in benchmarks.items():
+        seconds, calls = time_call(function)
+        results.append({"name": name, "nb_genes": nb_genes,
+                        "nb_barriers": nb_barriers,
+                        "genome_size": genome_size,
+                        "seconds": seconds, "calls": calls})
+    return results
+
+
+def benchmark_evolution(nb_genes, nb_barriers, genome_size, u,
+                        nb_generations):
+    """
+    Time evolution with the synthetic simulator.
+
+    Returns
+    -------
+    result : dict
+        Time per generation.
+    """
+
+    genome = synthetic_genome(nb_genes, nb_barriers, genome_size)
+    simulator = ourCode.SyntheticSimulator()
+    target = np.full(nb_genes, 1. / nb_genes)
+    expression = simulator.simulate(*genome.as_tuple())
+    fitness = ourCode.compute_fitness(expression, target)
+    rng = np.random.default_rng(0)
+
+    def run():
+        # Generation messages are formatted but not displayed
+        with contextlib.redirect_stdout(io.StringIO()):
+            ourCode.evolution(genome.start, genome.end, genome.barriers,
+                              None, genome.size, expression, fitness, target,
+                              u, 1e-3, .5, .5, nb_generations, [None] * 6,
+                              simulator, rng=rng)
+
+    seconds, calls = time_call(run)
+    return {"name": "evolution", "nb_genes": nb_genes,
+            "nb_barriers": nb_barriers, "genome_size": genome_size,
+            "seconds": seconds / nb_generations,
+            "calls": calls * nb_generations}
+
+
+def git_commit():
+    """Return the current commit hash, or None outside of a git repository."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"],
+                              capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))
+                              ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, reference):
+    """Print the speed-up of each result compared to a reference run."""
+    reference_times = {(r["name"], r["nb_genes"], r["nb_barriers"],
+                        r["genome_size"]): r["seconds"]
+                       for r in reference["results"]}
+    print("%-24s %8s %8s %10s %12s %12s %8s" % (
+            "benchmark", "genes", "barriers", "size", "reference (s)",
+            "new (s)", "speed-up"))
+    for result in results["results"]:
+        key = (result["name"], result["nb_genes"], result["nb_barriers"],
+               result["genome_size"])
+        if key in reference_times:
+            print("%-24s %8d %8d %10d %12.3g %12.3g %8.2f" % (
+                    key + (reference_times[key], result["seconds"],
+                           reference_times[key] / result["seconds"])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--genes", default="10,100,1000,10000",
+                        help="comma-separated numbers of genes")
+    parser.add_argument("--barriers", default=None,
+                        help="comma-separated numbers of barriers (default: "
+                        "as many as genes)")
+    parser.add_argument("--bp-per-gene", type=int, default=3000,
+                        help="genome size divided by the number of genes")
+    parser.add_argument("--discret-step", type=int, default=60)
+    parser.add_argument("--generations", type=int, default=50,
+                        help="generations of the evolution benchmark")
+    parser.add_argument("--output", default="benchmarks.json")
+    parser.add_argument("--compare", default=None,
+                        help="JSON results of a previous run")
+    arguments = parser.parse_args(argv)
+
+    results = {"commit": git_commit(), "python": platform.python_version(),
+               "numpy": np.__version__, "results": []}
+    for nb_genes in [int(x) for x in arguments.genes.split(",")]:
+        if arguments.barriers is None:
+            barrier_counts = [nb_genes]
+        else:
+            barrier_counts = [int(x) for x in arguments.barriers.split(",")]
+        for nb_barriers in barrier_counts:
+            genome_size = nb_genes * arguments.bp_per_gene
+            print("genes:", nb_genes, "barriers:", nb_barriers,
+                  "genome size:", genome_size)
+            with tempfile.TemporaryDirectory() as folder:
+                results["results"] += benchmark_genome(
+                        nb_genes, nb_barriers, genome_size,
+                        arguments.discret_step, folder)
+            results["results"].append(benchmark_evolution(
+                    nb_genes, nb_barriers, genome_size,
+                    arguments.discret_step, arguments.generations))
+    with open(arguments.output, "w") as output:
+        json.dump(results, output, indent=1)
+    if arguments.compare is not None:
+        with open(arguments.compare, "r") as reference:
+            compare(results, json.load(reference))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,56 @@
 """
 Simulation of a genome evolving inside an environment without mutations on
 coding sequences.
+
+The simulation only needs numpy: matplotlib (plot extra) and pandas (table
+extra) are imported when plotting or exporting results, so importing the
+module stays fast and never touches a display backend.
+
+>>> import subprocess
+>>> modules = subprocess.run([sys.executable, "-c",
+...                           "import sys, ourCode; print(list(sys.modules))"],
+...                          cwd=os.path.dirname(os.path.abspath(__file__)),
+...                          capture_output=True, text=True).stdout
+>>> "matplotlib" in modules, "pandas" in modules
+(False, False)
+
+The import-time budget: apart from numpy and the module's own body, the
+imports of ourCode take less than 0.2 s (matplotlib.pyplot or pandas alone
+take about twice that).
+
+>>> report = subprocess.run([sys.executable, "-X", "importtime", "-c",
+...                          "import ourCode"],
+...                         cwd=os.path.dirname(os.path.abspath(__file__)),
+...                         capture_output=True, text=True).stderr
+>>> lines = [line.split("|") for line in report.splitlines()
+...          if line.startswith("import time:")]
+>>> times = {name.strip(): (int(own.split(":")[1]), int(total))
+...          for own, total, name in lines if total.strip().isdigit()}
+>>> own, total = times["ourCode"]
+>>> total - own - times["numpy"][1] < 200000  # microseconds
+True
 """
 import numpy as np
 import os
 import re
-import matplotlib.pyplot as plt
-import pandas as pd
+import sys
+import io
+import contextlib
+import runpy
+import copy
+import hashlib
+import collections
+import pickle
+import time
+import threading
+import socket
+import cProfile
+import multiprocessing
+import multiprocessing.connection
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import configparser
+import itertools
 
 #=======================================================================
 #                   READ INPUT FILES
@@ -38,7 +82,151 @@ def parse_namefile_ini(line):
     return processed_line
 
 
-def pos_out_genes(file_ini, folder):
+# Keys of the genome files in a TwisTranscripT .ini file
+GENOME_FILE_KEYS = ["GFF", "TSS", "TTS", "BARR_FIX"]
+# Version of the genome cache files written by pos_out_genes
+GENOME_CACHE_VERSION = 1
+
+
+def genome_files_ini(file_ini, folder):
+    """
+    Return the genome files described by a .ini file.
+    
+    Files are found by their key (GENOME_FILE_KEYS) in any section of the
+    .ini file. If they are missing, they are read from lines 2 to 5 (see
+    parse_namefile_ini).
+    
+    Parameters
+    ----------
+    file_ini : str
+        Initialization .ini file name.
+    folder : str
+        folder of the .ini file
+    
+    Returns
+    -------
+    genome_files : list of str
+        Addresses of the .gff, TSS, TTS and barrier files.
+    """
+    
+    config = configparser.ConfigParser(interpolation=None, strict=False)
+    # Keys are case sensitive
+    config.optionxform = str
+    try:
+        config.read(file_ini)
+    except configparser.Error:
+        config = configparser.ConfigParser()
+    for section in config.sections():
+        if all(key in config[section] for key in GENOME_FILE_KEYS):
+            return [folder + config[section][key] for key in GENOME_FILE_KEYS]
+    with open(file_ini, "r") as ini:
+        lines = ini.readlines()
+    return [folder + parse_namefile_ini(line) for line in lines[1:5]]
+
+
+# Key of a "key = value" (or "key: value") line of a .ini file
+INI_KEY_PATTERN = re.compile(r"\s*([^\s=:#;\[][^=:]*?)\s*[=:]")
+
+
+def genome_file_lines(lines):
+    """
+    Find the lines of a .ini file giving the genome files.
+    
+    Lines are found by their key (GENOME_FILE_KEYS), the first occurrence
+    of each key being used; if a key is missing, they are lines 2 to 5, as
+    in genome_files_ini.
+    
+    Parameters
+    ----------
+    lines : list of str
+        Lines of the .ini file.
+    
+    Returns
+    -------
+    line_numbers : list of ints
+        Index of the lines giving the .gff, TSS, TTS and barrier files.
+    
+    >>> genome_file_lines(["[INPUTS]\\n", "# GFF = old.gff\\n",
+    ...                    "TSS = TSS.dat\\n", "GFF=genome.gff\\n",
+    ...                    "BARR_FIX = prot.dat\\n", "TTS: TTS.dat\\n"])
+    [3, 2, 5, 4]
+    """
+    
+    line_numbers = {}
+    for k, line in enumerate(lines):
+        match = INI_KEY_PATTERN.match(line)
+        if match is not None and match.group(1) in GENOME_FILE_KEYS:
+            line_numbers.setdefault(match.group(1), k)
+    if len(line_numbers) < len(GENOME_FILE_KEYS):
+        return [1, 2, 3, 4]
+    return [line_numbers[key] for key in GENOME_FILE_KEYS]
+
+
+def gff_genome_size(file_gff):
+    """
+    Read the genome size in the header of a .gff file.
+    
+    Only the header lines (starting with "#") are read.
+    
+    Parameters
+    ----------
+    file_gff : str
+        .gff file name.
+    
+    Returns
+    -------
+    genome_size : int
+        Number of base pairs in the genome.
+    """
+    
+    with open(file_gff, "r") as gff:
+        for line in gff:
+            if not line.startswith("#"):
+                break
+            region = re.match("##sequence-region .* 1 ([0-9]+)", line)
+            if region is not None:
+                return int(region.group(1))
+    raise ValueError("no ##sequence-region line in the header of "
+                     + file_gff)
+
+
+def read_positions(filename, column):
+    """
+    Read a column of positions in a tab-separated file with a header line.
+    
+    Parameters
+    ----------
+    filename : str
+        Name of the TSS, TTS or barrier file.
+    column : int
+        Index of the column of positions.
+    
+    Returns
+    -------
+    positions : Numpy array
+        Array of ints, in the file order.
+    """
+    
+    with open(filename, "r") as table:
+        table.readline()
+        content = table.read()
+    if not content.strip():
+        return np.empty(0, dtype=np.int64)
+    return np.loadtxt(io.StringIO(content), dtype=np.int64, delimiter="\t",
+                      usecols=column, ndmin=1)
+
+
+def _genome_cache_key(files):
+    # Files are identified by their path, modification time and size
+    key = ["ourCode genome cache " + str(GENOME_CACHE_VERSION)]
+    for filename in files:
+        stat = os.stat(filename)
+        key.append(os.path.abspath(filename) + "\t" + str(stat.st_mtime_ns)
+                   + "\t" + str(stat.st_size))
+    return "\n".join(key)
+
+
+def pos_out_genes(file_ini, folder, cache_file=None):
     """
     Return a description of the genome described by a .ini file.
     
@@ -48,14 +236,17 @@ def pos_out_genes(file_ini, folder):
         Initialization .ini file name.
     folder : str
         folder of the .ini file
+    cache_file : str, optional
+        .npz file where the parsed genome is saved. It is reused while the
+        .ini and genome files keep their path, modification time and size.
         
     Returns
     -------
-    start : list of ints
+    start : Numpy array
         Positions of gene starts
-    end : list of ints
+    end : Numpy array
         Positions of gene ends
-    barr : list of ints
+    barr : Numpy array
         Positionds of topological barriers
     out : Numpy array
         2-D array of ints. Each line represents an open interval containing
@@ -64,50 +255,37 @@ def pos_out_genes(file_ini, folder):
         Number of base pairs in the genome.
     """
     
-    f = open(file_ini, 'r')
-    f_lines = f.readlines() # List of the file_ini lines
-    file_gff = folder + parse_namefile_ini(f_lines[1]) # GFFF file address
-    file_tss = folder + parse_namefile_ini(f_lines[2]) # TSS file address
-    file_tts = folder + parse_namefile_ini(f_lines[3])# TTS file address
-    file_barr = folder + parse_namefile_ini(f_lines[4]) # prot.dat file address
-    
-    ## Genome size
-    fgff = open(file_gff, 'r')
-    fgff_content = fgff.read() # List of the file_gff lines
-    Ngen = re.findall("##sequence-region .* 1 ([0-9]+)",fgff_content)[0]
-                      
-    ## List of transcription start positions
-    ftss = open(file_tss, 'r')
-    ftss_lines = ftss.readlines() # List of the file_tss lines
-    start = []
-    for x in ftss_lines[1:]:
-        start.append(int(x.split("\t")[2]))
-    
-    ## List of transcription end positions
-    ftts = open(file_tts, 'r')
-    ftts_lines = ftts.readlines() # List of the file_tts lines
-    end = []
-    for x in ftts_lines[1:]:
-        end.append(int(x.split("\t")[2]))
-    
-    ## List of topological barriers
-    fbarr = open(file_barr, 'r')
-    fbarr_lines = fbarr.readlines() # List of the file_barr lines
-    barr = []
-    for x in fbarr_lines[1:]:
-        barr.append(int(x.split("\t")[1]))
-    
-    ## Close files
-    f.close()
-    fgff.close()
-    ftss.close()
-    ftts.close()
-    fbarr.close()
+    file_gff, file_tss, file_tts, file_barr = genome_files_ini(file_ini,
+                                                               folder)
+    key = _genome_cache_key([file_ini, file_gff, file_tss, file_tts,
+                             file_barr])
+    if cache_file is not None and os.path.exists(cache_file):
+        try:
+            with np.load(cache_file, allow_pickle=False) as cache:
+                if str(cache["key"]) == key:
+                    return (cache["start"], cache["end"], cache["barr"],
+                            cache["out"], int(cache["genome_size"]))
+        except (OSError, ValueError, KeyError):
+            # Unreadable cache, it is replaced
+            pass
     
+    genome_size = gff_genome_size(file_gff)
+    start = read_positions(file_tss, 2)
+    end = read_positions(file_tts, 2)
+    barr = read_positions(file_barr, 1)
     ### List of open position intervals in the genome where there is 
     ### no gene
     out = pos_out_from_pos_lists(start, end, barr)
-    return start, end, barr, out, int(Ngen)
+    
+    if cache_file is not None:
+        # Write then rename, so that a reader never sees a partial file,
+        # even if other processes load the same genome
+        temporary_file = cache_file + "." + str(os.getpid()) + ".tmp"
+        with open(temporary_file, "wb") as cache:
+            np.savez(cache, key=key, start=start, end=end, barr=barr,
+                     out=out, genome_size=genome_size)
+        os.replace(temporary_file, cache_file)
+    return start, end, barr, out, genome_size
 
 
 def target_expression(environment_file):
@@ -164,84 +342,360 @@ def update_files(genome_size, genes_start_pos, genes_end_pos, barriers_pos,
     Note
     ----
     Nothing is returned, but the files are created or updated.
+    
+    Files are read back by pos_out_genes:
+    
+    >>> import tempfile
+    >>> names = ["genome.gff", "TSS.dat", "TTS.dat", "prot.dat"]
+    >>> with tempfile.TemporaryDirectory() as folder:
+    ...     folder += os.sep
+    ...     update_files(100, [10, 60], [20, 50], [80],
+    ...                  *[folder + name for name in names])
+    ...     with open(folder + "params.ini", "w") as ini:
+    ...         _ = ini.write("[INPUTS]\\n" + "".join(
+    ...                 key + " = " + name + "\\n"
+    ...                 for key, name in zip(GENOME_FILE_KEYS, names)))
+    ...     pos_out_genes(folder + "params.ini", folder)
+    (array([10, 60]), array([20, 50]), array([80]), array([[80, 10],
+           [20, 50],
+           [60, 80]]), 100)
     """
     
     sequence_name = gff_file[:-4]
-    new_gff = open(gff_file, "w")
-    new_tss = open(tss_file, "w")
-    new_tts = open(tts_file, "w")
-    new_barr = open(barr_file, "w")
+    genes_start_pos = np.asarray(genes_start_pos)
+    genes_end_pos = np.asarray(genes_end_pos)
+    nb_genes = len(genes_start_pos)
+    orientations = gene_orientations(genome_size, genes_start_pos,
+                                     genes_end_pos).tolist()
+    starts = genes_start_pos.tolist()
+    ends = genes_end_pos.tolist()
+    gene_indices = range(nb_genes)
     ### Headers
-    new_gff.writelines(["##gff-version 3\n",
-                        "#!gff-spec-version 1.20\n",
-                        "#!processor NCBI annotwriter\n",
-                        "##sequence-region " + sequence_name + " 1 "
-                        + str(genome_size) + "\n",
-                        sequence_name + "\tRefSeq\tregion\t1\t"
-                        + str(genome_size) + "\t.\t+\t.\tID=id0;Name="
-                        + sequence_name + "\n"])
-    new_tss.write("TUindex\tTUorient\tTSS_pos\tTSS_strength\n")
-    new_tts.write("TUindex\tTUorient\tTTS_pos\tTTS_proba_off\n")
-    new_barr.write("prot_name\tprot_pos\n")
-    ### Body
-    for gene_index in range(len(genes_start_pos)):
-        start = genes_start_pos[gene_index]
-        end = genes_end_pos[gene_index]
-        size = end - start
-        if size > (genome_size / 2):
-            # Gene oriented "-" but crossing the origin
-            orient = "-"
-        elif size > 0:
-            orient = "+"
-        elif size > (-genome_size / 2):
-            orient = "-"
-        else:
-            # Gene oriented "+" but crossing the origin
-            orient = "+"
-        new_gff.write(sequence_name + "\tRefSeq\tgene\t" + str(start) + "\t"
-                      + str(end) + "\t.\t" + orient + "\t.\tID=g1;Name=g"
-                      + str(gene_index + 1) + "\n")
-        new_tss.write(str(gene_index) + "\t" + orient + "\t" + str(start)
-                      + "\t.2\n")
-        new_tts.write(str(gene_index) + "\t" + orient + "\t" + str(end)
-                      + "\t1.\n")
-    for barrier in barriers_pos:
-        new_barr.write("hns\t" +str(barrier) + "\n")
-    ### Close
-    for file in [new_gff, new_tss, new_tts, new_barr]:
-        file.close()
+    gff = ("##gff-version 3\n"
+           "#!gff-spec-version 1.20\n"
+           "#!processor NCBI annotwriter\n"
+           "##sequence-region " + sequence_name + " 1 " + str(genome_size)
+           + "\n" + sequence_name + "\tRefSeq\tregion\t1\t"
+           + str(genome_size) + "\t.\t+\t.\tID=id0;Name=" + sequence_name
+           + "\n")
+    tss = "TUindex\tTUorient\tTSS_pos\tTSS_strength\n"
+    tts = "TUindex\tTUorient\tTTS_pos\tTTS_proba_off\n"
+    barr = "prot_name\tprot_pos\n"
+    ### Body, formatted at once for all genes
+    gff += (("%s\tRefSeq\tgene\t%d\t%d\t.\t%s\t.\tID=g1;Name=g%d\n"
+             * nb_genes)
+            % tuple(itertools.chain.from_iterable(zip(
+                    itertools.repeat(sequence_name), starts, ends,
+                    orientations, range(1, nb_genes + 1)))))
+    tss += (("%d\t%s\t%d\t.2\n" * nb_genes)
+            % tuple(itertools.chain.from_iterable(zip(
+                    gene_indices, orientations, starts))))
+    tts += (("%d\t%s\t%d\t1.\n" * nb_genes)
+            % tuple(itertools.chain.from_iterable(zip(
+                    gene_indices, orientations, ends))))
+    barr += ("hns\t%d\n" * len(barriers_pos)) % tuple(
+            np.asarray(barriers_pos).tolist())
+    ### One write per file
+    for filename, content in [(gff_file, gff), (tss_file, tss),
+                              (tts_file, tts), (barr_file, barr)]:
+        with open(filename, "w") as file:
+            file.write(content)
 
 
-def copy_genome(PARAMS):
+def isolated_params(params_file, tag, staging_folder=None):
     """
-    Copy the last accepted genome to save it
+    Copy a parameter file so that it references its own genome files.
+    
+    The copy is written next to params_file, and the genome files are
+    placed in a tag sub-folder, so that several simulations can run at the
+    same time without overwriting each other's files.
     
     Parameters
     ----------
+    params_file : str
+        Path and name of the parameter file to copy.
+    tag : str
+        Name of the sub-folder holding the genome files. It can be nested
+        ("job0/speculative0"), the slashes being replaced by underscores in
+        the name of the copy.
+    staging_folder : str, optional
+        Folder where to write the genome files given to the simulation
+        instead of the folder of params_file, for instance a tmpfs folder
+        (see default_staging_folder). Last accepted genome files always
+        stay next to params_file.
+    
+    Returns
+    -------
     PARAMS : Python list
-        list of the following parameters:
-            NEXT_GEN_GFF : str
-                Name of the .gff file (gene positions) at the next generation.
-            NEXT_GEN_TSS : str
-                Name of the TSS file (gene start positions) 
-                at the next generation.
-            NEXT_GEN_TTS : str
-                Name of the TTS file (gene end positions)
-                at the next generation.
-            NEXT_GEN_BARRIERS : str
-                Name of the .dat file containing barrier positions 
-                at the next generation.
-            LAST_ACCEPTED_GENOME : list of str
-                Name of the equivalent files, where we want to copy the previous ones.
-    Note
-    ----
-    Nothing is returned, but the files are created or updated.
+        list of the parameter file copy, its .gff, TSS, TTS and barrier
+        files, and the list of files where to save the last accepted
+        genome (same layout as the PARAMS argument of evolution).
+    """
+    
+    folder = os.path.dirname(params_file)
+    os.makedirs(os.path.join(folder, tag), exist_ok=True)
+    if staging_folder is not None:
+        staging_folder = os.path.join(os.path.abspath(staging_folder), tag)
+        os.makedirs(staging_folder, exist_ok=True)
+    with open(params_file, "r") as read_file:
+        lines = read_file.readlines()
+    genome_files = []
+    for k, name in zip(genome_file_lines(lines),
+                       ["nextGen.gff", "nextGenTSS.dat", "nextGenTTS.dat",
+                        "nextGenProt.dat"]):
+        # Genome files are relative to the .ini folder
+        key = re.split("[=:]", lines[k], 1)[0].strip()
+        if staging_folder is None:
+            lines[k] = key + " = " + tag + "/" + name + "\n"
+            genome_files.append(os.path.join(folder, tag, name))
+        else:
+            lines[k] = key + " = " + os.path.join(staging_folder,
+                                                  name) + "\n"
+            genome_files.append(os.path.join(staging_folder, name))
+    new_params_file = os.path.join(folder, "params_" + tag.replace("/", "_")
+                                   + ".ini")
+    with open(new_params_file, "w") as write_file:
+        write_file.writelines(lines)
+    last_accepted_genome = [os.path.join(folder, tag, name) for name in
+                            ["last.gff", "lastTSS.dat", "lastTTS.dat",
+                             "lastProt.dat"]]
+    return [new_params_file] + genome_files + [last_accepted_genome]
+
+
+def default_staging_folder():
+    """Return a memory-backed folder for temporary genome files, if any.
+    
+    Returns
+    -------
+    folder : str or None
+        /dev/shm if it exists and is writable, None else.
+    """
+    
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return None
+  
+  
+EVENT_TYPES = ["initial", "insertion", "deletion", "inversion"]
+RESULT_DTYPE = np.dtype([("generation", "<i8"),
+                         ("accepted_fitness", "<f8"),
+                         ("proposed_fitness", "<f8"),
+                         ("accepted", "?"),
+                         ("event_type", "i1"),
+                         ("genome_size", "<i8"),
+                         ("event_position", "<i8"),
+                         ("event_position2", "<i8")])
+RESULT_LOG_HEADER = b"ourCode result log v1\n"
+
+
+class ResultLog:
+    """
+    Append-only binary log of the generations of a run.
+    
+    Each generation is one fixed-size record of RESULT_DTYPE (event types
+    are stored as their index in EVENT_TYPES, missing event positions as
+    -1). Records are buffered and written every flush_interval
+    generations, so memory use does not grow with the number of
+    generations, and the records written before a crash can still be read
+    (see read_result_log). Opening an existing log overwrites it, unless
+    nb_records is given: the log is then continued after its first
+    nb_records records.
+    
+    Parameters
+    ----------
+    filename : str
+        Path and name of the log file.
+    flush_interval : int, optional
+        Number of records buffered before writing them.
+    fsync : bool, optional
+        If True, records are also forced to disk at each flush.
+    nb_records : int, optional
+        Number of records of an existing log to keep, the following ones
+        being dropped (used to resume a run from a checkpoint).
+    
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as folder:
+    ...     filename = os.path.join(folder, "run.log")
+    ...     for run in range(2):
+    ...         with ResultLog(filename) as result_log:
+    ...             for generation in range(3):
+    ...                 result_log.append(generation, 1., 1., True,
+    ...                                   "initial", 100)
+    ...     with ResultLog(filename, nb_records=2) as result_log:
+    ...         result_log.append(2, .5, .5, False, "initial", 100)
+    ...     records = read_result_log(filename)
+    ...     records["generation"].tolist(), records["accepted"].tolist()
+    ([0, 1, 2], [True, True, False])
+    """
+    
+    def __init__(self, filename, flush_interval=1000, fsync=False,
+                 nb_records=None):
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.buffer = np.zeros(flush_interval, dtype=RESULT_DTYPE)
+        self.nb_buffered = 0
+        if (nb_records is not None and os.path.exists(filename)
+                and os.path.getsize(filename) > 0):
+            # Drop the incomplete record left by an interrupted write
+            nb_complete_records = len(read_result_log(filename))
+            if nb_records > nb_complete_records:
+                nb_records = nb_complete_records
+            self.file = open(filename, "r+b")
+            self.file.truncate(len(RESULT_LOG_HEADER)
+                               + nb_records * RESULT_DTYPE.itemsize)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.file = open(filename, "wb")
+            self.file.write(RESULT_LOG_HEADER)
+            self.file.flush()
+    
+    def append(self, generation, accepted_fitness, proposed_fitness,
+               accepted, event_type, genome_size, event_position=-1,
+               event_position2=-1):
+        """Add the record of a generation."""
+        self.buffer[self.nb_buffered] = (generation, accepted_fitness,
+                                         proposed_fitness, accepted,
+                                         EVENT_TYPES.index(event_type),
+                                         genome_size, event_position,
+                                         event_position2)
+        self.nb_buffered += 1
+        if self.nb_buffered == self.flush_interval:
+            self.flush()
+    
+    def flush(self):
+        """Write the buffered records."""
+        self.file.write(self.buffer[:self.nb_buffered].tobytes())
+        self.nb_buffered = 0
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+    
+    def close(self):
+        """Write the buffered records and close the file."""
+        self.flush()
+        self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_result_log(filename):
+    """
+    Read a log written by ResultLog.
+    
+    The file is memory-mapped: records are only loaded when accessed, so
+    slices of very long runs can be read without loading the whole log.
+    
+    Parameters
+    ----------
+    filename : str
+        Path and name of the log file.
+    
+    Returns
+    -------
+    records : Numpy array
+        1-D structured array of RESULT_DTYPE, one record per generation.
+    """
+    
+    with open(filename, "rb") as log:
+        if log.read(len(RESULT_LOG_HEADER)) != RESULT_LOG_HEADER:
+            raise ValueError(filename + " is not a result log")
+    nb_records = ((os.path.getsize(filename) - len(RESULT_LOG_HEADER))
+                  // RESULT_DTYPE.itemsize)
+    if nb_records == 0:
+        return np.zeros(0, dtype=RESULT_DTYPE)
+    return np.memmap(filename, dtype=RESULT_DTYPE, mode="r",
+                     offset=len(RESULT_LOG_HEADER), shape=(nb_records,))
+
+
+def read_result_dataframe(filename):
+    """
+    Read a log written by ResultLog as a pandas DataFrame.
+    
+    Requires pandas (table extra).
+    
+    Parameters
+    ----------
+    filename : str
+        Path and name of the log file.
+    
+    Returns
+    -------
+    results : pandas DataFrame
+        One line per generation, indexed by generation, with event types
+        as strings.
+    """
+    
+    import pandas as pd
+    results = pd.DataFrame(np.asarray(read_result_log(filename)))
+    results["event_type"] = np.array(EVENT_TYPES)[results["event_type"]]
+    return results.set_index("generation")
+
+
+def result_log_to_csv(log_filename, csv_filename, chunk_size=100000):
+    """
+    Export a result log as a csv file, one line per generation.
+    
+    Parameters
+    ----------
+    log_filename : str
+        Path and name of the log file.
+    csv_filename : str
+        Path and name of the csv file.
+    chunk_size : int, optional
+        Number of records converted at once.
+    """
+    
+    records = read_result_log(log_filename)
+    event_names = np.array(EVENT_TYPES)
+    with open(csv_filename, "w") as csv:
+        csv.write("generation,system fitness,proposed fitness,accepted,"
+                  "event type,genome size,event position,"
+                  "event position 2\n")
+        for first in range(0, len(records), chunk_size):
+            chunk = records[first:first+chunk_size]
+            columns = [chunk["generation"].astype(str),
+                       chunk["accepted_fitness"].astype(str),
+                       chunk["proposed_fitness"].astype(str),
+                       np.where(chunk["accepted"], "accepted", "rejected"),
+                       event_names[chunk["event_type"]],
+                       chunk["genome_size"].astype(str),
+                       chunk["event_position"].astype(str),
+                       chunk["event_position2"].astype(str)]
+            csv.write("".join(",".join(row) + "\n" for row in zip(*columns)))
+
+
+def result_log_history(records):
+    """
+    Convert result log records to the results lists of evolution.
+    
+    Parameters
+    ----------
+    records : Numpy array
+        Records of RESULT_DTYPE (see read_result_log).
+    
+    Returns
+    -------
+    accepted_fitnesses, proposed_fitnesses, accepted_status, all_types
+        Results lists of evolution, for these records.
+    
+    >>> records = np.zeros(2, dtype=RESULT_DTYPE)
+    >>> records["accepted_fitness"] = [.5, .5]
+    >>> records["proposed_fitness"] = [.5, .25]
+    >>> records["accepted"] = [True, False]
+    >>> records["event_type"] = [0, 3]
+    >>> result_log_history(records)
+    ([0.5, 0.5], [0.5, 0.25], ['accepted', 'rejected'], ['initial', 'inversion'])
     """
     
-    for k, filename in enumerate(PARAMS[:-1]):
-        with open(filename, "r") as read_file:
-            with open(PARAMS[-1][k], "w") as write_file:
-                write_file.write(read_file.read())
+    return (records["accepted_fitness"].tolist(),
+            records["proposed_fitness"].tolist(),
+            np.where(records["accepted"], "accepted", "rejected").tolist(),
+            np.array(EVENT_TYPES)[records["event_type"]].tolist())
   
   
 #=======================================================================
@@ -270,10 +724,366 @@ def pos_out_from_pos_lists(genes_start_pos, genes_end_pos, barriers_pos):
                                 barriers_pos)))
     # First interval is from the last coding position to the first one
     # as the genome is circular
-    out_positions = np.array([limits[-1], limits[0]])
-    for k in range(1, len(limits)-1, 2):
-        out_positions = np.vstack((out_positions, [limits[k], limits[k+1]]))
-    return out_positions
+    return np.vstack(([limits[-1], limits[0]], limits[1:-1].reshape(-1, 2)))
+
+
+class FreeIntervals:
+    """
+    Index of the open intervals of a genome containing no gene nor barrier.
+    
+    The index keeps the sorted gene bounds and barriers (barriers counted
+    twice), so that interval k>0 is (limits[2k-1], limits[2k]), and
+    interval 0 is the one crossing the origin, (limits[-1], limits[0]).
+    It is updated after an event without sorting again: an indel shifts
+    the limits after its position, and an inversion reflects the limits
+    of a contiguous range, which only requires a binary search and
+    slicing. Like Genome, updates return a new index. The cumulative
+    number of positions inside the intervals, at least distance
+    nucleotides away from their bounds, is updated along with the limits:
+    PositionSampler draws mutation positions from it.
+    
+    Parameters
+    ----------
+    genome_size : int
+        Genome size in base pair.
+    limits : Numpy array
+        Sorted array of ints of gene bounds and barriers (counted twice).
+    cumulative_lengths : Numpy array, optional
+        Cumulative number of positions inside intervals, if already known.
+    distance : int, optional
+        Minimal distance to the bounds of the positions counted in
+        cumulative_lengths (1 for all the positions inside intervals).
+    
+    >>> index = FreeIntervals.from_pos_lists(100, [10, 60], [20, 50], [80])
+    >>> index.cumulative_lengths
+    array([29, 58, 77])
+    >>> index.with_distance(10).with_indel(30, 6).cumulative_lengths
+    array([11, 28, 29])
+    >>> index.with_indel(30, 6).out
+    array([[86, 10],
+           [20, 56],
+           [66, 86]])
+    >>> index.with_inversion(30, 70).out
+    array([[80, 10],
+           [20, 40],
+           [50, 80]])
+    """
+    
+    __slots__ = ("genome_size", "limits", "distance", "_cumulative_lengths",
+                 "_out")
+    
+    def __init__(self, genome_size, limits, cumulative_lengths=None,
+                 distance=1):
+        self.genome_size = int(genome_size)
+        self.limits = limits
+        self.distance = distance
+        self._cumulative_lengths = cumulative_lengths
+        self._out = None
+    
+    @classmethod
+    def from_pos_lists(cls, genome_size, genes_start_pos, genes_end_pos,
+                       barriers_pos):
+        """Build the index of a genome from its positions."""
+        return cls(genome_size, np.sort(np.hstack((genes_start_pos,
+                                                   genes_end_pos,
+                                                   barriers_pos,
+                                                   barriers_pos))))
+    
+    @classmethod
+    def from_out(cls, genome_size, out):
+        """Build the index from intervals given by pos_out_from_pos_lists."""
+        return cls(genome_size, np.hstack(([out[0][1]], np.ravel(out[1:]),
+                                           [out[0][0]])))
+    
+    @property
+    def out(self):
+        """2-D array of ints, one line per interval (see
+        pos_out_from_pos_lists)."""
+        if self._out is None:
+            limits = self.limits
+            self._out = np.vstack(([limits[-1], limits[0]],
+                                   limits[1:-1].reshape(-1, 2)))
+        return self._out
+    
+    def with_distance(self, distance):
+        """Return the index counting positions at least distance
+        nucleotides away from the bounds."""
+        if distance == self.distance:
+            return self
+        return FreeIntervals(self.genome_size, self.limits,
+                             distance=distance)
+    
+    def lengths(self, first=0, last=None):
+        """Number of positions inside intervals first to last (excluded),
+        at least distance nucleotides away from their bounds."""
+        limits = self.limits
+        if last is None:
+            last = len(limits) // 2
+        lower = max(first, 1)
+        lengths = (limits[2*lower:2*last:2] - limits[2*lower-1:2*last-1:2]
+                   - 1)
+        if first == 0:
+            # Interval crossing the origin
+            lengths = np.hstack((abs(self.genome_size - limits[-1]
+                                     + limits[0] - 1), lengths))
+        return np.maximum(lengths - 2 * (self.distance - 1), 0)
+    
+    @property
+    def cumulative_lengths(self):
+        """Cumulative number of positions inside intervals (see lengths),
+        used to sample an interval with a probability proportional to its
+        length."""
+        if self._cumulative_lengths is None:
+            self._cumulative_lengths = np.cumsum(self.lengths())
+        return self._cumulative_lengths
+    
+    def interval_index(self, position):
+        """Index of the interval containing given free position."""
+        k = np.searchsorted(self.limits, position)
+        if k == 0 or k == len(self.limits):
+            return 0
+        return k // 2
+    
+    def with_indel(self, indel_pos, shift):
+        """Return the index after an indel (see shift_positions)."""
+        k = np.searchsorted(self.limits, indel_pos)
+        limits = np.hstack((self.limits[:k], self.limits[k:] + shift))
+        index = FreeIntervals(self.genome_size + shift, limits,
+                              distance=self.distance)
+        if self._cumulative_lengths is not None:
+            # Only the interval containing the indel changes length
+            interval = self.interval_index(indel_pos)
+            cumulative_lengths = self._cumulative_lengths.copy()
+            cumulative_lengths[interval:] += (
+                    index.lengths(interval, interval+1)[0]
+                    - self.lengths(interval, interval+1)[0])
+            index._cumulative_lengths = cumulative_lengths
+        return index
+    
+    def with_inversion(self, inversion_start, inversion_end):
+        """Return the index after an inversion (see invert_positions)."""
+        if inversion_end < inversion_start:
+            # The inverted segment crosses the origin
+            return FreeIntervals(self.genome_size, np.sort(invert_positions(
+                    self.limits, inversion_start, inversion_end,
+                    self.genome_size)), distance=self.distance)
+        first = np.searchsorted(self.limits, inversion_start, "right")
+        last = np.searchsorted(self.limits, inversion_end, "left")
+        # Reflected limits are in reverse order
+        limits = np.hstack((self.limits[:first],
+                            (inversion_start + inversion_end
+                             - self.limits[first:last])[::-1],
+                            self.limits[last:]))
+        index = FreeIntervals(self.genome_size, limits,
+                              distance=self.distance)
+        if self._cumulative_lengths is not None:
+            first_interval = self.interval_index(inversion_start)
+            last_interval = self.interval_index(inversion_end)
+            if 0 < first_interval <= last_interval:
+                # The total length of the inverted intervals is unchanged
+                cumulative_lengths = self._cumulative_lengths.copy()
+                cumulative_lengths[first_interval:last_interval+1] = (
+                        self._cumulative_lengths[first_interval-1]
+                        + np.cumsum(index.lengths(first_interval,
+                                                  last_interval+1)))
+                index._cumulative_lengths = cumulative_lengths
+        return index
+
+
+def gene_orientations(genome_size, genes_start_pos, genes_end_pos):
+    """Compute the orientation of each gene.
+    
+    A gene is oriented "+" if it ends after its start, unless it is longer
+    than half of the genome, in which case it crosses the origin.
+    
+    Parameters
+    ----------
+    genome_size : int
+        Genome size in base pair.
+    genes_start_pos : Numpy array
+        Array of ints representing the begining position of genes.
+    genes_end_pos : Numpy array
+        Array of ints representing the ending position of genes.
+    
+    Returns
+    -------
+    orientations : Numpy array
+        Array of str, "+" or "-" for each gene.
+    
+    >>> gene_orientations(100, np.array([10, 30, 95]), np.array([20, 25, 5]))
+    array(['+', '-', '+'], dtype='<U1')
+    """
+    
+    size = np.asarray(genes_end_pos) - np.asarray(genes_start_pos)
+    forward = (((size > 0) & (size <= genome_size / 2))
+               | (size <= -genome_size / 2))
+    return np.where(forward, "+", "-")
+
+
+class Genome:
+    """
+    Positions of the genes and barriers of a genome.
+    
+    Gene starts, gene ends and barriers are views on a single contiguous
+    array of ints. Genomes are never modified in place: mutations return a
+    new genome, so a genome can be shared (between a chain and its
+    proposals, or between processes) without being copied; the positions
+    array is read-only so that the derived data cannot go stale. Derived data
+    (orientations, sorted limits, free intervals) are computed on first
+    use and kept with the positions they describe; the free intervals of a
+    mutated genome are derived from the ones of its parent (see
+    FreeIntervals).
+    
+    Parameters
+    ----------
+    size : int
+        Genome size in base pair.
+    genes_start_pos : Numpy array
+        Array of ints representing the begining position of genes.
+    genes_end_pos : Numpy array
+        Array of ints representing the ending position of genes.
+    barriers_pos : Numpy array
+        Array of ints representing the position of barriers.
+    out : Numpy array, optional
+        Free intervals of the genome, if already known (see
+        pos_out_from_pos_lists).
+    
+    >>> genome = Genome(100, [10, 60], [20, 50], [80])
+    >>> genome.end
+    array([20, 50])
+    >>> genome.with_indel(30, 5).end
+    array([20, 55])
+    >>> genome.out
+    array([[80, 10],
+           [20, 50],
+           [60, 80]])
+    >>> genome.start[0] = 30
+    Traceback (most recent call last):
+        ...
+    ValueError: assignment destination is read-only
+    """
+    
+    __slots__ = ("size", "positions", "nb_genes", "_orientations",
+                 "_intervals", "_sampler")
+    
+    def __init__(self, size, genes_start_pos, genes_end_pos, barriers_pos,
+                 out=None):
+        self.size = int(size)
+        self.positions = np.concatenate((genes_start_pos, genes_end_pos,
+                                         barriers_pos)).astype(int)
+        self.positions.flags.writeable = False
+        self.nb_genes = len(genes_start_pos)
+        self._orientations = None
+        self._intervals = None
+        self._sampler = None
+        if out is not None:
+            self._intervals = FreeIntervals.from_out(size, out)
+    
+    @classmethod
+    def from_positions(cls, size, positions, nb_genes, intervals=None,
+                       copy=True):
+        """Build a genome from the array of its gene starts, gene ends and
+        barriers. The genome works on a read-only copy of positions; with
+        copy=False, it takes the array itself (owned by no one else), which
+        is made read-only.
+        
+        >>> positions = np.array([10, 60, 20, 50, 80])
+        >>> Genome.from_positions(100, positions, 2).end
+        array([20, 50])
+        >>> positions.flags.writeable
+        True
+        """
+        genome = cls.__new__(cls)
+        genome.size = int(size)
+        if copy:
+            positions = np.array(positions, dtype=int)
+        positions.flags.writeable = False
+        genome.positions = positions
+        genome.nb_genes = nb_genes
+        genome._orientations = None
+        genome._intervals = intervals
+        genome._sampler = None
+        return genome
+    
+    @property
+    def start(self):
+        """Positions of gene starts."""
+        return self.positions[:self.nb_genes]
+    
+    @property
+    def end(self):
+        """Positions of gene ends."""
+        return self.positions[self.nb_genes:2*self.nb_genes]
+    
+    @property
+    def barriers(self):
+        """Positions of topological barriers."""
+        return self.positions[2*self.nb_genes:]
+    
+    @property
+    def orientations(self):
+        """Orientation of each gene (see gene_orientations)."""
+        if self._orientations is None:
+            self._orientations = gene_orientations(self.size, self.start,
+                                                   self.end)
+        return self._orientations
+    
+    @property
+    def intervals(self):
+        """Index of the free intervals (see FreeIntervals)."""
+        if self._intervals is None:
+            self._intervals = FreeIntervals.from_pos_lists(
+                    self.size, self.start, self.end, self.barriers)
+        return self._intervals
+    
+    @property
+    def limits(self):
+        """Sorted positions of gene bounds, with barriers counted twice."""
+        return self.intervals.limits
+    
+    @property
+    def out(self):
+        """Open intervals containing no gene nor barrier (see
+        pos_out_from_pos_lists)."""
+        return self.intervals.out
+    
+    def sampler(self, u):
+        """Sampler of mutation positions at least u nucleotides away from
+        genes and barriers (see PositionSampler)."""
+        if self._sampler is None or self._sampler[0] != u:
+            # The index then keeps the counts of the sampler up to date in
+            # the mutated genomes
+            self._intervals = self.intervals.with_distance(max(u, 1))
+            self._sampler = (u, PositionSampler.from_intervals(
+                    self._intervals, u))
+        return self._sampler[1]
+    
+    def as_tuple(self):
+        """Return genome size, gene starts, gene ends and barriers."""
+        return self.size, self.start, self.end, self.barriers
+    
+    def with_indel(self, indel_pos, shift):
+        """Return the genome after an indel (see shift_positions)."""
+        intervals = None
+        if self._intervals is not None:
+            intervals = self._intervals.with_indel(indel_pos, shift)
+        return Genome.from_positions(self.size + shift,
+                                     shift_positions(self.positions,
+                                                     indel_pos, shift),
+                                     self.nb_genes, intervals, copy=False)
+    
+    def with_inversion(self, inversion_start, inversion_end):
+        """Return the genome after an inversion (see invert_positions)."""
+        intervals = None
+        if self._intervals is not None:
+            intervals = self._intervals.with_inversion(inversion_start,
+                                                       inversion_end)
+        return Genome.from_positions(self.size,
+                                     invert_positions(self.positions,
+                                                      inversion_start,
+                                                      inversion_end,
+                                                      self.size),
+                                     self.nb_genes, intervals, copy=False)
 
 
 def expression_simulation(params_file, out_file, gene_start_pos):
@@ -306,144 +1116,274 @@ def expression_simulation(params_file, out_file, gene_start_pos):
     # Open the output file of previous command to get the expression
     # profile
     with open(out_file, "r") as out:
-        file_content = out.read()
-        transcript_nbs = re.findall("Transcript ID [0-9]+ : ([0-9]+)",
-                                    file_content)
-        transcript_nbs = np.asarray(transcript_nbs, dtype=int)
-        # Transcripts are reindexed, we fetch their starting position to map
-        # transcription values to the right gene.
-        # (This issue was fixed in the last version of 
-        # start_simulation.py by its author. This code is compatible
-        # with both versions)
-        starts = re.findall("\n[0-9] +[0-9] +[0-9] +[\-0-9]+ +([0-9]+)",
-                            file_content)
-        starts = np.asarray(starts, dtype=int)
-    # Reorder transcription values
-    transcription_values = np.full(len(starts), np.nan)
-    for k, start_pos in enumerate(gene_start_pos):
-        transcript_id, = np.where(starts == start_pos)
-        transcription_values[k] = transcript_nbs[transcript_id[0]]
-    return transcription_values
-
-
-def compute_fitness(observed_transcript_numbers, target_frequencies):
-    """Compute the fitness of an individual with given gene expression pattern
-    in given environment.
+        records = read_transcript_records(out.read())
+    return map_transcripts(records, gene_start_pos)
+
+
+# Structured simulation result: one record per transcription unit
+TRANSCRIPT_DTYPE = np.dtype([("start", np.int64),
+                             ("transcripts", np.float64)])
+# Transcription unit table (TU index, ..., strand, start) and transcript
+# counts printed by the simulation
+TU_PATTERN = re.compile(r"^[0-9]+ +[0-9]+ +[0-9]+ +[\-0-9]+ +([0-9]+)",
+                        re.MULTILINE)
+TRANSCRIPT_PATTERN = re.compile("Transcript ID [0-9]+ : ([0-9]+)")
+
+
+def read_transcript_records(file_content):
+    """Extract the transcript records from a simulation printed output.
     
     Parameters
     ----------
-    observed_transcript_numbers : Numpy array
-        Array of ints representing the observed number of transcripts for each
-        gene of the invidual.
-    target_frequencies : Numpy array
-        Array of floats representing target relative expression level for each
-        gene (environment).
-    
+    file_content : str
+        Text printed by the transcription simulation.
+        
     Returns
     -------
-    fitnness : float
-        computed fitness of the invidual, following the formula:
-            .. math::
-            	fitness =  \exp\left(-\sum\left|\ln\left(\\frac{observed\_for\_gene\_i}{target\_for\_gene\_i}\\right)\\right|\\right)
+    records : Numpy array
+        Array of TRANSCRIPT_DTYPE, the start position and number of
+        transcripts of each transcription unit, in the printed order.
+    
+    >>> text = "".join("%d  1  1  -1 %d\\n" % (k, 100 * k) for k in range(12))
+    >>> text += "".join("Transcript ID %d : %d\\n" % (k, k) for k in range(12))
+    >>> read_transcript_records(text)[-2:]
+    array([(1000, 10.), (1100, 11.)],
+          dtype=[('start', '<i8'), ('transcripts', '<f8')])
     """
     
-    observed_frequencies = (observed_transcript_numbers
-                            / np.sum(observed_transcript_numbers))
-    ln_freqs = np.log(observed_frequencies / target_frequencies)
-    return np.exp(-np.sum(np.abs(ln_freqs)))
+    starts = TU_PATTERN.findall(file_content)
+    transcript_nbs = TRANSCRIPT_PATTERN.findall(file_content)
+    if len(starts) != len(transcript_nbs):
+        raise ValueError("simulation output lists " + str(len(starts))
+                         + " transcription units but "
+                         + str(len(transcript_nbs)) + " transcript counts")
+    records = np.empty(len(starts), dtype=TRANSCRIPT_DTYPE)
+    records["start"] = np.asarray(starts, dtype=np.int64)
+    records["transcripts"] = np.asarray(transcript_nbs, dtype=np.float64)
+    return records
 
 
-#=======================================================================
-#                   GENERATE MUTATIONS
-#=======================================================================
-def sample(out, Ngen, u):
-    """
-    Sample a location from a given list of intervals that satisfies the "distance to bounds condition" 
-    (there is at least u nucleotides between the right and left bound and the sampled mutation position)
-    This allows a deletion to happen without being to close to a gene or barrier.
+def map_transcripts(records, gene_start_pos):
+    """Order the number of transcripts by gene.
+    
+    Transcription units are reindexed by the simulation, they are matched
+    to genes by their start position.
     
     Parameters
     ----------
-    out : Python list
-        list of the open position intervals in the genome where there are not any genes   
-    Ngen : int
-        the length of the genome
-    u : int
-        unit of length of nucleotides.
+    records : Numpy array
+        Array of TRANSCRIPT_DTYPE (see read_transcript_records).
+    gene_start_pos : Numpy array
+        Array of ints representing the begining position of genes.
         
     Returns
     -------
-    mut_pos : int
-        sampled location of the mutation
-    """
+    transcript_numbers : Numpy array
+        Array of floats representing the number of transcripts for each
+        gene, ordered by gene ID.
     
-    space = False # Used to make sure there is enough space between the right and left bound and the sampled mutation position
-    i=100 # Max number of iterations
-    
-    while (not space):
-        # Repeat until we find a mutation position that satisfies the distance to the bounds condition
-        # or until we have repeated this loop a 100 times
-        ### Sample the interval
-        ## For each interval, calculate the probability to sample from it
-        N = 0 # Total length of the intervals
-        intlen = [] # List of the cummulative length of each intervals
-        for x in out:
-            a = x[0] # Left bound of the interval xout_positions[i][1]
-            b = x[1] # Right boud of x
-            if a>b:
-                # Then x is the last interval of the plasmid with b after the first position of the genome
-                xlen = abs(Ngen - a + b - 1)
-                N += xlen
-                intlen.append(N)
-            else:
-                xlen = b-a-1 # Length of the interval
-                N += xlen
-                intlen.append(N)
-        probas = np.array(intlen)/N # List of the cummulative probabilities to sample in each interval
-        ## Sample the interval
-        p = np.random.uniform(0,1) # Draw a random number between 0 and 1
-        sint = min(np.where(p<probas)[0]) # Index of the sampled interval
-    
-        ### Sample the exact location of the mutation
-        a = out[sint][0]
-        b = out[sint][1]
-
-        if a>b:
-            # Then the selected interval is the last interval of the plasmid with b after the first position of the genome
-            mut_pos = np.random.randint(a+1, Ngen+b) # Sample the location of the mutation
-            if mut_pos > Ngen:
-                # Then the sampled position is located after the first position of the plasmid
-                
-                if (mut_pos <= Ngen + out[sint][1] - u) and (mut_pos >= out[sint][0] + u):
-                    # There is enough space between the right and left bound and the sampled mutation position
-                    space = True
-                    mut_pos = mut_pos - Ngen
-                   
-        else:
-            mut_pos = np.random.randint(a+1, b) # Sample the location of the mutation
-            if (mut_pos <= out[sint][1] - u) and (mut_pos >= out[sint][0] + u):
-                # There is enough space between the right and left bound and the sampled mutation position
-                space = True
-            
-        i-=1
-        if i==0:
-            raise RuntimeError("A mutation position that that satisfies the distance to the bounds condition was not found")
+    >>> records = np.array([(50, 3.), (10, 7.)], dtype=TRANSCRIPT_DTYPE)
+    >>> map_transcripts(records, [10, 50])
+    array([7., 3.])
+    """
     
-    return mut_pos
+    gene_start_pos = np.asarray(gene_start_pos)
+    order = np.argsort(records["start"], kind="stable")
+    sorted_starts = records["start"][order]
+    index = np.searchsorted(sorted_starts, gene_start_pos)
+    index[index == len(sorted_starts)] = 0
+    if len(gene_start_pos) and (len(sorted_starts) == 0 or np.any(
+            sorted_starts[index] != gene_start_pos)):
+        raise ValueError("genes without transcription unit in the "
+                         "simulation output")
+    return records["transcripts"][order[index]]
 
 
-def evolutive_event(discret_step, inversion_proba, genome_size,
-                    genes_start_pos, genes_end_pos, barriers_pos,
-                    out_positions, p_insertion):
-    """Generate an evolutive event on given genome.
+#=======================================================================
+#                   SIMULATOR BACKENDS
+#=======================================================================
+class SimulatorBackend:
+    """
+    Transcription simulator used to evaluate a genome.
     
-    The event can either be a genome inversion (with probability inversion_proba),
-    or an indel. An indel is an insertion with probability p_insertion
+    A backend receives the genome as in-memory position arrays and returns
+    the number of transcripts of each gene. TwisTranscripT reads the genome
+    from the files referenced by its parameter file, so the genome is first
+    written to genome_files (if given) before running the simulation.
+    Subclasses implement `run`. The duration of the stages of the last
+    simulation (in seconds) is kept in the stage_timings dict. The
+    random state of the simulation (random_state) is set with `seed`, and
+    kept by the simulator rather than in the global NumPy random state.
+    The copies made by
+    `isolated` keep their tag: the copies of an isolated simulator are
+    nested in its own sub-folder, so that concurrent runs each keep their
+    workers apart.
     
     Parameters
     ----------
-    inversion_proba : float
-        Probability for the event to be an inversion.
+    params_file : str
+        Path and name of the parameters file given to the simulation.
+    genome_files : list of str, optional
+        Names of the .gff, TSS, TTS and barrier files referenced by
+        params_file. If None, the files are used as they are.
+    """
+    
+    # Tag of the isolated copy, None for the original simulator
+    tag = None
+    # Random state of the simulations, None until seeded
+    random_state = None
+    
+    def __init__(self, params_file, genome_files=None):
+        self.params_file = params_file
+        self.genome_files = genome_files
+        self.stage_timings = {}
+    
+    def simulate(self, genome_size, genes_start_pos, genes_end_pos,
+                 barriers_pos):
+        """Simulate the expression of given genome.
+        
+        Parameters
+        ----------
+        genome_size : int
+            Genome size in base pair.
+        genes_start_pos : Numpy array
+            Array of ints representing the begining position of genes.
+        genes_end_pos : Numpy array
+            Array of ints representing the ending position of genes.
+        barriers_pos : Numpy array
+            Array of ints representing the position of barriers.
+        
+        Returns
+        -------
+        transcript_numbers : Numpy array
+            Array of ints representing the number of transcripts for each
+            gene, ordered by gene ID.
+        """
+        
+        self.stage_timings = {}
+        if self.genome_files is not None:
+            start_time = time.perf_counter()
+            update_files(genome_size, genes_start_pos, genes_end_pos,
+                         barriers_pos, *self.genome_files)
+            self.stage_timings["write_files"] = (time.perf_counter()
+                                                 - start_time)
+        return self.run(genes_start_pos)
+    
+    def run(self, gene_start_pos):
+        """Run the simulation on the genome files referenced by params_file.
+        
+        Parameters
+        ----------
+        gene_start_pos : Numpy array
+            Array of ints representing the begining position of genes.
+        
+        Returns
+        -------
+        transcript_numbers : Numpy array
+            Array of ints representing the number of transcripts for each
+            gene, ordered by gene ID.
+        """
+        
+        raise NotImplementedError
+    
+    def simulate_batch(self, genome_sizes, genes_start_pos, genes_end_pos,
+                       barriers_pos):
+        """Simulate the expression of each genome of a batch.
+        
+        Parameters
+        ----------
+        genome_sizes, genes_start_pos, genes_end_pos, barriers_pos : Numpy arrays
+            Genomes of the batch (see batch_indel).
+        
+        Returns
+        -------
+        transcript_numbers : Numpy array
+            2-D array (genomes, genes) of the number of transcripts of
+            each gene.
+        """
+        
+        return np.array([self.simulate(*genome) for genome in
+                         zip(genome_sizes, genes_start_pos, genes_end_pos,
+                             barriers_pos)])
+    
+    def identity(self):
+        """Describe the simulation parameters, for caching.
+        
+        Returns
+        -------
+        identity : bytes
+            Simulator type and parameter file content, without the genome
+            file names (which differ between isolated copies).
+        """
+        
+        identity = type(self).__name__.encode()
+        if self.params_file is not None:
+            with open(self.params_file, "r") as params:
+                lines = params.readlines()
+            genome_lines = genome_file_lines(lines)
+            identity += "".join(line for k, line in enumerate(lines)
+                                if k not in genome_lines).encode()
+        return identity
+    
+    def seed(self, seed_sequence):
+        """Seed the random number generators of the simulation.
+        
+        TwisTranscripT draws from the global NumPy random state: the
+        simulator keeps its own random_state, which InProcessSimulator
+        swaps in for the duration of each simulation. Simulations run in
+        a new process (SubprocessSimulator) are not seeded.
+        
+        Parameters
+        ----------
+        seed_sequence : numpy.random.SeedSequence
+            Seed of the simulations, for instance spawned from the seed of
+            a chain.
+        """
+        
+        self.random_state = np.random.RandomState(
+                np.random.MT19937(seed_sequence))
+    
+    def isolated(self, tag, staging_folder=None):
+        """Return a copy of the simulator working on its own genome files.
+        
+        Parameters
+        ----------
+        tag : str
+            Name of the sub-folder holding the genome files (see
+            isolated_params), inside the one of the simulator if it is
+            itself isolated.
+        staging_folder : str, optional
+            Folder where to write the genome files (see isolated_params).
+        
+        Returns
+        -------
+        simulator : SimulatorBackend
+            Copy of the simulator.
+        """
+        
+        if self.tag is not None:
+            tag = self.tag + "/" + tag
+        PARAMS = isolated_params(self.params_file, tag, staging_folder)
+        simulator = copy.copy(self)
+        simulator.tag = tag
+        simulator.params_file = PARAMS[0]
+        simulator.genome_files = PARAMS[1:5]
+        return simulator
+
+
+class SimulationError(RuntimeError):
+    """Raised when a simulation still fails after all its attempts."""
+
+
+def simulate_genome(simulator, genome_size, genes_start_pos, genes_end_pos,
+                    barriers_pos, max_attempts=3, backoff=0.1,
+                    failures=None):
+    """Simulate the expression of a genome, retrying if it fails.
+    
+    Parameters
+    ----------
+    simulator : SimulatorBackend
+        Simulator used to compute the expression.
     genome_size : int
         Genome size in base pair.
     genes_start_pos : Numpy array
@@ -452,125 +1392,440 @@ def evolutive_event(discret_step, inversion_proba, genome_size,
         Array of ints representing the ending position of genes.
     barriers_pos : Numpy array
         Array of ints representing the position of barriers.
-    out_positions : Numpy array
-        2-D array of ints. Each line represents an open interval containing
-        no gene nor barrier.
-    p_insertion : float
-        Probability for an indel event to be an insertion.
+    max_attempts : int, optional
+        Maximal number of simulations.
+    backoff : float, optional
+        Waiting time before the first retry, in seconds. It doubles at each
+        retry.
+    failures : collections.Counter, optional
+        Counter of failed simulations, incremented under the "error" key.
+    
     Returns
     -------
-    genome_size : ine
-        Updated value of genome_size after the event.
-    genes_start_pos : Numpy array
-        Updated value of genes_start_pos after the event.
-    genes_end_pos : Numpy array
-        Updated value of genes_end_pos after the event.
-    barriers_pos : Numpy array
-        Updated value of barriers_pos after the event.
-    genome_size: int
-        Updated value of the genome size.    
+    transcript_numbers : Numpy array
+        Array of ints representing the number of transcripts for each
+        gene, ordered by gene ID.
+    
+    Raises
+    ------
+    SimulationError
+        If all the attempts failed.
     """
     
-    # Draw a position for the mutation
-    event_position = sample(out_positions, genome_size, discret_step)
-    if np.random.rand() < inversion_proba:
-        # The event will be an inversion
-        # Draw the second position for the mutation
-        event_position2 = sample(out_positions, genome_size, discret_step)
-        return genome_inversion(genome_size, genes_start_pos, genes_end_pos,
-                                barriers_pos, min(event_position,
-                                                  event_position2),
-                                max(event_position, event_position2))
-    else:
-        return indel(discret_step, genome_size, genes_start_pos, genes_end_pos,
-                     barriers_pos, out_positions, p_insertion)
+    for attempt in range(max_attempts):
+        if attempt > 0:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        try:
+            return simulator.simulate(genome_size, genes_start_pos,
+                                      genes_end_pos, barriers_pos)
+        except Exception as error:
+            if failures is not None:
+                failures["error"] += 1
+            last_error = error
+    raise SimulationError("simulation failed " + str(max_attempts)
+                          + " times") from last_error
 
 
-def indel(u, genome_size, genes_start_pos, genes_end_pos, barriers_pos, out_positions, p_insertion):
+class SubprocessSimulator(SimulatorBackend):
     """
-    Delete or insert in the plasmid a unit with length u in base pairs 
+    Simulator running TwisTranscripT in a new python process at each call
+    (see expression_simulation).
     
     Parameters
     ----------
-    u : int
-        Unit of length in base pairs that is deleted or inserted.
-    genome_size : int
-        Genome size in base pairs.
-    genes_start_pos : Numpy array
-        Array of ints representing the begining position of genes.
-    genes_end_pos : Numpy array
-        Array of ints representing the ending position of genes.
-    barriers_pos : Numpy array
-        Array of ints representing the position of barriers.
-    out_positions : Numpy array
-        2-D array of ints. Each line represents an open interval containing
-        no gene nor barrier.
-    p_insertion : float
-        Probability of the event to be an insertion and not a deletion.
-        
-    Returns
-    -------
-    event_type : str
-        Equal to "insertion" or "deletion".
-    new_genes_start_pos : Numpy array
-        Updated value of genes_start_pos after inversion.
-    new_genes_end_pos : Numpy array
-        Updated value of genes_end_pos after inversion.
-    new_barriers_pos : Numpy array
-        Updated value of barriers_pos after inversion.
-    genome_size: int
-        Updated value of the genome size.
+    params_file : str
+        Path and name of the parameters file given to the simulation.
+    genome_files : list of str, optional
+        Names of the .gff, TSS, TTS and barrier files referenced by
+        params_file.
+    out_file : str, optional
+        Path and name of the simulation output file.
     """
     
-    ### Sample the indel position
-    indel_pos = sample(out_positions, genome_size, u)
+    def __init__(self, params_file, genome_files=None, out_file="out.txt"):
+        SimulatorBackend.__init__(self, params_file, genome_files)
+        self.out_file = out_file
+    
+    def run(self, gene_start_pos):
+        start_time = time.perf_counter()
+        transcript_numbers = expression_simulation(self.params_file,
+                                                   self.out_file,
+                                                   gene_start_pos)
+        self.stage_timings["run"] = time.perf_counter() - start_time
+        return transcript_numbers
+
+
+# Serializes the in-process simulations, which replace process-wide state
+_IN_PROCESS_LOCK = threading.Lock()
+
+
+class InProcessSimulator(SimulatorBackend):
+    """
+    Simulator running TwisTranscripT inside the current python process.
     
-    ### Initialize the new positions
-    new_genes_start_pos = np.copy(genes_start_pos)
-    new_genes_end_pos = np.copy(genes_end_pos)
-    new_barriers_pos = np.copy(barriers_pos)
+    The simulation script is executed as if it was the main program, with
+    its printed output captured in memory. Modules it imports (numpy,
+    the TwisTranscripT simulation module) stay loaded between calls, so
+    interpreter startup and imports are paid only once. TwisTranscripT has
+    no entry point taking a genome in memory: the genome files are still
+    written, and read again with params_file, at each call.
     
-    ### Choose whether it is an insertion or a deletion
-    p = np.random.uniform(0,1) # Draw a random number between 0 and 1
-    if p<p_insertion:
-        # It is an insertion
-        event_type = "insertion"
-        for i in range( len(genes_start_pos) ):
-            if genes_start_pos[i] >= indel_pos :
-                # Update gene start positions
-                new_genes_start_pos[i] += u
-            if genes_end_pos[i] >= indel_pos :
-                # Update gene end positions
-                new_genes_end_pos[i] += u
-            if barriers_pos[i] >= indel_pos :
-                # Update barrieres positions
-                new_barriers_pos[i] += u
-        # Update genome size
-        genome_size += u
+    The script runs with the process-wide sys.argv, sys.path, standard
+    output and global NumPy random state replaced (the latter by the
+    random_state of the simulator, see SimulatorBackend.seed), so
+    simulations run by threads of the same process are
+    run one at a time. Use SimulatorPool for simultaneous simulations.
+    
+    Parameters
+    ----------
+    params_file : str
+        Path and name of the parameters file given to the simulation.
+    genome_files : list of str, optional
+        Names of the .gff, TSS, TTS and barrier files referenced by
+        params_file.
+    script : str, optional
+        Path and name of the TwisTranscripT simulation script.
+    """
+    
+    def __init__(self, params_file, genome_files=None,
+                 script="TwisTranscripT/start_simulation.py"):
+        SimulatorBackend.__init__(self, params_file, genome_files)
+        self.script = script
+    
+    def run(self, gene_start_pos):
+        output = io.StringIO()
+        start_time = time.perf_counter()
+        with _IN_PROCESS_LOCK:
+            # The script imports its modules from its own folder
+            script_folder = os.path.dirname(os.path.abspath(self.script))
+            sys.path.insert(0, script_folder)
+            argv = sys.argv
+            sys.argv = [self.script, self.params_file]
+            if self.random_state is None:
+                self.random_state = np.random.RandomState()
+            global_state = np.random.get_state()
+            np.random.set_state(self.random_state.get_state())
+            try:
+                with contextlib.redirect_stdout(output):
+                    runpy.run_path(self.script, run_name="__main__")
+            except SystemExit as exit_status:
+                if exit_status.code:
+                    raise
+            finally:
+                self.random_state.set_state(np.random.get_state())
+                np.random.set_state(global_state)
+                sys.argv = argv
+                sys.path.remove(script_folder)
+        self.stage_timings["run"] = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        records = read_transcript_records(output.getvalue())
+        transcript_numbers = map_transcripts(records, gene_start_pos)
+        self.stage_timings["parse"] = time.perf_counter() - start_time
+        return transcript_numbers
+
+
+class SyntheticSimulator(SimulatorBackend):
+    """
+    Deterministic stand-in for TwisTranscripT, needing no file.
+    
+    The number of transcripts of a gene grows with the free space before
+    its start (one transcript per spacing base pairs), and doubles for
+    genes oriented "+". It is cheap and depends on the layout, which makes
+    it suited to benchmarks and tests of the evolution loop.
+    
+    Parameters
+    ----------
+    spacing : int, optional
+        Number of free base pairs per additional transcript.
+    
+    >>> SyntheticSimulator(10).simulate(100, [10, 60], [20, 50], [80])
+    array([8., 2.])
+    """
+    
+    def __init__(self, spacing=100):
+        SimulatorBackend.__init__(self, None)
+        self.spacing = spacing
+    
+    def identity(self):
+        return ("SyntheticSimulator " + str(self.spacing)).encode()
+    
+    def isolated(self, tag, staging_folder=None):
+        return copy.copy(self)
+    
+    def simulate(self, genome_size, genes_start_pos, genes_end_pos,
+                 barriers_pos):
+        genes_start_pos = np.asarray(genes_start_pos)
+        limits = np.sort(np.hstack((genes_start_pos, genes_end_pos,
+                                    barriers_pos)))
+        # Closest limit before each gene start, on the circular genome
+        previous = limits[np.searchsorted(limits, genes_start_pos) - 1]
+        free_space = (genes_start_pos - previous) % genome_size
+        forward = gene_orientations(genome_size, genes_start_pos,
+                                    genes_end_pos) == "+"
+        return ((1 + free_space // self.spacing)
+                * np.where(forward, 2, 1)).astype(float)
+    
+    def simulate_batch(self, genome_sizes, genes_start_pos, genes_end_pos,
+                       barriers_pos):
+        genome_sizes = np.asarray(genome_sizes)[:, np.newaxis]
+        genes_start_pos = np.asarray(genes_start_pos)
+        limits = np.sort(np.hstack((genes_start_pos, genes_end_pos,
+                                    barriers_pos)), axis=1)
+        # Closest limit before each gene start, with one binary search over
+        # all genomes, offset so that their limits do not overlap
+        nb_limits = limits.shape[1]
+        offsets = (np.arange(len(limits))[:, np.newaxis]
+                   * (genome_sizes.max() + 1))
+        index = np.searchsorted((limits + offsets).ravel(),
+                                (genes_start_pos + offsets).ravel()) - 1
+        rows = np.repeat(np.arange(len(limits)), genes_start_pos.shape[1])
+        # Before the first limit of a genome is its last one
+        index = np.where(index < rows * nb_limits, index + nb_limits, index)
+        previous = limits.ravel()[index].reshape(genes_start_pos.shape)
+        free_space = (genes_start_pos - previous) % genome_sizes
+        forward = gene_orientations(genome_sizes, genes_start_pos,
+                                    genes_end_pos) == "+"
+        return ((1 + free_space // self.spacing)
+                * np.where(forward, 2, 1)).astype(float)
+
+
+#=======================================================================
+#                   SIMULATOR WORKER POOL
+#=======================================================================
+def _simulator_worker(simulator, connection, seed_sequence):
+    # Simulations are independent between workers
+    simulator.seed(seed_sequence)
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        request_id, genome = request
+        try:
+            expression = simulator.simulate(*genome)
+            connection.send((request_id, "result", expression,
+                             simulator.stage_timings))
+        except Exception as error:
+            connection.send((request_id, "error", repr(error), {}))
+
+
+class SimulatorPool:
+    """
+    Long-lived worker processes, each one running simulations with its own
+    simulator.
+    
+    Workers keep the simulator and its imported modules loaded between
+    simulations. Genomes and expressions go through pipes. A simulation
+    raising an error or exceeding the timeout is retried with an
+    exponential backoff. A worker that crashes or times out is replaced.
+    Failures are counted in the failures Counter, under the "error",
+    "timeout" and "crash" keys, and replaced workers under "restart".
+    
+    Parameters
+    ----------
+    simulators : list of SimulatorBackend
+        Simulator of each worker. Simultaneous simulations must not share
+        their genome files (see SimulatorBackend.isolated).
+    timeout : float, optional
+        Maximal duration of a simulation, in seconds. No limit by default.
+    max_attempts : int, optional
+        Maximal number of simulations of a genome.
+    backoff : float, optional
+        Waiting time before the first retry of a genome, in seconds. It
+        doubles at each retry.
+    seeds : list of numpy.random.SeedSequence, optional
+        Seed of each worker (see SimulatorBackend.seed), for instance
+        spawned from the seed of the chain. A replaced worker is seeded
+        with a seed spawned from the previous one. By default, workers are
+        seeded from fresh entropy.
+    
+    >>> with SimulatorPool([SyntheticSimulator(10)]) as pool:
+    ...     pool.simulate([(100, [10, 60], [20, 50], [80])])
+    [array([8., 2.])]
+    
+    Failures, with a simulator crashing on genomes of 101 bp, hanging on
+    genomes of 102 bp, and raising an error the first time it simulates a
+    genome of 103 bp:
+    
+    >>> class FaultySimulator(SyntheticSimulator):
+    ...     has_failed = False
+    ...     def simulate(self, genome_size, *positions):
+    ...         if genome_size == 103 and not self.has_failed:
+    ...             self.has_failed = True
+    ...             raise ValueError("first simulation")
+    ...         if genome_size == 101:
+    ...             os._exit(1)
+    ...         if genome_size == 102:
+    ...             time.sleep(60)
+    ...         return SyntheticSimulator.simulate(self, genome_size,
+    ...                                            *positions)
+    >>> genome = ([10, 60], [20, 50], [80])
+    >>> with SimulatorPool([FaultySimulator(10)], timeout=.5,
+    ...                    max_attempts=2, backoff=0.) as pool:
+    ...     pool.simulate([(103,) + genome])
+    ...     for genome_size in [101, 102]:
+    ...         try:
+    ...             pool.simulate([(genome_size,) + genome])
+    ...         except SimulationError as error:
+    ...             print(error)
+    ...     # Simulations go on with a new worker
+    ...     pool.simulate([(100,) + genome])
+    [array([8., 2.])]
+    simulation failed 2 times, last failure: crash
+    simulation failed 2 times, last failure: timeout
+    [array([8., 2.])]
+    >>> sorted(pool.failures.items())
+    [('crash', 2), ('error', 1), ('restart', 4), ('timeout', 2)]
+    """
+    
+    def __init__(self, simulators, timeout=None, max_attempts=3,
+                 backoff=0.1, seeds=None):
+        self.simulators = simulators
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        if seeds is None:
+            seeds = np.random.SeedSequence().spawn(len(simulators))
+        self.seeds = list(seeds)
+        self.failures = collections.Counter()
+        self.stage_timings = [{} for simulator in simulators]
+        self._next_request = 0
+        self._workers = [None] * len(simulators)
+        for k in range(len(simulators)):
+            self._start(k)
+    
+    def _start(self, k):
+        connection, worker_connection = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+                target=_simulator_worker,
+                args=(self.simulators[k], worker_connection, self.seeds[k]),
+                daemon=True)
+        process.start()
+        worker_connection.close()
+        self._workers[k] = (process, connection)
+    
+    def _restart(self, k):
+        process, connection = self._workers[k]
+        process.kill()
+        process.join()
+        connection.close()
+        self.failures["restart"] += 1
+        # The replaced worker does not repeat the random draws of the
+        # previous one
+        self.seeds[k] = self.seeds[k].spawn(1)[0]
+        self._start(k)
+    
+    def _send(self, k, genome):
+        # Request ids let late answers of an abandoned request be ignored
+        self._next_request += 1
+        try:
+            self._workers[k][1].send((self._next_request, genome))
+        except (BrokenPipeError, EOFError):
+            self.failures["crash"] += 1
+            self._restart(k)
+            self._workers[k][1].send((self._next_request, genome))
+        return self._next_request
+    
+    def simulate(self, genomes):
+        """Simulate the expression of genomes, at the same time.
         
-    else:
-        # It is a deletion
-        event_type = "deletion"        
-        for i in range( len(genes_start_pos) ):        
-            if genes_start_pos[i] >= indel_pos :
-                # Update gene start positions
-                new_genes_start_pos[i] -= u
-            if genes_end_pos[i] >= indel_pos :
-                # Update gene end positions
-                new_genes_end_pos[i] -= u
-            if barriers_pos[i] >= indel_pos :
-                # Update barrieres positions
-                new_barriers_pos[i] -= u
-        # Update genome size
-        genome_size -= u
+        Parameters
+        ----------
+        genomes : list of tuples
+            Genome size, gene start positions, gene end positions and
+            barrier positions of each genome, at most one per worker.
+        
+        Returns
+        -------
+        expressions : list of Numpy arrays
+            Number of transcripts of each gene, for each genome.
+        
+        Raises
+        ------
+        SimulationError
+            If a genome failed max_attempts times.
+        """
+        
+        expressions = [None] * len(genomes)
+        attempts = [0] * len(genomes)
+        requests = {}
+        deadlines = {}
+        for k, genome in enumerate(genomes):
+            requests[k] = self._send(k, genome)
+            if self.timeout is not None:
+                deadlines[k] = time.monotonic() + self.timeout
+        while requests:
+            connections = {self._workers[k][1]: k for k in requests}
+            wait_time = None
+            if self.timeout is not None:
+                wait_time = max(0, min(deadlines[k] for k in requests)
+                                - time.monotonic())
+            failed = {}
+            for connection in multiprocessing.connection.wait(
+                    list(connections), wait_time):
+                k = connections[connection]
+                try:
+                    request_id, status, value, timings = connection.recv()
+                except EOFError:
+                    self._restart(k)
+                    failed[k] = "crash"
+                    continue
+                if request_id != requests[k]:
+                    continue
+                if status == "result":
+                    expressions[k] = value
+                    self.stage_timings[k] = timings
+                    del requests[k]
+                else:
+                    failed[k] = status
+            if self.timeout is not None:
+                now = time.monotonic()
+                for k in requests:
+                    if k not in failed and deadlines[k] <= now:
+                        self._restart(k)
+                        failed[k] = "timeout"
+            for k, status in failed.items():
+                self.failures[status] += 1
+                attempts[k] += 1
+                if attempts[k] >= self.max_attempts:
+                    raise SimulationError(
+                            "simulation failed " + str(attempts[k])
+                            + " times, last failure: " + status)
+                time.sleep(self.backoff * 2 ** (attempts[k] - 1))
+                requests[k] = self._send(k, genomes[k])
+                if self.timeout is not None:
+                    deadlines[k] = time.monotonic() + self.timeout
+        return expressions
     
-    return (event_type, genome_size, new_genes_start_pos, new_genes_end_pos,
-            new_barriers_pos)
+    def close(self):
+        """Stop the workers."""
+        for process, connection in self._workers:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, EOFError):
+                pass
+        for process, connection in self._workers:
+            process.join(1)
+            if process.is_alive():
+                process.kill()
+                process.join()
+            connection.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exception):
+        self.close()
 
 
-def genome_inversion(genome_size, genes_start_pos, genes_end_pos, barriers_pos,
-                     inversion_start, inversion_end):        
-    """Perform a genome innversion on given genome at given positions.
+#=======================================================================
+#                   CACHE SIMULATION RESULTS
+#=======================================================================
+def genome_key(genome_size, genes_start_pos, genes_end_pos, barriers_pos,
+               identity=b""):
+    """Compute a canonical hash of a genome layout.
     
     Parameters
     ----------
@@ -582,107 +1837,2298 @@ def genome_inversion(genome_size, genes_start_pos, genes_end_pos, barriers_pos,
         Array of ints representing the ending position of genes.
     barriers_pos : Numpy array
         Array of ints representing the position of barriers.
-    inversion_start : int
-        Position of the beginning of the inversion in the genome.
-    inversion_end : int
-        Position of the end of the inversion in the genome.
+    identity : bytes, optional
+        Simulation parameters (see SimulatorBackend.identity).
     
     Returns
     -------
-    event_type : str
-        Always equal to "inversion"
-    genome_size : int
-        Unchanged value of genome_size.
-    genes_start_pos : Numpy array
-        Updated value of genes_start_pos after inversion.
-    genes_end_pos : Numpy array
-        Updated value of genes_end_pos after inversion.
-    barriers_pos : Numpy array
-        Updated value of barriers_pos after inversion.
-        
-    Notes
-    -----
-    inversion_start and inversion_end must not be inside a gene.
-    inversion_end must be greater than inversion_start.
-    """
-    
-    # Copy lists to avoid modifying them
-    new_genes_start_pos = np.copy(genes_start_pos)
-    new_genes_end_pos = np.copy(genes_end_pos)
-    new_barriers_pos = np.copy(barriers_pos)
-    # Update them
-    for new_array in [new_genes_start_pos, new_genes_end_pos,
-                      new_barriers_pos]:
-        for (k, position) in enumerate(new_array):
-            # Perform the inversion
-            if (position > inversion_start) and (position < inversion_end):
-                new_array[k] = inversion_start + (inversion_end - position)
-    return ("inversion", genome_size, new_genes_start_pos, new_genes_end_pos,
-            new_barriers_pos)
+    key : str
+        Hexadecimal digest, equal for equal layouts.
+    
+    >>> genome_key(100, [10], [20], [50]) == genome_key(100, np.array([10]),
+    ...                                                 [20], (50,))
+    True
+    """
+    
+    key = hashlib.sha1(identity)
+    key.update(np.array([genome_size, len(genes_start_pos)], dtype="<i8"))
+    for positions in [genes_start_pos, genes_end_pos, barriers_pos]:
+        key.update(np.ascontiguousarray(positions, dtype="<i8"))
+    return key.hexdigest()
 
 
-#=======================================================================
-#                   SIMULATE EVOLUTION
-#=======================================================================
-def accept_mutation(previous_fitness, new_fitness, q):
+class ExpressionCache:
     """
-    Accept or reject the mutation, based on fitnesses comparison.
+    Cache of expression profiles, keyed by genome_key.
     
-    A fitness increase is always accepted. A fitness loss is accepted with
-    a probability exp(fitness difference / q).
+    Profiles are kept in memory, the least recently used ones being
+    dropped beyond max_entries. If a folder is given, they are also stored
+    there, so that runs sharing the folder share their results: each
+    profile is a .npy file of the sub-folder of its layout, written then
+    renamed, so that runs adding profiles of the same layout at the same
+    time never overwrite each other. As the transcription simulation is
+    stochastic, up to nb_replicates profiles are stored per layout.
     
     Parameters
     ----------
-    previous_fitness : float
-        Fitness of the previous generation (before mutation).
-    new_fitness : float
-        Fitness of the new generation (after mutation).
-    q : float
-        Parameters of the Monte Carlo Metropolis algorithm, controlling the
-        range of accepted fitness losses.
-        
-    Returns
-    -------
-    is_accepted : bool
-        True if the mutation is accepted, False else.
-        
-    >>> accept_mutation(0, float('Inf'), 1)
+    max_entries : int, optional
+        Maximal number of layouts kept in memory.
+    folder : str, optional
+        Folder of the on-disk cache.
+    nb_replicates : int, optional
+        Number of profiles stored per layout.
+    
+    Attributes
+    ----------
+    hits : int
+        Number of profiles found in the cache.
+    misses : int
+        Number of profiles that had to be simulated.
+    
+    >>> cache = ExpressionCache(max_entries=1)
+    >>> cache.add("a", np.array([1., 2.]))
+    >>> cache.get("a")
+    [array([1., 2.])]
+    >>> cache.add("b", np.array([3., 4.]))
+    >>> cache.get("a") is None
     True
+    
+    Two runs sharing a folder, both simulating the same layout:
+    
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as folder:
+    ...     caches = [ExpressionCache(folder=folder, nb_replicates=3)
+    ...               for run in range(2)]
+    ...     [cache.get("a") for cache in caches]
+    ...     caches[0].add("a", np.array([1., 2.]))
+    ...     caches[1].add("a", np.array([3., 4.]))
+    ...     sorted(profile.tolist() for profile in caches[0].get("a"))
+    ...     new_run = ExpressionCache(folder=folder, nb_replicates=3)
+    ...     sorted(profile.tolist() for profile in new_run.get("a"))
+    [None, None]
+    [[1.0, 2.0], [3.0, 4.0]]
+    [[1.0, 2.0], [3.0, 4.0]]
     """
     
-    fitness_diff = new_fitness - previous_fitness
-    if fitness_diff > 0:
-        return True
-    else:
-        return (np.random.rand() < np.exp(fitness_diff/q))
+    def __init__(self, max_entries=10000, folder=None, nb_replicates=1):
+        self.max_entries = max_entries
+        self.folder = folder
+        self.nb_replicates = nb_replicates
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+    
+    def get(self, key):
+        """Return the list of profiles stored for key, or None."""
+        replicates = self.entries.get(key)
+        if replicates is not None:
+            self.entries.move_to_end(key)
+        if self.folder is not None and (replicates is None or len(replicates)
+                                        < self.nb_replicates):
+            # Other runs may have added profiles
+            stored = self._load(key)
+            if stored and len(stored) > len(replicates or []):
+                replicates = stored
+                self._store(key, replicates)
+        return replicates
+    
+    def _load(self, key):
+        # Profiles stored in the folder of the layout
+        try:
+            names = sorted(name for name in
+                           os.listdir(os.path.join(self.folder, key))
+                           if name.endswith(".npy"))
+        except OSError:
+            return []
+        replicates = []
+        for name in names[:self.nb_replicates]:
+            try:
+                replicates.append(np.load(os.path.join(self.folder, key,
+                                                       name)))
+            except (OSError, ValueError):
+                # Unreadable profile, it is simulated again
+                pass
+        return replicates
+    
+    def add(self, key, expression):
+        """Store a new profile for key."""
+        replicates = self.get(key) or []
+        if len(replicates) >= self.nb_replicates:
+            return
+        replicates = replicates + [np.asarray(expression)]
+        self._store(key, replicates)
+        if self.folder is not None:
+            # Each profile has its own file, with a random name: write then
+            # rename, so that other runs never read partial files
+            os.makedirs(os.path.join(self.folder, key), exist_ok=True)
+            path = os.path.join(self.folder, key, os.urandom(8).hex())
+            with open(path + ".tmp", "wb") as write_file:
+                np.save(write_file, replicates[-1])
+            os.replace(path + ".tmp", path + ".npy")
+    
+    def _store(self, key, replicates):
+        self.entries[key] = replicates
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    def stats(self):
+        """Return a dict of cache statistics."""
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.,
+                "entries": len(self.entries)}
 
 
-def evolution(start, end, barr, out, genome_size, initial_expression, previous_fitness, target_freqs, discret_step, q, inversion_proba, p_insertion, nb_generations, PARAMS):
+class CachedSimulator(SimulatorBackend):
     """
-    Simulate the evolution with a Monte-Carlo Metropolis algorithm. 
+    Simulator reusing the profiles of already simulated layouts.
+    
+    A layout is simulated until its cache entry holds nb_replicates
+    profiles; afterwards, one of them is returned at random.
     
     Parameters
     ----------
-    start : Numpy array
-        Array of ints representing the begining position of genes.
-    end : Numpy array
-        Array of ints representing the ending position of genes.
-    barr : Numpy array
-        Array of ints representing the position of barriers.
-    out : Python list
-        list of the open position intervals in the genome where there 
-        are not any genes   
-    genome_size : int
+    simulator : SimulatorBackend
+        Simulator used on cache misses.
+    cache : ExpressionCache, optional
+        Cache of profiles. By default, a new in-memory cache.
+    rng : numpy.random.Generator, optional
+        Random number generator choosing the returned profile (see
+        random_generator).
+    """
+    
+    def __init__(self, simulator, cache=None, rng=None):
+        SimulatorBackend.__init__(self, simulator.params_file,
+                                  simulator.genome_files)
+        self.simulator = simulator
+        self.cache = cache if cache is not None else ExpressionCache()
+        self.rng = random_generator(rng)
+        self._identity = simulator.identity()
+    
+    def identity(self):
+        return self._identity
+    
+    def simulate(self, genome_size, genes_start_pos, genes_end_pos,
+                 barriers_pos):
+        key = genome_key(genome_size, genes_start_pos, genes_end_pos,
+                         barriers_pos, self._identity)
+        replicates = self.cache.get(key)
+        if replicates is not None and (len(replicates)
+                                       >= self.cache.nb_replicates):
+            self.cache.hits += 1
+            self.stage_timings = {}
+            return replicates[self.rng.integers(len(replicates))]
+        self.cache.misses += 1
+        expression = self.simulator.simulate(genome_size, genes_start_pos,
+                                             genes_end_pos, barriers_pos)
+        self.stage_timings = self.simulator.stage_timings
+        self.cache.add(key, expression)
+        return expression
+    
+    def run(self, gene_start_pos):
+        return self.simulator.run(gene_start_pos)
+    
+    def seed(self, seed_sequence):
+        cache_seed, simulator_seed = seed_sequence.spawn(2)
+        self.rng = np.random.default_rng(cache_seed)
+        self.simulator.seed(simulator_seed)
+    
+    @property
+    def random_state(self):
+        return self.simulator.random_state
+    
+    @random_state.setter
+    def random_state(self, random_state):
+        self.simulator.random_state = random_state
+    
+    def isolated(self, tag, staging_folder=None):
+        simulator = copy.copy(self)
+        simulator.simulator = self.simulator.isolated(tag, staging_folder)
+        simulator.tag = simulator.simulator.tag
+        simulator.params_file = simulator.simulator.params_file
+        simulator.genome_files = simulator.simulator.genome_files
+        return simulator
+
+
+# Number of transcripts counted for genes without transcript
+MIN_TRANSCRIPTS = 0.5
+
+
+def compute_fitness(observed_transcript_numbers, target_frequencies,
+                    min_transcripts=MIN_TRANSCRIPTS):
+    """Compute the fitness of an individual with given gene expression pattern
+    in given environment.
+    
+    Parameters
+    ----------
+    observed_transcript_numbers : Numpy array
+        Array of ints representing the observed number of transcripts for each
+        gene of the invidual.
+    target_frequencies : Numpy array
+        Array of floats representing target relative expression level for each
+        gene (environment).
+    min_transcripts : float, optional
+        Floor on the number of transcripts of each gene (see
+        batch_log_fitness). With None, a gene without transcript gives a
+        fitness of 0, as before the floor was introduced.
+    
+    Returns
+    -------
+    fitnness : float
+        computed fitness of the invidual, following the formula:
+            .. math::
+            	fitness =  \exp\left(-\sum\left|\ln\left(\\frac{observed\_for\_gene\_i}{target\_for\_gene\_i}\\right)\\right|\\right)
+    
+    >>> print(compute_fitness(np.array([1., 1.]), np.array([.5, .5])))
+    1.0
+    >>> print(compute_fitness(np.array([0., 2.]), np.array([.5, .5])))
+    0.25
+    >>> print(compute_fitness(np.array([0., 2.]), np.array([.5, .5]), None))
+    0.0
+    """
+    
+    return np.exp(batch_log_fitness(
+            np.asarray(observed_transcript_numbers)[np.newaxis],
+            target_frequencies, min_transcripts)[0])
+
+
+def batch_log_fitness(transcript_numbers, target_frequencies,
+                      min_transcripts=MIN_TRANSCRIPTS):
+    """Compute the logarithm of the fitness of many expression profiles.
+    
+    Parameters
+    ----------
+    transcript_numbers : Numpy array
+        2-D array (candidates, genes) of the number of transcripts of each
+        gene of each candidate.
+    target_frequencies : Numpy array
+        Array of floats representing target relative expression level for
+        each gene (environment).
+    min_transcripts : float, optional
+        Genes with less transcripts count as min_transcripts transcripts,
+        so that the fitness stays defined (and positive) for genes without
+        transcript. With None, there is no floor: the log fitness is -inf
+        for a candidate with a gene without transcript, nan for a
+        candidate without transcript.
+    
+    Returns
+    -------
+    log_fitnesses : Numpy array
+        Logarithm of the fitness of each candidate (see compute_fitness).
+    
+    >>> transcript_numbers = np.array([[1., 3.], [0., 0.], [0., 2.]])
+    >>> np.exp(batch_log_fitness(transcript_numbers, np.array([.5, .5])))
+    array([0.33333333, 1.        , 0.25      ])
+    >>> np.exp(batch_log_fitness(transcript_numbers, np.array([.5, .5]),
+    ...                          None))
+    array([0.33333333,        nan, 0.        ])
+    """
+    
+    if min_transcripts is not None:
+        transcript_numbers = np.maximum(transcript_numbers, min_transcripts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        observed_frequencies = (transcript_numbers
+                                / np.sum(transcript_numbers, axis=1,
+                                         keepdims=True))
+        ln_freqs = np.log(observed_frequencies / target_frequencies)
+    return -np.sum(np.abs(ln_freqs), axis=1)
+
+
+def batch_fitness(transcript_numbers, target_frequencies,
+                  min_transcripts=MIN_TRANSCRIPTS):
+    """Compute the fitness of many expression profiles (see
+    batch_log_fitness)."""
+    return np.exp(batch_log_fitness(transcript_numbers, target_frequencies,
+                                    min_transcripts))
+
+
+def batch_accept_mutation(previous_fitnesses, new_fitnesses, q, rng):
+    """
+    Accept or reject many mutations, based on fitnesses comparison (see
+    accept_mutation).
+    
+    Parameters
+    ----------
+    previous_fitnesses : Numpy array
+        Fitness of each candidate before its mutation.
+    new_fitnesses : Numpy array
+        Fitness of each candidate after its mutation. Candidates with a nan
+        fitness are rejected.
+    q : float
+        Parameters of the Monte Carlo Metropolis algorithm, controlling the
+        range of accepted fitness losses.
+    rng : numpy.random.Generator
+        Random generator, drawing one number per candidate.
+    
+    Returns
+    -------
+    is_accepted : Numpy array
+        Array of bools, True for accepted mutations.
+    
+    >>> batch_accept_mutation(np.array([.5, .5, .5]),
+    ...                       np.array([.6, .1, np.nan]), 1e-3,
+    ...                       np.random.default_rng(0))
+    array([ True, False, False])
+    """
+    
+    fitness_diffs = (np.asarray(new_fitnesses)
+                     - np.asarray(previous_fitnesses))
+    # exp(fitness difference / q) is compared in log space, which is never
+    # above 0 for a fitness increase
+    log_uniforms = np.log1p(-rng.random(len(fitness_diffs)))
+    return log_uniforms * q < fitness_diffs
+
+
+#=======================================================================
+#                   GENERATE MUTATIONS
+#=======================================================================
+# Generator of the functions called without rng (see random_generator)
+_DEFAULT_RNG = np.random.default_rng()
+
+
+def random_generator(rng=None):
+    """
+    Return the random number generator of a stochastic function.
+    
+    Functions drawing random numbers take an optional rng argument. By
+    default, they share one generator seeded from fresh entropy: pass
+    the same rng down the calls to make a run reproducible. The global
+    NumPy random state is neither used nor changed.
+    
+    Parameters
+    ----------
+    rng : numpy.random.Generator, optional
+        Generator given by the caller.
+    
+    Returns
+    -------
+    rng : numpy.random.Generator
+        rng, or the default generator.
+    
+    >>> random_generator() is random_generator()
+    True
+    >>> global_state = np.random.get_state()
+    >>> draw = sample([[0, 100]], 100, 10)
+    >>> np.array_equal(np.random.get_state()[1], global_state[1])
+    True
+    """
+    
+    if rng is None:
+        rng = _DEFAULT_RNG
+    return rng
+
+
+def sample(out, Ngen, u, rng=None):
+    """
+    Sample a location from a given list of intervals that satisfies the "distance to bounds condition" 
+    (there is at least u nucleotides between the right and left bound and the sampled mutation position)
+    This allows a deletion to happen without being to close to a gene or barrier.
+    
+    Parameters
+    ----------
+    out : Python list
+        list of the open position intervals in the genome where there are not any genes   
+    Ngen : int
+        the length of the genome
+    u : int
+        unit of length of nucleotides.
+    rng : numpy.random.Generator, optional
+        Random number generator (see random_generator).
+        
+    Returns
+    -------
+    mut_pos : int
+        sampled location of the mutation
+    
+    Note
+    ----
+    Raise a RuntimeError if no position satisfies the condition.
+    """
+    
+    return PositionSampler(out, Ngen, u).draw(rng=rng)
+
+
+class PositionSampler:
+    """
+    Sampler of mutation positions satisfying the "distance to bounds
+    condition" (see sample), without rejection.
+    
+    The cumulative count of eligible positions (at least u nucleotides
+    away from both bounds) of the intervals is taken from their index (see
+    FreeIntervals), which keeps it up to date after each event. A position
+    is then drawn uniformly among all eligible positions with a binary
+    search on this cumulative count, which allows drawing many positions
+    in one vectorized call.
+    
+    Parameters
+    ----------
+    out : Numpy array
+        2-D array of ints. Each line represents an open interval containing
+        no gene nor barrier (see pos_out_from_pos_lists).
+    genome_size : int
+        Genome size in base pair.
+    u : int
+        unit of length of nucleotides.
+    
+    >>> sampler = PositionSampler(np.array([[90, 10], [20, 50]]), 100, 5)
+    >>> sampler.cumulative_counts
+    array([11, 32])
+    >>> positions = sampler.draw(1000)
+    >>> bool(np.all((positions <= 5) | (positions >= 95)
+    ...             | ((positions >= 25) & (positions <= 45))))
+    True
+    """
+    
+    __slots__ = ("genome_size", "limits", "distance", "cumulative_counts")
+    
+    def __init__(self, out, genome_size, u):
+        self._set_intervals(FreeIntervals.from_out(
+                genome_size, np.asarray(out)).with_distance(max(u, 1)))
+    
+    @classmethod
+    def from_intervals(cls, intervals, u):
+        """Build the sampler on the index of the intervals, without copy
+        if it already counts the positions u nucleotides away from the
+        bounds (see FreeIntervals.with_distance)."""
+        sampler = cls.__new__(cls)
+        sampler._set_intervals(intervals.with_distance(max(u, 1)))
+        return sampler
+    
+    def _set_intervals(self, intervals):
+        self.genome_size = intervals.genome_size
+        self.limits = intervals.limits
+        self.distance = intervals.distance
+        self.cumulative_counts = intervals.cumulative_lengths
+        if (len(self.cumulative_counts) == 0
+                or self.cumulative_counts[-1] == 0):
+            raise RuntimeError("A mutation position that that satisfies the "
+                               "distance to the bounds condition does not "
+                               "exist")
+    
+    def draw(self, size=None, rng=None):
+        """Draw mutation positions.
+        
+        Parameters
+        ----------
+        size : int, optional
+            Number of positions to draw. If None, a single int is returned.
+        rng : numpy.random.Generator, optional
+            Random number generator (see random_generator).
+        
+        Returns
+        -------
+        mut_pos : int or Numpy array
+            Sampled location(s) of the mutation.
+        """
+        
+        rng = random_generator(rng)
+        rank = rng.integers(0, self.cumulative_counts[-1], size)
+        interval = np.searchsorted(self.cumulative_counts, rank, "right")
+        previous_counts = np.where(interval > 0,
+                                   self.cumulative_counts[interval-1], 0)
+        # Lower bound of interval k is limits[2k-1] (limits[-1] for k=0)
+        mut_pos = (self.limits[2*interval-1] + self.distance + rank
+                   - previous_counts)
+        # Positions after the origin
+        mut_pos = np.where(mut_pos > self.genome_size,
+                           mut_pos - self.genome_size, mut_pos)
+        if size is None:
+            return int(mut_pos)
+        return mut_pos
+
+
+def evolutive_event(discret_step, inversion_proba, genome_size,
+                    genes_start_pos, genes_end_pos, barriers_pos,
+                    out_positions, p_insertion, rng=None):
+    """Generate an evolutive event on given genome.
+    
+    The event can either be a genome inversion (with probability inversion_proba),
+    or an indel. An indel is an insertion with probability p_insertion
+    
+    Parameters
+    ----------
+    inversion_proba : float
+        Probability for the event to be an inversion.
+    genome_size : int
+        Genome size in base pair.
+    genes_start_pos : Numpy array
+        Array of ints representing the begining position of genes.
+    genes_end_pos : Numpy array
+        Array of ints representing the ending position of genes.
+    barriers_pos : Numpy array
+        Array of ints representing the position of barriers.
+    out_positions : Numpy array
+        2-D array of ints. Each line represents an open interval containing
+        no gene nor barrier.
+    p_insertion : float
+        Probability for an indel event to be an insertion.
+    rng : numpy.random.Generator, optional
+        Random number generator (see random_generator).
+    Returns
+    -------
+    genome_size : ine
+        Updated value of genome_size after the event.
+    genes_start_pos : Numpy array
+        Updated value of genes_start_pos after the event.
+    genes_end_pos : Numpy array
+        Updated value of genes_end_pos after the event.
+    barriers_pos : Numpy array
+        Updated value of barriers_pos after the event.
+    genome_size: int
+        Updated value of the genome size.    
+    """
+    
+    event_type, genome, _ = mutate_genome(Genome(genome_size, genes_start_pos,
+                                                 genes_end_pos,
+                                                 barriers_pos, out_positions),
+                                          discret_step, inversion_proba,
+                                          p_insertion, rng)
+    return (event_type, genome.size, genome.start, genome.end,
+            genome.barriers)
+
+
+def mutate_genome(genome, discret_step, inversion_proba, p_insertion,
+                  rng=None):
+    """Generate an evolutive event on given Genome.
+    
+    Same event as evolutive_event. Positions are drawn with the sampler
+    of the genome: two for an inversion, one for an indel.
+    
+    Parameters
+    ----------
+    genome : Genome
+        Genome before the event (it is not modified).
+    discret_step : int
+        Size of an indel event (in base pairs)
+    inversion_proba : float
+        Probability for the event to be an inversion.
+    p_insertion : float
+        Probability for an indel event to be an insertion.
+    rng : numpy.random.Generator, optional
+        Random number generator (see random_generator).
+    
+    Returns
+    -------
+    event_type : str
+        Equal to "insertion", "deletion" or "inversion".
+    new_genome : Genome
+        Genome after the event.
+    event_positions : tuple of ints
+        Position(s) of the event: start and end of an inversion, or the
+        indel position.
+    """
+    
+    rng = random_generator(rng)
+    sampler = genome.sampler(discret_step)
+    if rng.random() < inversion_proba:
+        # The event will be an inversion
+        # Draw both positions of the mutation
+        event_positions = np.sort(sampler.draw(2, rng))
+        return ("inversion", genome.with_inversion(*event_positions),
+                tuple(event_positions))
+    # The event will be an indel
+    indel_pos = sampler.draw(rng=rng)
+    if rng.random() < p_insertion:
+        return ("insertion", genome.with_indel(indel_pos, discret_step),
+                (indel_pos,))
+    return ("deletion", genome.with_indel(indel_pos, -discret_step),
+            (indel_pos,))
+
+
+def indel(u, genome_size, genes_start_pos, genes_end_pos, barriers_pos, out_positions, p_insertion,
+          indel_pos=None, rng=None):
+    """
+    Delete or insert in the plasmid a unit with length u in base pairs 
+    
+    Parameters
+    ----------
+    u : int
+        Unit of length in base pairs that is deleted or inserted.
+    genome_size : int
+        Genome size in base pairs.
+    genes_start_pos : Numpy array
+        Array of ints representing the begining position of genes.
+    genes_end_pos : Numpy array
+        Array of ints representing the ending position of genes.
+    barriers_pos : Numpy array
+        Array of ints representing the position of barriers.
+    out_positions : Numpy array
+        2-D array of ints. Each line represents an open interval containing
+        no gene nor barrier.
+    p_insertion : float
+        Probability of the event to be an insertion and not a deletion.
+    indel_pos : int, optional
+        Position of the indel, if already sampled.
+    rng : numpy.random.Generator, optional
+        Random number generator (see random_generator).
+        
+    Returns
+    -------
+    event_type : str
+        Equal to "insertion" or "deletion".
+    new_genes_start_pos : Numpy array
+        Updated value of genes_start_pos after inversion.
+    new_genes_end_pos : Numpy array
+        Updated value of genes_end_pos after inversion.
+    new_barriers_pos : Numpy array
+        Updated value of barriers_pos after inversion.
+    genome_size: int
+        Updated value of the genome size.
+    """
+    
+    ### Sample the indel position
+    rng = random_generator(rng)
+    if indel_pos is None:
+        indel_pos = sample(out_positions, genome_size, u, rng)
+    
+    ### Choose whether it is an insertion or a deletion
+    p = rng.random() # Draw a random number between 0 and 1
+    if p<p_insertion:
+        # It is an insertion
+        event_type = "insertion"
+        shift = u
+    else:
+        # It is a deletion
+        event_type = "deletion"
+        shift = -u
+    
+    ### Update positions after the indel, and the genome size
+    new_genes_start_pos = shift_positions(genes_start_pos, indel_pos, shift)
+    new_genes_end_pos = shift_positions(genes_end_pos, indel_pos, shift)
+    new_barriers_pos = shift_positions(barriers_pos, indel_pos, shift)
+    genome_size += shift
+    
+    return (event_type, genome_size, new_genes_start_pos, new_genes_end_pos,
+            new_barriers_pos)
+
+
+def genome_inversion(genome_size, genes_start_pos, genes_end_pos, barriers_pos,
+                     inversion_start, inversion_end):        
+    """Perform a genome innversion on given genome at given positions.
+    
+    Parameters
+    ----------
+    genome_size : int
+        Genome size in base pair.
+    genes_start_pos : Numpy array
+        Array of ints representing the begining position of genes.
+    genes_end_pos : Numpy array
+        Array of ints representing the ending position of genes.
+    barriers_pos : Numpy array
+        Array of ints representing the position of barriers.
+    inversion_start : int
+        Position of the beginning of the inversion in the genome.
+    inversion_end : int
+        Position of the end of the inversion in the genome.
+    
+    Returns
+    -------
+    event_type : str
+        Always equal to "inversion"
+    genome_size : int
+        Unchanged value of genome_size.
+    genes_start_pos : Numpy array
+        Updated value of genes_start_pos after inversion.
+    genes_end_pos : Numpy array
+        Updated value of genes_end_pos after inversion.
+    barriers_pos : Numpy array
+        Updated value of barriers_pos after inversion.
+        
+    Notes
+    -----
+    inversion_start and inversion_end must not be inside a gene.
+    If inversion_end is lower than inversion_start, the inverted segment
+    crosses the origin.
+    """
+    
+    new_genes_start_pos = invert_positions(genes_start_pos, inversion_start,
+                                           inversion_end, genome_size)
+    new_genes_end_pos = invert_positions(genes_end_pos, inversion_start,
+                                         inversion_end, genome_size)
+    new_barriers_pos = invert_positions(barriers_pos, inversion_start,
+                                        inversion_end, genome_size)
+    return ("inversion", genome_size, new_genes_start_pos, new_genes_end_pos,
+            new_barriers_pos)
+
+
+def shift_positions(positions, indel_pos, shift):
+    """Shift the positions located after an indel.
+    
+    Works on a single genome (1-D positions and scalar event) or on a batch
+    of genomes (positions with one line per genome, and one event per
+    genome).
+    
+    Parameters
+    ----------
+    positions : Numpy array
+        Array of ints representing positions, of shape (n,) or (M, n).
+    indel_pos : int or Numpy array
+        Position of the indel, or array of shape (M,).
+    shift : int or Numpy array
+        Length added to positions after the indel (negative for a
+        deletion), or array of shape (M,).
+    
+    Returns
+    -------
+    new_positions : Numpy array
+        Updated positions (the input array is not modified).
+    
+    >>> shift_positions(np.array([10, 50, 90]), 50, 6)
+    array([10, 56, 96])
+    >>> shift_positions(np.array([[10, 50], [10, 50]]), [20, 60], [-6, 6])
+    array([[10, 44],
+           [10, 50]])
+    """
+    
+    positions = np.asarray(positions)
+    indel_pos = np.asarray(indel_pos)[..., np.newaxis]
+    shift = np.asarray(shift)[..., np.newaxis]
+    return positions + np.where(positions >= indel_pos, shift, 0)
+
+
+def invert_positions(positions, inversion_start, inversion_end, genome_size):
+    """Reflect the positions located inside an inverted segment.
+    
+    If inversion_end is lower than inversion_start, the segment crosses the
+    origin of the circular genome. Like shift_positions, works on a single
+    genome or on a batch of genomes.
+    
+    Parameters
+    ----------
+    positions : Numpy array
+        Array of ints representing positions, of shape (n,) or (M, n).
+    inversion_start : int or Numpy array
+        Position of the beginning of the inversion, or array of shape (M,).
+    inversion_end : int or Numpy array
+        Position of the end of the inversion, or array of shape (M,).
+    genome_size : int or Numpy array
+        Genome size in base pair, or array of shape (M,).
+    
+    Returns
+    -------
+    new_positions : Numpy array
+        Updated positions (the input array is not modified).
+    
+    >>> invert_positions(np.array([10, 30, 40, 90]), 20, 60, 100)
+    array([10, 50, 40, 90])
+    >>> invert_positions(np.array([5, 50, 95]), 90, 10, 100)
+    array([95, 50,  5])
+    """
+    
+    positions = np.asarray(positions)
+    inversion_start = np.asarray(inversion_start)[..., np.newaxis]
+    inversion_end = np.asarray(inversion_end)[..., np.newaxis]
+    genome_size = np.asarray(genome_size)[..., np.newaxis]
+    # Unwrap segments crossing the origin
+    crossing = inversion_end < inversion_start
+    inversion_end = np.where(crossing, inversion_end + genome_size,
+                             inversion_end)
+    unwrapped = np.where(crossing & (positions < inversion_start),
+                         positions + genome_size, positions)
+    inside = (unwrapped > inversion_start) & (unwrapped < inversion_end)
+    reflected = inversion_start + inversion_end - unwrapped
+    # Wrap reflected positions back into the genome
+    reflected = np.where(reflected > genome_size, reflected - genome_size,
+                         reflected)
+    return np.where(inside, reflected, positions)
+
+
+def batch_indel(u, genome_sizes, genes_start_pos, genes_end_pos, barriers_pos,
+                indel_pos, is_insertion):
+    """
+    Apply one indel to each genome of a batch.
+    
+    Parameters
+    ----------
+    u : int
+        Unit of length in base pairs that is deleted or inserted.
+    genome_sizes : Numpy array
+        Array of ints of shape (M,), size of each genome.
+    genes_start_pos : Numpy array
+        2-D array of ints of shape (M, nb genes), gene starts of each genome.
+    genes_end_pos : Numpy array
+        2-D array of ints of shape (M, nb genes), gene ends of each genome.
+    barriers_pos : Numpy array
+        2-D array of ints of shape (M, nb barriers), barriers of each genome.
+    indel_pos : Numpy array
+        Array of ints of shape (M,), position of each indel.
+    is_insertion : Numpy array
+        Array of bools of shape (M,), True for an insertion and False for a
+        deletion.
+    
+    Returns
+    -------
+    genome_sizes, genes_start_pos, genes_end_pos, barriers_pos : Numpy arrays
+        Updated values after the indels.
+    """
+    
+    shift = np.where(is_insertion, u, -u)
+    return (genome_sizes + shift,
+            shift_positions(genes_start_pos, indel_pos, shift),
+            shift_positions(genes_end_pos, indel_pos, shift),
+            shift_positions(barriers_pos, indel_pos, shift))
+
+
+def batch_inversion(genome_sizes, genes_start_pos, genes_end_pos, barriers_pos,
+                    inversion_start, inversion_end):
+    """
+    Apply one inversion to each genome of a batch.
+    
+    Parameters
+    ----------
+    genome_sizes : Numpy array
+        Array of ints of shape (M,), size of each genome.
+    genes_start_pos : Numpy array
+        2-D array of ints of shape (M, nb genes), gene starts of each genome.
+    genes_end_pos : Numpy array
+        2-D array of ints of shape (M, nb genes), gene ends of each genome.
+    barriers_pos : Numpy array
+        2-D array of ints of shape (M, nb barriers), barriers of each genome.
+    inversion_start : Numpy array
+        Array of ints of shape (M,), beginning of each inversion.
+    inversion_end : Numpy array
+        Array of ints of shape (M,), end of each inversion.
+    
+    Returns
+    -------
+    genome_sizes, genes_start_pos, genes_end_pos, barriers_pos : Numpy arrays
+        Updated values after the inversions (sizes are unchanged).
+    """
+    
+    return (genome_sizes,
+            invert_positions(genes_start_pos, inversion_start, inversion_end,
+                             genome_sizes),
+            invert_positions(genes_end_pos, inversion_start, inversion_end,
+                             genome_sizes),
+            invert_positions(barriers_pos, inversion_start, inversion_end,
+                             genome_sizes))
+
+
+def batch_sample_positions(u, genome_sizes, genes_start_pos, genes_end_pos,
+                           barriers_pos, nb_positions, rng):
+    """
+    Sample mutation positions satisfying the "distance to bounds
+    condition" (see PositionSampler) in each genome of a batch.
+    
+    Parameters
+    ----------
+    u : int
+        unit of length of nucleotides.
+    genome_sizes : Numpy array
+        Array of ints of shape (M,), size of each genome.
+    genes_start_pos : Numpy array
+        2-D array of ints of shape (M, nb genes), gene starts of each genome.
+    genes_end_pos : Numpy array
+        2-D array of ints of shape (M, nb genes), gene ends of each genome.
+    barriers_pos : Numpy array
+        2-D array of ints of shape (M, nb barriers), barriers of each genome.
+    nb_positions : int
+        Number of positions drawn per genome.
+    rng : numpy.random.Generator
+        Random generator.
+    
+    Returns
+    -------
+    positions : Numpy array
+        2-D array of ints of shape (M, nb_positions).
+    
+    >>> positions = batch_sample_positions(
+    ...         5, np.array([100, 200]), np.array([[10], [10]]),
+    ...         np.array([[20], [20]]), np.array([[50], [150]]), 1000,
+    ...         np.random.default_rng(0))
+    >>> bool(np.all((positions[0] >= 25) & (positions[0] <= 45)
+    ...             | (positions[0] >= 55) | (positions[0] <= 5)))
+    True
+    >>> int(positions[1].max()) > 100
+    True
+    """
+    
+    genome_sizes = np.asarray(genome_sizes)
+    limits = np.sort(np.hstack((genes_start_pos, genes_end_pos, barriers_pos,
+                                barriers_pos)), axis=1)
+    # Intervals as in pos_out_from_pos_lists, the first one crossing the
+    # origin
+    lower_bounds = np.hstack((limits[:, -1:], limits[:, 1:-1:2]))
+    upper_bounds = np.hstack((limits[:, :1] + genome_sizes[:, np.newaxis],
+                              limits[:, 2:-1:2]))
+    distance = max(u, 1)
+    lower_bounds = lower_bounds + distance
+    counts = np.maximum(upper_bounds - distance - lower_bounds + 1, 0)
+    cumulative_counts = np.cumsum(counts, axis=1)
+    totals = cumulative_counts[:, -1]
+    if np.any(totals == 0):
+        raise RuntimeError("A mutation position that that satisfies the "
+                           "distance to the bounds condition does not "
+                           "exist")
+    ranks = rng.integers(0, totals[:, np.newaxis],
+                         (len(genome_sizes), nb_positions))
+    # One binary search over all genomes: counts of each genome are offset
+    # by the total of the previous ones
+    offsets = np.concatenate(([0], np.cumsum(totals)[:-1]))[:, np.newaxis]
+    flat_index = np.searchsorted((cumulative_counts + offsets).ravel(),
+                                 (ranks + offsets).ravel(), "right")
+    rows = np.repeat(np.arange(len(genome_sizes)), nb_positions)
+    intervals = flat_index - rows * counts.shape[1]
+    previous_counts = np.where(
+            intervals > 0, cumulative_counts[rows, intervals - 1], 0)
+    positions = (lower_bounds[rows, intervals] + ranks.ravel()
+                 - previous_counts)
+    # Positions after the origin
+    positions = np.where(positions > genome_sizes[rows],
+                         positions - genome_sizes[rows], positions)
+    return positions.reshape(len(genome_sizes), nb_positions)
+
+
+def batch_mutate(u, inversion_proba, p_insertion, genome_sizes,
+                 genes_start_pos, genes_end_pos, barriers_pos, rng,
+                 mutated=None):
+    """
+    Apply one evolutive event to each genome of a batch (see
+    mutate_genome).
+    
+    Parameters
+    ----------
+    u : int
+        Size of an indel event (in base pairs).
+    inversion_proba : float
+        Probability for an event to be an inversion.
+    p_insertion : float
+        Probability for an indel event to be an insertion.
+    genome_sizes, genes_start_pos, genes_end_pos, barriers_pos : Numpy arrays
+        Genomes of the batch (see batch_indel).
+    rng : numpy.random.Generator
+        Random generator.
+    mutated : Numpy array, optional
+        Array of bools of shape (M,). Only these genomes are mutated. By
+        default, all of them.
+    
+    Returns
+    -------
+    genome_sizes, genes_start_pos, genes_end_pos, barriers_pos : Numpy arrays
+        Genomes after the events.
+    event_types : Numpy array
+        Array of ints of shape (M,), index of the event type in
+        EVENT_TYPES, or -1 for genomes that are not mutated.
+    """
+    
+    nb_genomes = len(genome_sizes)
+    if mutated is None:
+        mutated = np.ones(nb_genomes, dtype=bool)
+    positions = batch_sample_positions(u, genome_sizes, genes_start_pos,
+                                       genes_end_pos, barriers_pos, 2, rng)
+    is_inversion = rng.random(nb_genomes) < inversion_proba
+    is_insertion = rng.random(nb_genomes) < p_insertion
+    originals = (genome_sizes, genes_start_pos, genes_end_pos, barriers_pos)
+    mutants = [np.array(original) for original in originals]
+    # Each event is only applied to the genomes it mutates
+    inverted = mutated & is_inversion
+    if np.any(inverted):
+        for mutant, values in zip(mutants, batch_inversion(
+                *[original[inverted] for original in originals],
+                positions[inverted].min(axis=1),
+                positions[inverted].max(axis=1))):
+            mutant[inverted] = values
+    shifted = mutated & ~is_inversion
+    if np.any(shifted):
+        for mutant, values in zip(mutants, batch_indel(
+                u, *[original[shifted] for original in originals],
+                positions[shifted, 0], is_insertion[shifted])):
+            mutant[shifted] = values
+    event_types = np.where(
+            is_inversion, EVENT_TYPES.index("inversion"),
+            np.where(is_insertion, EVENT_TYPES.index("insertion"),
+                     EVENT_TYPES.index("deletion")))
+    event_types = np.where(mutated, event_types, -1)
+    return tuple(mutants) + (event_types,)
+
+
+#=======================================================================
+#                   SURROGATE FITNESS MODEL
+#=======================================================================
+class SurrogateFitness:
+    """
+    Cheap estimate of the fitness of a genome from its layout, used to
+    screen proposals before simulating them (delayed acceptance, see
+    evolution).
+    
+    The logarithm of the fitness is modelled as a linear function of
+    layout features (see layout_features), fitted by ridge regression on
+    the first `warmup` simulated genomes. The model is then frozen, so that
+    the delayed acceptance chain keeps the stationary distribution of the
+    Metropolis algorithm.
+    
+    Parameters
+    ----------
+    warmup : int, optional
+        Number of simulated genomes the model is fitted on.
+    ridge : float, optional
+        Regularization of the regression.
+    """
+    
+    def __init__(self, warmup=200, ridge=1e-3):
+        self.warmup = warmup
+        self.ridge = ridge
+        self.features = []
+        self.log_fitnesses = []
+        self.coefficients = None
+    
+    @property
+    def is_fitted(self):
+        """True once the model is fitted and frozen."""
+        return self.coefficients is not None
+    
+    @staticmethod
+    def layout_features(genome):
+        """
+        Describe the layout of a genome.
+        
+        Parameters
+        ----------
+        genome : Genome
+            Genome to describe.
+        
+        Returns
+        -------
+        features : Numpy array
+            For each gene, in gene ID order: orientation (1 for "+", -1
+            for "-"), log(1 + free space) upstream and downstream of the
+            gene, and whether its upstream and downstream neighbours are
+            barriers (1) or genes (0). A constant 1 ends the array.
+        
+        >>> genome = Genome(100, [10, 60], [20, 50], [80])
+        >>> np.round(SurrogateFitness.layout_features(genome), 2)
+        array([ 1.  ,  3.43,  3.43,  1.  ,  0.  , -1.  ,  3.04,  3.43,  1.  ,
+                0.  ,  1.  ])
+        """
+        
+        forward = genome.orientations == "+"
+        nb_genes = genome.nb_genes
+        # Genes and barriers, from their left to their right limit on the
+        # circular genome
+        lefts = np.concatenate((np.where(forward, genome.start, genome.end),
+                                genome.barriers))
+        rights = np.concatenate((np.where(forward, genome.end, genome.start),
+                                 genome.barriers))
+        is_barrier = np.arange(len(lefts)) >= nb_genes
+        order = np.argsort(lefts, kind="stable")
+        previous = np.empty_like(order)
+        previous[order] = np.roll(order, 1)
+        following = np.empty_like(order)
+        following[order] = np.roll(order, -1)
+        space_before = (lefts - rights[previous]) % genome.size
+        space_after = space_before[following]
+        previous = previous[:nb_genes]
+        following = following[:nb_genes]
+        space_before = space_before[:nb_genes]
+        space_after = space_after[:nb_genes]
+        # Upstream of a "-" gene is on its right
+        features = np.column_stack((
+                np.where(forward, 1., -1.),
+                np.log1p(np.where(forward, space_before, space_after)),
+                np.log1p(np.where(forward, space_after, space_before)),
+                np.where(forward, is_barrier[previous], is_barrier[following]),
+                np.where(forward, is_barrier[following], is_barrier[previous])))
+        return np.append(features.ravel(), 1.)
+    
+    def add(self, genome, fitness):
+        """Learn the fitness of a simulated genome, until the model is
+        fitted."""
+        if self.is_fitted:
+            return
+        self.features.append(self.layout_features(genome))
+        self.log_fitnesses.append(np.log(max(fitness,
+                                             np.finfo(float).tiny)))
+        if len(self.log_fitnesses) >= self.warmup:
+            self.fit()
+    
+    def fit(self):
+        """Fit the model on the learnt genomes, and freeze it."""
+        features = np.asarray(self.features)
+        self.coefficients = np.linalg.solve(
+                features.T @ features
+                + self.ridge * np.eye(features.shape[1]),
+                features.T @ np.asarray(self.log_fitnesses))
+        # Training data are no longer needed
+        self.features = []
+        self.log_fitnesses = []
+    
+    def predict(self, genome):
+        """Return the estimated fitness of a genome."""
+        return float(np.exp(self.layout_features(genome)
+                            @ self.coefficients))
+
+
+#=======================================================================
+#                   SIMULATE EVOLUTION
+#=======================================================================
+def accept_mutation(previous_fitness, new_fitness, q, rng=None):
+    """
+    Accept or reject the mutation, based on fitnesses comparison.
+    
+    A fitness increase is always accepted. A fitness loss is accepted with
+    a probability exp(fitness difference / q).
+    
+    Parameters
+    ----------
+    previous_fitness : float
+        Fitness of the previous generation (before mutation).
+    new_fitness : float
+        Fitness of the new generation (after mutation).
+    q : float
+        Parameters of the Monte Carlo Metropolis algorithm, controlling the
+        range of accepted fitness losses.
+    rng : numpy.random.Generator, optional
+        Random number generator (see random_generator).
+        
+    Returns
+    -------
+    is_accepted : bool
+        True if the mutation is accepted, False else.
+        
+    >>> accept_mutation(0, float('Inf'), 1)
+    True
+    """
+    
+    fitness_diff = new_fitness - previous_fitness
+    if fitness_diff > 0:
+        return True
+    else:
+        rng = random_generator(rng)
+        return (rng.random() < np.exp(fitness_diff/q))
+
+
+def replicate_decision(fitnesses, threshold, z=2.):
+    """
+    Sequential test of the acceptance of a mutation, from the fitnesses of
+    replicate simulations.
+    
+    Parameters
+    ----------
+    fitnesses : list of floats
+        Fitness of each replicate.
+    threshold : float
+        Fitness above which the mutation is accepted.
+    z : float, optional
+        Number of standard errors between the mean fitness and the
+        threshold needed to decide.
+    
+    Returns
+    -------
+    is_accepted : bool or None
+        True if the mean fitness is significantly above the threshold,
+        False if it is significantly below, None if more replicates are
+        needed (always with less than 2 replicates).
+    
+    >>> replicate_decision([.50, .52, .51], .3)
+    True
+    >>> print(replicate_decision([.1, .5], .3))
+    None
+    """
+    
+    if len(fitnesses) < 2:
+        return None
+    mean = np.mean(fitnesses)
+    standard_error = np.std(fitnesses, ddof=1) / np.sqrt(len(fitnesses))
+    if mean - threshold > z * standard_error:
+        return True
+    if threshold - mean > z * standard_error:
+        return False
+    return None
+
+
+def evaluate_replicates(simulate_replicates, target_freqs, threshold,
+                        max_replicates, replicate_batch=1, z=2.):
+    """
+    Simulate replicates of a proposal until its acceptance is decided.
+    
+    Parameters
+    ----------
+    simulate_replicates : callable
+        Function returning a list of n replicate expressions of the
+        proposal, given n.
+    target_freqs : Numpy array
+        Array of floats representing target relative expression level for
+        each gene (environment).
+    threshold : float
+        Fitness above which the proposal is accepted.
+    max_replicates : int
+        Maximal number of replicates. If the decision is still ambiguous,
+        it is made from the mean fitness.
+    replicate_batch : int, optional
+        Number of replicates simulated at once.
+    z : float, optional
+        Significance of the sequential test (see replicate_decision).
+    
+    Returns
+    -------
+    expression : Numpy array
+        Mean number of transcripts of each gene over the replicates.
+    fitness : float
+        Mean fitness of the replicates.
+    is_accepted : bool
+        Acceptance of the proposal.
+    nb_replicates : int
+        Number of simulated replicates.
+    
+    >>> expressions = iter([[1., 1.], [1., 1.1], [1., .9], [1., 1.]])
+    >>> evaluate_replicates(lambda n: [next(expressions) for k in range(n)],
+    ...                     np.array([.5, .5]), .88, 4)[2:]
+    (True, 4)
+    """
+    
+    expressions = []
+    fitnesses = []
+    is_accepted = None
+    while is_accepted is None and len(expressions) < max_replicates:
+        batch = simulate_replicates(min(replicate_batch,
+                                        max_replicates - len(expressions)))
+        expressions += batch
+        fitnesses += batch_fitness(np.asarray(batch), target_freqs).tolist()
+        is_accepted = replicate_decision(fitnesses, threshold, z)
+    if is_accepted is None:
+        is_accepted = bool(np.mean(fitnesses) > threshold)
+    return (np.mean(expressions, axis=0), float(np.mean(fitnesses)),
+            is_accepted, len(expressions))
+
+
+def evolution(start, end, barr, out, genome_size, initial_expression, previous_fitness, target_freqs, discret_step, q, inversion_proba, p_insertion, nb_generations, PARAMS, simulator=None, n_speculative=1,
+              return_genome=False, staging_folder=None, result_log=None,
+              keep_history=True, checkpoint_file=None,
+              checkpoint_interval=1000, resume_state=None, verbose=True,
+              observer=None, profile_file=None, simulation_timeout=None,
+              max_attempts=3, max_replicates=1, replicate_batch=2,
+              decision_z=2., surrogate=None, rng=None):
+    """
+    Simulate the evolution with a Monte-Carlo Metropolis algorithm. 
+    
+    Parameters
+    ----------
+    start : Numpy array
+        Array of ints representing the begining position of genes.
+    end : Numpy array
+        Array of ints representing the ending position of genes.
+    barr : Numpy array
+        Array of ints representing the position of barriers.
+    out : Python list
+        list of the open position intervals in the genome where there 
+        are not any genes   
+    genome_size : int
+        Genome size in base pair.
+    initial_expression : Numpy array
+        Array of ints representing the initial number of transcripts 
+        for each gene, ordered by gene ID.
+    previous_fitness : float
+        computed initial fitness of the invidual, following the formula:
+            .. math::
+            	fitness = \exp\left(-\sum\left|\ln\left(\\frac{observed\_for\_gene\_i}{target\_for\_gene\_i}\\right)\\right|\\right)
+    target_freqs : Numpy array
+        Array of floats representing target relative expression level for each gene.
+    discret_step : int
+        Size of an indel event (in base pairs)
+    inversion_proba : float
+        Probability for an event to be an inversion.
+    p_insertion : float
+        Probability for an indel event to be an insertion.
+    nb_generations : int
+        Number of generations to run the simulation.
+                
+    PARAMS : Python list
+        list of the following parameters:
+            NEXT_GEN_PARAMS : str
+                Path and name of the parameter file necessary for 
+                the expression_simulation function, at the next generation.
+            NEXT_GEN_GFF : str
+                Name of the .gff file (gene positions) at the next generation.
+            NEXT_GEN_TSS : str
+                Name of the TSS file (gene start positions) 
+                at the next generation.
+            NEXT_GEN_TTS : str
+                Name of the TTS file (gene end positions)
+                at the next generation.
+            NEXT_GEN_BARRIERS : str
+                Name of the .dat file containing barrier positions 
+                at the next generation.
+            LAST_ACCEPTED_GENOME : list of str
+                4 equivalent files where the last accepted genome is
+                saved at the end of the run (None to skip)
+    simulator : SimulatorBackend, optional
+        Simulator used to compute the expression of proposed genomes. By
+        default, TwisTranscripT is run in-process on the next generation
+        files of PARAMS.
+    n_speculative : int, optional
+        Number of proposals drawn from the current genome and simulated
+        concurrently in a process pool. Proposals are then considered in
+        order, one per generation, until one is accepted; the following
+        ones are discarded. As rejected proposals leave the genome
+        unchanged, this gives the same chain as the sequential algorithm
+        (n_speculative=1).
+    return_genome : bool, optional
+        If True, the last accepted genome is also returned.
+    staging_folder : str, optional
+        Folder where the simulated genomes are written for the simulation,
+        for instance a tmpfs folder (see isolated_params and
+        default_staging_folder). By default, they are written in the
+        genome files of the simulator (in a sub-folder of its folder for
+        speculative batches and replicates).
+    result_log : ResultLog, optional
+        Log where each generation is recorded as it is simulated.
+    keep_history : bool, optional
+        If False, the results lists are not filled (only their initial
+        value is returned), so that memory use does not grow with the
+        number of generations. Use it with result_log.
+    checkpoint_file : str, optional
+        File where the state of the run is saved every checkpoint_interval
+        generations, to continue it with resume. It is removed once the run
+        is complete.
+    checkpoint_interval : int, optional
+        Number of generations between two checkpoints.
+    resume_state : dict, optional
+        State loaded from a checkpoint (see resume).
+    verbose : bool, optional
+        If False, the generation messages are not printed.
+    observer : callable, optional
+        Function called after each generation with a dict describing it:
+        generation, event_type, event_positions, genome_size (of the
+        proposal), fitness (of the proposal), accepted, failures (number
+        of failed simulations before this one), replicates (number of
+        simulations of the proposal), surrogate_fitness (None until the
+        surrogate is fitted), screened (True if rejected by the
+        surrogate, without simulation), and timings, the
+        duration in seconds of each stage of the generation (mutation,
+        screening, simulation and the stages reported by the simulator,
+        fitness and acceptance, which are computed for the whole batch of
+        proposals and shared among them, history, checkpoint). See
+        StageTimer.
+    profile_file : str, optional
+        If given, the generation loop is profiled with cProfile and the
+        statistics are saved in this file (see the pstats module).
+    simulation_timeout : float, optional
+        Maximal duration of a simulation, in seconds. Simulations then run
+        in worker processes (see SimulatorPool), even if n_speculative is
+        1. No limit by default.
+    max_attempts : int, optional
+        Maximal number of simulations of a genome before a SimulationError
+        is raised.
+    max_replicates : int, optional
+        If above 1, the transcription noise is averaged out: replicates of
+        each proposal are simulated until a sequential test on their
+        fitnesses decides its acceptance, up to max_replicates (see
+        evaluate_replicates). The proposed fitness is then their mean
+        fitness, and the fitness of the accepted genome is kept, not
+        re-estimated. Requires n_speculative to be 1.
+    replicate_batch : int, optional
+        Number of replicates simulated at the same time, each one in its
+        own worker process.
+    decision_z : float, optional
+        Number of standard errors of the replicate fitnesses needed to
+        decide (see replicate_decision).
+    surrogate : SurrogateFitness, optional
+        If given, delayed acceptance is used once the surrogate is fitted:
+        a proposal is first accepted or rejected by the Metropolis
+        criterion on the surrogate fitnesses, without simulation. Only the
+        proposals passing this screening are simulated, and accepted with
+        the corrected criterion exp((fitness difference - surrogate
+        fitness difference) / q). Until then, simulated genomes are used to
+        fit the surrogate. Screened proposals have a nan fitness.
+    rng : numpy.random.Generator, optional
+        Random number generator of the chain, drawing the mutations and
+        the acceptances (see random_generator). The simulations are seeded
+        with seeds spawned from its seed (see SimulatorBackend.seed), one
+        per worker process, so that runs with the same rng and the same
+        n_speculative and replicate_batch are identical. Changing them
+        changes the run: discarded speculative proposals also draw from
+        rng, and each worker simulates with its own seed.
+                
+    Return
+    ----
+    accepted_fitnesses : list of floats
+        Evolution of the system fitness (only fixed mutations)
+    proposed_fitnesses : list of floats
+        Fitness following the proposed mutation (whether it is fixed or not)
+    accepted_status : list of str
+        For each generation, either "accepted" or "rejected" depending
+        on the status of the proposed mutation
+    all_types : list of str
+        For each generation, the mutation type: "insertion", "deletion"
+        or "inversion".
+    generation_numbers : list of ints
+        Number of each generation
+    final_expression : list of ints
+        Number of copies of each gene's transcript following the last 
+        expression simulation of the accepted genome.
+    final_genome : Genome
+        Only if return_genome is True. Last accepted genome.
+    """
+    
+    if simulator is None:
+        simulator = InProcessSimulator(PARAMS[0], PARAMS[1:5])
+    if max_replicates > 1 and n_speculative > 1:
+        raise ValueError("replicates require n_speculative to be 1")
+    if resume_state is not None:
+        rng = resume_state["rng"]
+    else:
+        rng = random_generator(rng)
+    seed_sequence = rng.bit_generator.seed_seq
+    failures = collections.Counter()
+    if max_replicates > 1 and replicate_batch > 1:
+        # Replicates of a proposal are simulated at the same time, each one
+        # on its own files
+        pool = SimulatorPool([simulator.isolated("replicate" + str(k),
+                                                 staging_folder)
+                              for k in range(replicate_batch)],
+                             simulation_timeout, max_attempts,
+                             seeds=seed_sequence.spawn(replicate_batch))
+        failures = pool.failures
+    elif n_speculative > 1:
+        # Proposals of a batch are simulated at the same time, each one on
+        # its own files
+        pool = SimulatorPool([simulator.isolated("speculative" + str(k),
+                                                 staging_folder)
+                              for k in range(n_speculative)],
+                             simulation_timeout, max_attempts,
+                             seeds=seed_sequence.spawn(n_speculative))
+        failures = pool.failures
+    else:
+        # Genomes simulated one at a time are written in the staging folder
+        # too
+        sequential_simulator = simulator
+        if staging_folder is not None:
+            sequential_simulator = simulator.isolated("staged",
+                                                      staging_folder)
+        if simulation_timeout is not None:
+            pool = SimulatorPool([sequential_simulator], simulation_timeout,
+                                 max_attempts, seeds=seed_sequence.spawn(1))
+            failures = pool.failures
+        else:
+            pool = None
+            if resume_state is None:
+                sequential_simulator.seed(seed_sequence.spawn(1)[0])
+            else:
+                # State of the simulations run in this process
+                sequential_simulator.random_state = resume_state[
+                        "simulator_state"]
+    if profile_file is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        genome = Genome(genome_size, start, end, barr, out)
+        final_expression = initial_expression
+        generation_numbers = range(nb_generations+1)
+        if resume_state is None:
+            # Initialize results lists
+            accepted_fitnesses = [previous_fitness]
+            proposed_fitnesses = [previous_fitness]
+            accepted_status = ["accepted"]
+            all_types = ["initial"]
+            generation = 0
+            if result_log is not None:
+                result_log.append(0, previous_fitness, previous_fitness, True,
+                                  "initial", genome.size)
+            if surrogate is not None:
+                surrogate.add(genome, previous_fitness)
+        else:
+            generation = resume_state["generation"]
+            if "history" in resume_state:
+                (accepted_fitnesses, proposed_fitnesses, accepted_status,
+                 all_types) = resume_state["history"]
+            else:
+                # The history is in the result log, up to the checkpoint
+                log_records = read_result_log(resume_state["result_log"])
+                log_records = log_records[:generation+1 if keep_history
+                                          else 1]
+                (accepted_fitnesses, proposed_fitnesses, accepted_status,
+                 all_types) = result_log_history(log_records)
+        last_checkpoint = generation
+        # Surrogate fitness of the current genome, once the surrogate is fitted
+        current_surrogate = None
+        while generation < nb_generations:
+            # Random evolutive events, all from the current genome
+            nb_proposals = min(n_speculative, nb_generations - generation)
+            start_time = time.perf_counter()
+            proposals = [mutate_genome(genome, discret_step, inversion_proba,
+                                       p_insertion, rng)
+                         for k in range(nb_proposals)]
+            mutation_time = (time.perf_counter() - start_time) / nb_proposals
+            # First stage of delayed acceptance: proposals are screened with
+            # the surrogate fitness
+            surrogate_fitnesses = [None] * nb_proposals
+            survivors = list(range(nb_proposals))
+            screening_time = 0
+            if surrogate is not None and surrogate.is_fitted:
+                start_time = time.perf_counter()
+                if current_surrogate is None:
+                    current_surrogate = surrogate.predict(genome)
+                surrogate_fitnesses = [surrogate.predict(new_genome) for
+                                       _, new_genome, _ in proposals]
+                survivors = np.flatnonzero(batch_accept_mutation(
+                        np.full(nb_proposals, current_surrogate),
+                        surrogate_fitnesses, q, rng)).tolist()
+                screening_time = ((time.perf_counter() - start_time)
+                                  / nb_proposals)
+            # The second stage compensates the surrogate fitness difference
+            surrogate_differences = [
+                    0. if surrogate_fitness is None
+                    else surrogate_fitness - current_surrogate
+                    for surrogate_fitness in surrogate_fitnesses]
+            # Simulate expression
+            start_time = time.perf_counter()
+            failures_before = (failures["error"] + failures["timeout"]
+                               + failures["crash"])
+            nb_replicates = 1
+            if not survivors:
+                expressions = {}
+                simulation_timings = {}
+            elif max_replicates > 1:
+                # Metropolis criterion, as a threshold on the proposed fitness
+                threshold = (previous_fitness + surrogate_differences[0]
+                             + q * np.log(rng.random()))
+                new_genome = proposals[0][1].as_tuple()
+                if pool is None:
+                    simulate_replicates = lambda n: [
+                            simulate_genome(sequential_simulator,
+                                            *new_genome,
+                                            max_attempts=max_attempts,
+                                            failures=failures)
+                            for k in range(n)]
+                else:
+                    simulate_replicates = lambda n: pool.simulate(
+                            [new_genome] * n)
+                (expression, replicate_fitness, replicate_acceptance,
+                 nb_replicates) = evaluate_replicates(
+                        simulate_replicates, target_freqs, threshold,
+                        max_replicates, replicate_batch, decision_z)
+                expressions = {0: expression}
+                simulation_timings = {}
+            elif pool is None:
+                expressions = {0: simulate_genome(sequential_simulator,
+                                                  *proposals[0][1].as_tuple(),
+                                                  max_attempts=max_attempts,
+                                                  failures=failures)}
+                simulation_timings = {
+                        "simulation." + stage: duration for stage, duration
+                        in sequential_simulator.stage_timings.items()}
+            else:
+                expressions = dict(zip(survivors, pool.simulate(
+                        [proposals[k][1].as_tuple() for k in survivors])))
+                simulation_timings = {}
+            nb_failures = (failures["error"] + failures["timeout"]
+                           + failures["crash"] - failures_before)
+            simulation_timings["simulation"] = time.perf_counter() - start_time
+            if max_replicates == 1:
+                # Fitness and Metropolis criterion of the whole batch,
+                # screened proposals having a nan fitness
+                start_time = time.perf_counter()
+                new_fitnesses = np.full(nb_proposals, np.nan)
+                if expressions:
+                    simulated = list(expressions)
+                    new_fitnesses[simulated] = batch_fitness(
+                            np.array([expressions[k] for k in simulated]),
+                            target_freqs)
+                fitness_time = ((time.perf_counter() - start_time)
+                                / nb_proposals)
+                start_time = time.perf_counter()
+                batch_acceptance = batch_accept_mutation(
+                        previous_fitness + np.array(surrogate_differences),
+                        new_fitnesses, q, rng)
+                acceptance_time = ((time.perf_counter() - start_time)
+                                   / nb_proposals)
+            records = []
+            for k, proposal in enumerate(proposals):
+                generation += 1
+                event_type, new_genome, event_positions = proposal
+                screened = k not in expressions
+                timings = {"mutation": mutation_time}
+                if surrogate_fitnesses[k] is not None:
+                    timings["screening"] = screening_time
+                if k == 0:
+                    # Simulations of a batch are reported with its first
+                    # generation
+                    timings.update(simulation_timings)
+                # Accept or reject the mutation.
+                if max_replicates > 1:
+                    new_fitness = np.nan if screened else replicate_fitness
+                    is_accepted = not screened and replicate_acceptance
+                else:
+                    new_fitness = new_fitnesses[k]
+                    is_accepted = bool(batch_acceptance[k])
+                    timings["fitness"] = fitness_time
+                    timings["acceptance"] = acceptance_time
+                if (surrogate is not None and not screened
+                        and not surrogate.is_fitted):
+                    surrogate.add(new_genome, new_fitness)
+                if verbose:
+                    print("Generation ", end="")
+                    print(generation, end=":\n")
+                    print(event_type + " event")
+                    print("Fitness: ", end="")
+                    print(new_fitness)
+                if is_accepted:
+                    final_expression = expressions[k]
+                    previous_fitness = new_fitness
+                    current_surrogate = surrogate_fitnesses[k]
+                    # The accepted genome stays in memory, its files are
+                    # written at the end of the run
+                    genome = new_genome
+                
+                # Keep track of each event
+                start_time = time.perf_counter()
+                if keep_history:
+                    accepted_status.append("accepted" if is_accepted
+                                           else "rejected")
+                    accepted_fitnesses.append(previous_fitness)
+                    proposed_fitnesses.append(new_fitness)
+                    all_types.append(event_type)
+                if result_log is not None:
+                    result_log.append(generation, previous_fitness,
+                                      new_fitness, is_accepted, event_type,
+                                      genome.size, *event_positions)
+                timings["history"] = time.perf_counter() - start_time
+                if observer is not None:
+                    records.append({"generation": generation,
+                                    "event_type": event_type,
+                                    "event_positions": event_positions,
+                                    "genome_size": new_genome.size,
+                                    "fitness": new_fitness,
+                                    "accepted": bool(is_accepted),
+                                    "failures": nb_failures if k == 0 else 0,
+                                    "replicates": 0 if screened
+                                                  else nb_replicates,
+                                    "surrogate_fitness":
+                                        surrogate_fitnesses[k],
+                                    "screened": screened,
+                                    "timings": timings})
+                if is_accepted:
+                    # Next proposals were drawn from the previous genome
+                    break
+            if (checkpoint_file is not None
+                    and generation >= last_checkpoint + checkpoint_interval):
+                start_time = time.perf_counter()
+                last_checkpoint = generation
+                if result_log is not None:
+                    result_log.flush()
+                arguments = dict(
+                        start=genome.start, end=genome.end,
+                        barr=genome.barriers, out=None,
+                        genome_size=genome.size,
+                        initial_expression=final_expression,
+                        previous_fitness=previous_fitness,
+                        target_freqs=target_freqs, discret_step=discret_step,
+                        q=q, inversion_proba=inversion_proba,
+                        p_insertion=p_insertion,
+                        nb_generations=nb_generations, PARAMS=PARAMS,
+                        simulator=simulator, n_speculative=n_speculative,
+                        return_genome=return_genome,
+                        staging_folder=staging_folder,
+                        keep_history=keep_history,
+                        checkpoint_interval=checkpoint_interval,
+                        verbose=verbose,
+                        simulation_timeout=simulation_timeout,
+                        max_attempts=max_attempts,
+                        max_replicates=max_replicates,
+                        replicate_batch=replicate_batch,
+                        decision_z=decision_z, surrogate=surrogate)
+                state = {"arguments": arguments,
+                         "generation": generation,
+                         "rng": rng,
+                         "simulator_state": (None if pool is not None else
+                                             sequential_simulator
+                                             .random_state),
+                         "result_log": (None if result_log is None
+                                        else result_log.filename)}
+                if result_log is None:
+                    state["history"] = (accepted_fitnesses,
+                                        proposed_fitnesses, accepted_status,
+                                        all_types)
+                # Otherwise, the records of the log up to generation are
+                # the history
+                save_checkpoint(checkpoint_file, state)
+                if records:
+                    records[-1]["timings"]["checkpoint"] = (time.perf_counter()
+                                                            - start_time)
+            for record in records:
+                observer(record)
+    finally:
+        # Workers and profiler are released even if the run fails
+        if profile_file is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_file)
+        if pool is not None:
+            pool.close()
+    if result_log is not None:
+        result_log.flush()
+    if PARAMS[-1] is not None:
+        update_files(genome.size, genome.start, genome.end, genome.barriers,
+                     *PARAMS[-1])
+    if checkpoint_file is not None and os.path.exists(checkpoint_file):
+        # The run is complete, there is nothing left to resume
+        os.remove(checkpoint_file)
+    
+    if return_genome:
+        return(accepted_fitnesses, proposed_fitnesses, accepted_status,
+               all_types, generation_numbers, final_expression, genome)
+    return(accepted_fitnesses, proposed_fitnesses, accepted_status, all_types,
+           generation_numbers, final_expression)
+
+
+class StageTimer:
+    """
+    Observer of evolution aggregating the duration of each stage, and
+    counting accepted mutations, simulations (nb_simulations), failed
+    simulations (nb_failures), decisions per number of replicates
+    (replicate_counts) and the screening of the surrogate fitness (see
+    surrogate_summary).
+    
+    Parameters
+    ----------
+    percentiles : list of floats, optional
+        Percentiles of the stage durations given by summary.
+    
+    >>> timer = StageTimer()
+    >>> for duration in [1., 2., 3.]:
+    ...     timer({"accepted": duration > 2, "timings": {"fitness": duration}})
+    >>> timer.summary()["fitness"]["p50"], timer.acceptance_rate()
+    (2.0, 0.3333333333333333)
+    """
+    
+    def __init__(self, percentiles=(50, 90, 99)):
+        self.percentiles = percentiles
+        self.timings = collections.defaultdict(list)
+        self.nb_generations = 0
+        self.nb_accepted = 0
+        self.nb_failures = 0
+        self.nb_simulations = 0
+        self.replicate_counts = collections.Counter()
+        self.nb_screenings = 0
+        self.nb_screened = 0
+        self.surrogate_predictions = []
+    
+    def __call__(self, record):
+        self.nb_generations += 1
+        self.nb_accepted += record["accepted"]
+        self.nb_failures += record.get("failures", 0)
+        self.nb_simulations += record.get("replicates", 1)
+        self.replicate_counts[record.get("replicates", 1)] += 1
+        if record.get("surrogate_fitness") is not None:
+            self.nb_screenings += 1
+            if record["screened"]:
+                self.nb_screened += 1
+            else:
+                self.surrogate_predictions.append(
+                        (record["surrogate_fitness"], record["fitness"]))
+        for stage, duration in record["timings"].items():
+            self.timings[stage].append(duration)
+    
+    def acceptance_rate(self):
+        """Return the proportion of accepted mutations."""
+        return self.nb_accepted / max(self.nb_generations, 1)
+    
+    def summary(self):
+        """
+        Return statistics of the duration of each stage.
+        
+        Returns
+        -------
+        summary : dict
+            For each stage, a dict with the number of measures (count), the
+            total and mean durations, and one entry per percentile (p50,
+            p90...), in seconds.
+        """
+        
+        summary = {}
+        for stage, durations in self.timings.items():
+            durations = np.asarray(durations)
+            summary[stage] = {"count": len(durations),
+                              "total": float(durations.sum()),
+                              "mean": float(durations.mean())}
+            for percentile in self.percentiles:
+                summary[stage]["p" + str(percentile)] = float(
+                        np.percentile(durations, percentile))
+        return summary
+    
+    def surrogate_summary(self):
+        """
+        Return statistics of the screening of proposals by the surrogate.
+        
+        Returns
+        -------
+        summary : dict
+            screening_rate, the proportion of screened proposals rejected
+            without simulation, and the mean_absolute_error and correlation
+            of the surrogate fitness with the simulated one, over the
+            simulated proposals. Values are nan when undefined.
+        """
+        
+        predictions = np.asarray(self.surrogate_predictions).reshape(-1, 2)
+        summary = {"screening_rate": (self.nb_screened / self.nb_screenings
+                                      if self.nb_screenings else np.nan),
+                   "mean_absolute_error": np.nan, "correlation": np.nan}
+        if len(predictions):
+            summary["mean_absolute_error"] = float(np.mean(np.abs(
+                    predictions[:, 0] - predictions[:, 1])))
+        if len(predictions) > 1 and np.all(np.std(predictions, axis=0)):
+            summary["correlation"] = float(np.corrcoef(predictions.T)[0, 1])
+        return summary
+
+
+def save_checkpoint(filename, state):
+    """
+    Save the state of a run.
+    
+    The state is first written to a temporary file, which then replaces
+    filename, so that an interrupted write never corrupts the previous
+    checkpoint.
+    
+    Parameters
+    ----------
+    filename : str
+        Path and name of the checkpoint file.
+    state : dict
+        State of the run (see evolution).
+    """
+    
+    temporary_filename = filename + ".tmp"
+    with open(temporary_filename, "wb") as checkpoint:
+        pickle.dump(state, checkpoint, protocol=pickle.HIGHEST_PROTOCOL)
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+    os.replace(temporary_filename, filename)
+
+
+def load_checkpoint(filename):
+    """
+    Load the state of a run saved by save_checkpoint.
+    
+    Parameters
+    ----------
+    filename : str
+        Path and name of the checkpoint file.
+    
+    Returns
+    -------
+    state : dict
+        State of the run.
+    """
+    
+    with open(filename, "rb") as checkpoint:
+        return pickle.load(checkpoint)
+
+
+def resume(checkpoint_file, result_log=None, observer=None,
+           profile_file=None):
+    """
+    Continue a run of evolution from its last checkpoint.
+    
+    The genome, fitness, results, simulator and the state of the random
+    generators (the one of the chain, and the global numpy one used by
+    simulations run in this process) are restored, so that the run
+    continues exactly as it would have without interruption, as long as
+    simulations run in this process (InProcessSimulator) or are
+    deterministic. Records written to the result log after the checkpoint
+    are dropped. If the run had a result log, the checkpoint only keeps
+    its number of records, and the results lists are read back from it.
+    
+    Parameters
+    ----------
+    checkpoint_file : str
+        Path and name of the checkpoint file given to evolution.
+    result_log : ResultLog, optional
+        Log where to record the next generations. By default, the log of
+        the interrupted run is reopened.
+    observer : callable, optional
+        Observer of the next generations (see evolution).
+    profile_file : str, optional
+        File where to save the profile of the next generations (see
+        evolution).
+        
+    Returns
+    -------
+    results : tuple
+        Results of evolution, for the whole run.
+    
+    >>> import tempfile
+    >>> def interrupt(record):
+    ...     if record["generation"] == 5:
+    ...         raise KeyboardInterrupt
+    >>> arguments = ([10, 60], [20, 50], [80], None, 100, np.array([8., 2.]),
+    ...              .5, np.array([.5, .5]), 2, 1e-2, .5, .5, 8, [None] * 6,
+    ...              SyntheticSimulator(10))
+    >>> with tempfile.TemporaryDirectory() as folder:
+    ...     checkpoint_file = os.path.join(folder, "run.checkpoint")
+    ...     with ResultLog(os.path.join(folder, "run.log")) as result_log:
+    ...         try:
+    ...             evolution(*arguments, result_log=result_log,
+    ...                       checkpoint_file=checkpoint_file,
+    ...                       checkpoint_interval=2, verbose=False,
+    ...                       observer=interrupt, rng=np.random.default_rng(1))
+    ...         except KeyboardInterrupt:
+    ...             pass
+    ...     resumed = resume(checkpoint_file)
+    >>> complete = evolution(*arguments, verbose=False,
+    ...                      rng=np.random.default_rng(1))
+    >>> resumed[:4] == complete[:4]
+    True
+    """
+    
+    state = load_checkpoint(checkpoint_file)
+    if result_log is not None or state["result_log"] is None:
+        return evolution(resume_state=state, result_log=result_log,
+                         checkpoint_file=checkpoint_file, observer=observer,
+                         profile_file=profile_file, **state["arguments"])
+    with ResultLog(state["result_log"],
+                   nb_records=state["generation"] + 1) as result_log:
+        return evolution(resume_state=state, result_log=result_log,
+                         checkpoint_file=checkpoint_file, observer=observer,
+                         profile_file=profile_file, **state["arguments"])
+
+
+#=======================================================================
+#                   SIMULATE AN ENSEMBLE OF CHAINS
+#=======================================================================
+def evolve_chain(tag, genome, expression, fitness, target_freqs,
+                 discret_step, q, inversion_proba, p_insertion,
+                 nb_generations, simulator, staging_folder=None, rng=None):
+    """
+    Run evolution in its own working files.
+    
+    Parameters
+    ----------
+    tag : str
+        Name of the sub-folder holding the chain files (see
+        isolated_params).
+    genome : Genome
+        Initial genome.
+    expression : Numpy array
+        Number of transcripts of each gene of the initial genome.
+    fitness : float
+        Fitness of the initial genome.
+    simulator : SimulatorBackend
+        Simulator to isolate in the chain files.
+    staging_folder : str, optional
+        Folder where to write the genome files given to the simulation
+        (see isolated_params).
+    rng : numpy.random.Generator, optional
+        Random number generator of the chain.
+    
+    Other parameters are the ones of evolution.
+    
+    Returns
+    -------
+    results : tuple
+        Results of evolution, including the last accepted genome.
+    rng : numpy.random.Generator
+        Random number generator of the chain, in its final state (the
+        chain runs in another process), to continue the chain.
+    """
+    
+    chain_simulator = simulator.isolated(tag, staging_folder)
+    if chain_simulator.params_file is None:
+        # Simulators without files (SyntheticSimulator)
+        PARAMS = [None] * 6
+    else:
+        # Same layout as isolated_params, without copying the files again
+        folder = os.path.dirname(simulator.params_file)
+        PARAMS = ([chain_simulator.params_file]
+                  + list(chain_simulator.genome_files)
+                  + [[os.path.join(folder, chain_simulator.tag, name)
+                      for name in ["last.gff", "lastTSS.dat", "lastTTS.dat",
+                                   "lastProt.dat"]]])
+    return evolution(genome.start, genome.end, genome.barriers, genome.out,
+                     genome.size, expression, fitness, target_freqs,
+                     discret_step, q, inversion_proba, p_insertion,
+                     nb_generations, PARAMS, chain_simulator,
+                     return_genome=True, rng=rng), rng
+
+
+def accept_swap(fitness_1, fitness_2, q_1, q_2, rng=None):
+    """
+    Accept or reject the exchange of genomes between two chains.
+    
+    Chain i samples genomes with a probability proportional to
+    exp(fitness / q_i), so the swap is accepted with probability
+    exp((fitness_2 - fitness_1) * (1/q_1 - 1/q_2)).
+    
+    Parameters
+    ----------
+    fitness_1, fitness_2 : float
+        Fitness of the current genome of each chain.
+    q_1, q_2 : float
+        Parameter q of each chain.
+    rng : numpy.random.Generator, optional
+        Random number generator (see random_generator).
+        
+    Returns
+    -------
+    is_accepted : bool
+        True if the swap is accepted, False else.
+        
+    >>> accept_swap(0.5, 0.5, 0.1, 0.2)
+    True
+    """
+    
+    log_ratio = (fitness_2 - fitness_1) * (1/q_1 - 1/q_2)
+    if log_ratio >= 0:
+        return True
+    rng = random_generator(rng)
+    return (rng.random() < np.exp(log_ratio))
+
+
+def run_ensemble(start, end, barr, genome_size, initial_expression,
+                 initial_fitness, target_freqs, discret_step, q_values,
+                 inversion_proba, p_insertion, nb_generations, simulator,
+                 swap_interval=None, nb_processes=None, staging_folder=None,
+                 seed=None):
+    """
+    Simulate several evolution chains at the same time.
+    
+    One chain is run for each value of q, in its own process and working
+    files. With parallel tempering (swap_interval given), chains are
+    stopped every swap_interval generations and neighbouring chains in
+    q_values exchange their genomes according to accept_swap, alternating
+    between even and odd pairs. Chains with a small q can then leave local
+    optima through the chains with a larger q.
+    
+    Parameters
+    ----------
+    start : Numpy array
+        Array of ints representing the begining position of genes.
+    end : Numpy array
+        Array of ints representing the ending position of genes.
+    barr : Numpy array
+        Array of ints representing the position of barriers.
+    genome_size : int
+        Genome size in base pair.
+    initial_expression : Numpy array
+        Array of ints representing the initial number of transcripts 
+        for each gene, ordered by gene ID.
+    initial_fitness : float
+        Fitness of the initial genome.
+    target_freqs : Numpy array
+        Array of floats representing target relative expression level for
+        each gene.
+    discret_step : int
+        Size of an indel event (in base pairs)
+    q_values : list of floats
+        Parameter q of each chain, sorted for parallel tempering.
+    inversion_proba : float
+        Probability for an event to be an inversion.
+    p_insertion : float
+        Probability for an indel event to be an insertion.
+    nb_generations : int
+        Number of generations to run each chain.
+    simulator : SimulatorBackend
+        Simulator used to compute the expression of proposed genomes. Each
+        chain works on an isolated copy of it.
+    swap_interval : int, optional
+        Number of generations between two genome exchanges. If None, chains
+        are independent.
+    nb_processes : int, optional
+        Maximal number of chains running at the same time. By default, one
+        per chain.
+    staging_folder : str, optional
+        Folder where to write the genome files given to the simulation
+        (see isolated_params).
+    seed : int or numpy.random.SeedSequence, optional
+        Root seed of the ensemble. Each chain, and the exchanges, get their
+        own random number generator, seeded with a seed spawned from it, so
+        that the results only depend on it, whatever nb_processes. By
+        default, drawn from the global NumPy random state (see
+        random_generator).
+    
+    Returns
+    -------
+    chains : list of tuples
+        For each value of q, the results of evolution (accepted_fitnesses,
+        proposed_fitnesses, accepted_status, all_types, generation_numbers,
+        final_expression).
+    swaps : list of tuples
+        For each attempted exchange, the generation, the index of the lower
+        chain of the pair and whether the exchange was accepted.
+    
+    >>> simulator = SyntheticSimulator(10)
+    >>> expression = simulator.simulate(100, [10, 60], [20, 50], [80])
+    >>> target = np.array([.5, .5])
+    >>> fitness = compute_fitness(expression, target)
+    >>> chains, swaps = run_ensemble(
+    ...         [10, 60], [20, 50], [80], 100, expression, fitness, target, 2,
+    ...         [1e-2, 1e-1], .5, .5, 6, simulator, swap_interval=2, seed=0)
+    >>> len(chains), len(chains[0][0]), swaps
+    (2, 7, [(4, 0, False)])
+    >>> serial_chains, _ = run_ensemble(
+    ...         [10, 60], [20, 50], [80], 100, expression, fitness, target, 2,
+    ...         [1e-2, 1e-1], .5, .5, 6, simulator, swap_interval=2,
+    ...         nb_processes=1, seed=0)
+    >>> [chain[:4] for chain in serial_chains] == [chain[:4] for chain in chains]
+    True
+    """
+    
+    nb_chains = len(q_values)
+    if swap_interval is None:
+        swap_interval = nb_generations
+    genomes = [Genome(genome_size, start, end, barr)] * nb_chains
+    expressions = [initial_expression] * nb_chains
+    fitnesses = [initial_fitness] * nb_chains
+    chains = [([initial_fitness], [initial_fitness], ["accepted"], ["initial"])
+              for k in range(nb_chains)]
+    swaps = []
+    tags = ["chain" + str(k) for k in range(nb_chains)]
+    # Independent streams for each chain, and for the exchanges
+    if seed is None:
+        seed = random_generator().bit_generator.seed_seq
+    elif not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seeds = seed.spawn(nb_chains + 1)
+    rngs = [np.random.default_rng(chain_seed) for chain_seed in seeds[:-1]]
+    swap_rng = np.random.default_rng(seeds[-1])
+    
+    generation = 0
+    with ProcessPoolExecutor(nb_processes or nb_chains) as executor:
+        while generation < nb_generations:
+            nb_steps = min(swap_interval, nb_generations - generation)
+            results = executor.map(evolve_chain, tags, genomes, expressions,
+                                   fitnesses, [target_freqs] * nb_chains,
+                                   [discret_step] * nb_chains, q_values,
+                                   [inversion_proba] * nb_chains,
+                                   [p_insertion] * nb_chains,
+                                   [nb_steps] * nb_chains,
+                                   [simulator] * nb_chains,
+                                   [staging_folder] * nb_chains, rngs)
+            for k, (result, rngs[k]) in enumerate(results):
+                # Drop the initial state, already recorded
+                for history, segment in zip(chains[k], result[:4]):
+                    history.extend(segment[1:])
+                expressions[k], genomes[k] = result[5], result[6]
+                fitnesses[k] = result[0][-1]
+            generation += nb_steps
+            if generation == nb_generations or nb_chains < 2:
+                continue
+            # Exchange genomes between neighbouring chains
+            parity = (generation // swap_interval) % 2
+            for k in range(parity, nb_chains - 1, 2):
+                is_accepted = accept_swap(fitnesses[k], fitnesses[k+1],
+                                          q_values[k], q_values[k+1],
+                                          swap_rng)
+                swaps.append((generation, k, bool(is_accepted)))
+                if is_accepted:
+                    for state in [genomes, expressions, fitnesses]:
+                        state[k], state[k+1] = state[k+1], state[k]
+    
+    generation_numbers = range(nb_generations+1)
+    return ([chain + (generation_numbers, expressions[k])
+             for k, chain in enumerate(chains)], swaps)
+              
+#=======================================================================
+#                   SIMULATE A POPULATION
+#=======================================================================
+# Summary of each generation of population_evolution
+POPULATION_DTYPE = np.dtype([("generation", np.int64),
+                             ("mean_fitness", np.float64),
+                             ("min_fitness", np.float64),
+                             ("max_fitness", np.float64),
+                             ("std_fitness", np.float64),
+                             ("mean_genome_size", np.float64),
+                             ("nb_insertions", np.int64),
+                             ("nb_deletions", np.int64),
+                             ("nb_inversions", np.int64),
+                             ("nb_parents", np.int64)])
+
+
+def simulate_population(simulator, genome_sizes, genes_start_pos,
+                        genes_end_pos, barriers_pos):
+    """
+    Simulate the expression of each genome of a population.
+    
+    Parameters
+    ----------
+    simulator : SimulatorBackend or SimulatorPool
+        Simulator of the genomes. A pool simulates as many genomes at the
+        same time as it has workers.
+    genome_sizes, genes_start_pos, genes_end_pos, barriers_pos : Numpy arrays
+        Genomes of the population (see batch_indel).
+    
+    Returns
+    -------
+    transcript_numbers : Numpy array
+        2-D array (genomes, genes) of the number of transcripts of each
+        gene.
+    """
+    
+    if not isinstance(simulator, SimulatorPool):
+        return simulator.simulate_batch(genome_sizes, genes_start_pos,
+                                        genes_end_pos, barriers_pos)
+    genomes = list(zip(genome_sizes, genes_start_pos, genes_end_pos,
+                       barriers_pos))
+    nb_workers = len(simulator.simulators)
+    expressions = []
+    for k in range(0, len(genomes), nb_workers):
+        expressions += simulator.simulate(genomes[k:k + nb_workers])
+    return np.array(expressions)
+
+
+def trace_lineages(parents, individuals):
+    """
+    Trace the ancestors of individuals of the last generation.
+    
+    Parameters
+    ----------
+    parents : Numpy array
+        2-D array of ints (generations, population size), index in the
+        previous generation of the parent of each individual.
+    individuals : Numpy array
+        Indices of individuals in the last generation.
+    
+    Returns
+    -------
+    lineages : Numpy array
+        2-D array of ints (generations + 1, individuals), index of the
+        ancestor of each individual in each generation.
+    
+    >>> trace_lineages(np.array([[1, 1, 0], [2, 0, 0]]), [0, 1])
+    array([[0, 1],
+           [2, 0],
+           [0, 1]])
+    """
+    
+    lineages = np.empty((len(parents) + 1, len(individuals)), dtype=np.int64)
+    lineages[-1] = individuals
+    for generation in range(len(parents), 0, -1):
+        lineages[generation - 1] = parents[generation - 1][
+                lineages[generation]]
+    return lineages
+
+
+def population_evolution(start, end, barr, genome_size, target_freqs,
+                         discret_step, inversion_proba, p_insertion,
+                         nb_generations, population_size, simulator,
+                         rng=None, mutation_proba=1., nb_lineages=10,
+                         nb_workers=1, staging_folder=None,
+                         simulation_timeout=None, max_attempts=3):
+    """
+    Simulate the evolution of a population (Wright-Fisher model).
+    
+    The population starts with population_size copies of the genome. At
+    each generation, each genome undergoes an evolutive event with
+    probability mutation_proba (see batch_mutate), the mutants are
+    simulated, and the next generation is drawn from them with a
+    probability proportional to their fitness. Genomes are held as 2-D
+    position arrays (one line per genome). The fitness of a genome that is
+    not mutated is not simulated again.
+    
+    Parameters
+    ----------
+    start : Numpy array
+        Array of ints representing the begining position of genes.
+    end : Numpy array
+        Array of ints representing the ending position of genes.
+    barr : Numpy array
+        Array of ints representing the position of barriers.
+    genome_size : int
         Genome size in base pair.
-    initial_expression : Numpy array
-        Array of ints representing the initial number of transcripts 
-        for each gene, ordered by gene ID.
-    previous_fitness : float
-        computed initial fitness of the invidual, following the formula:
-            .. math::
-            	fitness = \exp\left(-\sum\left|\ln\left(\\frac{observed\_for\_gene\_i}{target\_for\_gene\_i}\\right)\\right|\\right)
     target_freqs : Numpy array
-        Array of floats representing target relative expression level for each gene.
+        Array of floats representing target relative expression level for
+        each gene (environment).
     discret_step : int
         Size of an indel event (in base pairs)
     inversion_proba : float
@@ -690,150 +4136,1064 @@ def evolution(start, end, barr, out, genome_size, initial_expression, previous_f
     p_insertion : float
         Probability for an indel event to be an insertion.
     nb_generations : int
-        Number of generations to run the simulation.
-                
-    PARAMS : Python list
-        list of the following parameters:
-            NEXT_GEN_PARAMS : str
-                Path and name of the parameter file necessary for 
-                the expression_simulation function, at the next generation.
-            NEXT_GEN_GFF : str
-                Name of the .gff file (gene positions) at the next generation.
-            NEXT_GEN_TSS : str
-                Name of the TSS file (gene start positions) 
-                at the next generation.
-            NEXT_GEN_TTS : str
-                Name of the TTS file (gene end positions)
-                at the next generation.
-            NEXT_GEN_BARRIERS : str
-                Name of the .dat file containing barrier positions 
-                at the next generation.
-            LAST_ACCEPTED_GENOME : list of str
-                5 equivalent files for the last genome to save
-                
-    Return
-    ----
-    accepted_fitnesses : list of floats
-        Evolution of the system fitness (only fixed mutations)
-    proposed_fitnesses : list of floats
-        Fitness following the proposed mutation (whether it is fixed or not)
-    accepted_status : list of str
-        For each generation, either "accepted" or "rejected" depending
-        on the status of the proposed mutation
-    all_types : list of str
-        For each generation, the mutation type: "insertion", "deletion"
-        or "inversion".
-    generation_numbers : list of ints
-        Number of each generation
-    final_expression : list of ints
-        Number of copies of each gene's transcript following the last 
-        expression simulation of the accepted genome.
+        Number of generations.
+    population_size : int
+        Number of genomes of the population.
+    simulator : SimulatorBackend
+        Simulator of the genomes.
+    rng : numpy.random.Generator, optional
+        Random generator of the events and of the selection. The
+        simulations are seeded with seeds spawned from its seed (see
+        SimulatorBackend.seed). By default, see random_generator.
+    mutation_proba : float, optional
+        Probability for a genome to undergo an event at each generation.
+    nb_lineages : int, optional
+        Number of lineages returned, those of the fittest genomes of the
+        last generation.
+    nb_workers : int, optional
+        Number of worker processes simulating the genomes, each one on its
+        own files (see SimulatorPool). If 1, the genomes are simulated in
+        the current process with simulator.simulate_batch.
+    staging_folder : str, optional
+        Folder where to write the genome files of the workers (see
+        isolated_params).
+    simulation_timeout : float, optional
+        Maximal duration of a simulation of a worker, in seconds.
+    max_attempts : int, optional
+        Maximal number of simulations of a genome.
+    
+    Returns
+    -------
+    summary : Numpy array
+        Array of POPULATION_DTYPE, one record per generation (the first one
+        for the initial population). Events are counted in the mutants,
+        before selection, and nb_parents is the number of mutants with
+        offspring.
+    lineages : dict
+        "indices", 2-D array (generations + 1, nb_lineages) of the index
+        of the ancestors of the fittest genomes in each generation (see
+        trace_lineages), and "fitnesses", their fitness.
+    population : tuple of Numpy arrays
+        Genome sizes, gene starts, gene ends, barriers and fitnesses of
+        the last generation.
+    
+    >>> summary, lineages, population = population_evolution(
+    ...         [10, 60], [20, 50], [80], 100, np.array([.5, .5]), 2, .5, .5,
+    ...         5, 20, SyntheticSimulator(10), np.random.default_rng(0))
+    >>> summary["generation"]
+    array([0, 1, 2, 3, 4, 5])
+    >>> lineages["indices"].shape, population[1].shape
+    ((6, 10), (20, 2))
     """
     
-    # Initialize results lists
-    accepted_fitnesses = [previous_fitness]
-    proposed_fitnesses = [previous_fitness]
-    accepted_status = ["accepted"]
-    all_types = ["initial"]
+    rng = random_generator(rng)
+    genome_sizes = np.full(population_size, genome_size, dtype=np.int64)
+    genes_start_pos = np.tile(np.asarray(start, dtype=np.int64),
+                              (population_size, 1))
+    genes_end_pos = np.tile(np.asarray(end, dtype=np.int64),
+                            (population_size, 1))
+    barriers_pos = np.tile(np.asarray(barr, dtype=np.int64),
+                           (population_size, 1))
+    if nb_workers > 1:
+        evaluator = SimulatorPool([simulator.isolated("population" + str(k),
+                                                      staging_folder)
+                                   for k in range(nb_workers)],
+                                  simulation_timeout, max_attempts,
+                                  seeds=rng.bit_generator.seed_seq.spawn(
+                                          nb_workers))
+    else:
+        evaluator = simulator
+        simulator.seed(rng.bit_generator.seed_seq.spawn(1)[0])
+    try:
+        fitnesses = batch_fitness(simulate_population(
+                evaluator, genome_sizes, genes_start_pos, genes_end_pos,
+                barriers_pos), target_freqs)
+        
+        summary = np.zeros(nb_generations + 1, dtype=POPULATION_DTYPE)
+        # Compact history, for the lineages
+        parents_history = np.empty((nb_generations, population_size),
+                                   dtype=np.int32)
+        fitness_history = np.empty((nb_generations + 1, population_size),
+                                   dtype=np.float32)
+        fitness_history[0] = fitnesses
+        summary[0] = (0, fitnesses.mean(), fitnesses.min(), fitnesses.max(),
+                      fitnesses.std(), genome_sizes.mean(), 0, 0, 0,
+                      population_size)
+        for generation in range(1, nb_generations + 1):
+            # Mutate
+            mutated = rng.random(population_size) < mutation_proba
+            (genome_sizes, genes_start_pos, genes_end_pos, barriers_pos,
+             event_types) = batch_mutate(discret_step, inversion_proba,
+                                         p_insertion, genome_sizes,
+                                         genes_start_pos, genes_end_pos,
+                                         barriers_pos, rng, mutated)
+            if np.any(mutated):
+                fitnesses = fitnesses.copy()
+                fitnesses[mutated] = batch_fitness(simulate_population(
+                        evaluator, genome_sizes[mutated],
+                        genes_start_pos[mutated], genes_end_pos[mutated],
+                        barriers_pos[mutated]), target_freqs)
+            # Select the next generation
+            parents = rng.choice(population_size, population_size,
+                                 p=fitnesses / fitnesses.sum())
+            genome_sizes = genome_sizes[parents]
+            genes_start_pos = genes_start_pos[parents]
+            genes_end_pos = genes_end_pos[parents]
+            barriers_pos = barriers_pos[parents]
+            fitnesses = fitnesses[parents]
+            
+            parents_history[generation - 1] = parents
+            fitness_history[generation] = fitnesses
+            event_counts = np.bincount(event_types + 1,
+                                       minlength=len(EVENT_TYPES) + 1)
+            summary[generation] = (
+                    generation, fitnesses.mean(), fitnesses.min(),
+                    fitnesses.max(), fitnesses.std(), genome_sizes.mean(),
+                    event_counts[EVENT_TYPES.index("insertion") + 1],
+                    event_counts[EVENT_TYPES.index("deletion") + 1],
+                    event_counts[EVENT_TYPES.index("inversion") + 1],
+                    len(np.unique(parents)))
+    finally:
+        # Workers are stopped even if the run is interrupted
+        if nb_workers > 1:
+            evaluator.close()
     
-    generation_numbers = range(nb_generations+1)
-    for generation in generation_numbers[1:]:
-        # Random evolutive event
-        event_type, new_size, new_start, new_end, new_barr = (
-                evolutive_event(discret_step, inversion_proba, genome_size, start, end,
-                                barr, out, p_insertion))
-        # Update parameter files and run expression simulation.
-        update_files(new_size, new_start, new_end, new_barr, PARAMS[1],
-                     PARAMS[2], PARAMS[3], PARAMS[4])
-        # Simulate expression
-        error = True
-        while(error):
+    fittest = np.argsort(fitnesses, kind="stable")[::-1][:nb_lineages]
+    indices = trace_lineages(parents_history, fittest)
+    lineages = {"indices": indices,
+                "fitnesses": np.take_along_axis(fitness_history, indices,
+                                                axis=1)}
+    return summary, lineages, (genome_sizes, genes_start_pos, genes_end_pos,
+                               barriers_pos, fitnesses)
+
+
+#=======================================================================
+#                   DISTRIBUTE JOBS OVER THE NETWORK
+#=======================================================================
+# Default port of the coordinator, and environment variable giving the
+# authentication key shared by the coordinator and its workers
+COORDINATOR_PORT = 6571
+AUTHKEY_VARIABLE = "OURCODE_AUTHKEY"
+
+
+class JobError(RuntimeError):
+    """Raised when a job failed on its workers, or was lost, too often."""
+
+
+def parse_address(address, default_port=COORDINATOR_PORT):
+    """
+    Read a network address.
+    
+    Parameters
+    ----------
+    address : str
+        "host:port", or "host" for the default port.
+    default_port : int, optional
+        Port used if address gives none.
+    
+    Returns
+    -------
+    address : tuple
+        Host and port.
+    
+    >>> parse_address("node1:7000"), parse_address("node1")
+    (('node1', 7000), ('node1', 6571))
+    """
+    
+    host, _, port = address.rpartition(":")
+    if not host:
+        return (address, default_port)
+    return (host, int(port))
+
+
+class Coordinator:
+    """
+    Job queue served over TCP to workers running on any host (see Worker).
+    
+    Jobs are either "chain" jobs, run_job options (see expand_sweep), or
+    "simulation" jobs, a (simulator, genome) tuple. Workers pull one job at
+    a time when they are idle, and send heartbeats while they run it. A job
+    whose worker disconnects or stays silent for heartbeat_timeout seconds
+    is requeued, as is a job raising an error, until it has failed
+    max_attempts times. Failures are counted in the failures Counter, under
+    the "error" and "lost" keys. submit blocks while max_pending jobs wait
+    for a worker, so that producing jobs faster than the workers run them
+    does not fill the memory.
+    
+    Messages are pickled and authenticated with authkey (see
+    multiprocessing.connection): only give it to trusted workers.
+    
+    Parameters
+    ----------
+    address : tuple
+        Host and port to listen on. Port 0 picks a free port, given by the
+        address attribute.
+    authkey : bytes
+        Key shared with the workers.
+    heartbeat_timeout : float, optional
+        Silence after which a worker is considered lost, in seconds.
+    max_pending : int, optional
+        Maximal number of jobs waiting for a worker.
+    max_attempts : int, optional
+        Maximal number of runs of a job before a JobError is raised.
+    poll_interval : float, optional
+        Waiting time between two checks of a worker connection, in seconds.
+    
+    >>> with Coordinator(("localhost", 0), b"key") as coordinator:
+    ...     worker = multiprocessing.Process(
+    ...             target=Worker(coordinator.address, b"key").run)
+    ...     worker.start()
+    ...     coordinator.map("simulation", [(SyntheticSimulator(10),
+    ...                                     (100, [10, 60], [20, 50], [80]))])
+    [array([8., 2.])]
+    >>> worker.join()
+    """
+    
+    JOB_KINDS = ("chain", "simulation")
+    
+    def __init__(self, address, authkey, heartbeat_timeout=30.,
+                 max_pending=64, max_attempts=3, poll_interval=0.1):
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.failures = collections.Counter()
+        self.nb_workers = 0
+        self._authkey = authkey
+        self._listener = multiprocessing.connection.Listener(
+                address, authkey=authkey)
+        self.address = self._listener.address
+        self._condition = threading.Condition()
+        self._jobs = {}
+        self._attempts = collections.Counter()
+        self._pending = collections.deque()
+        self._results = {}
+        self._next_job = 0
+        self._closed = False
+        self._accept_thread = threading.Thread(target=self._accept,
+                                               daemon=True)
+        self._accept_thread.start()
+    
+    def _accept(self):
+        while True:
             try:
-                new_expression = expression_simulation(PARAMS[0], "out.txt", new_start)
-                new_fitness = compute_fitness(new_expression, target_freqs)
-                error = False
-            except:
-                pass
-        # Accept or reject the mutation.
-        print("Generation ", end="")
-        print(generation, end=":\n")
-        print(event_type + " event")
-        print("Fitness: ", end="")
-        print(new_fitness)        
-        if accept_mutation(previous_fitness, new_fitness, q):
-            final_expression = new_expression
-            accepted_status.append("accepted")
-            previous_fitness = new_fitness
-            genome_size, start, end, barr = new_size, new_start, new_end, new_barr
-            out = pos_out_from_pos_lists(start, end, barr)
-            copy_genome(PARAMS[1:])
-        else:
-            accepted_status.append("rejected")
-            
-        # Keep track of each event
-        accepted_fitnesses.append(previous_fitness)
-        proposed_fitnesses.append(new_fitness)
-        all_types.append(event_type)
+                connection = self._listener.accept()
+            except multiprocessing.AuthenticationError:
+                continue
+            except OSError:
+                return
+            if self._closed:
+                connection.close()
+                return
+            with self._condition:
+                self.nb_workers += 1
+            threading.Thread(target=self._serve, args=(connection,),
+                             daemon=True).start()
     
-    return(accepted_fitnesses, proposed_fitnesses, accepted_status, all_types,
-           generation_numbers, final_expression)
-              
-if __name__=="__main__":
-    # Input and output files
-    # Initial parameter files
-    PARAM_FOLDER = "TwisTranscripT/"
-    INITIAL_PARAMETERS = PARAM_FOLDER + "params.ini" # name of the file containing the initial parameter values necessary for the expression_simulation function
-    ENVIRONMENT = "environment.dat"
-    # Intermediate generations parameter files
-    NEXT_GEN_PARAMS = PARAM_FOLDER + "params_nextGen.ini"
-    NEXT_GEN_GFF = PARAM_FOLDER + "nextGen/nextGen.gff"
-    NEXT_GEN_TSS = PARAM_FOLDER + "nextGen/nextGenTSS.dat"
-    NEXT_GEN_TTS = PARAM_FOLDER + "nextGen/nextGenTTS.dat"
-    NEXT_GEN_BARRIERS = PARAM_FOLDER + "nextGen/nextGenProt.dat"
-    # Last generation parameter files
-    LAST_ACCEPTED_GENOME = [PARAM_FOLDER + "nextGen/last.gff",PARAM_FOLDER + "nextGen/lastTSS.dat",PARAM_FOLDER + "nextGen/lastTTS.dat",PARAM_FOLDER + "nextGen/lastProt.dat"]
-    # Parameters to input in the evolution function
-    PARAMS = [NEXT_GEN_PARAMS, NEXT_GEN_GFF, NEXT_GEN_TSS, NEXT_GEN_TTS, NEXT_GEN_BARRIERS, LAST_ACCEPTED_GENOME]
-    # Color map for final plotting
-    COLORS = {"initial" : "black", "deletion" : "red", "insertion" : "green", "inversion" : "purple"}
-    
-    # Inputs for the evolution function
-    # Recommended values are indicated in comments
-    target_freqs = target_expression(ENVIRONMENT)
-    output_filename = input("path and name of the output csv file: ") # out.csv
-    discret_step = int(input("Unit of length in base pairs that is deleted or inserted: ")) # 60
-    inversion_proba = float(input("Probability for an evolutive event to be an inversion: ")) # 0.5
-    p_insertion = float(input("Probability for an indel event to be an insertion: ")) # 0.5
-    nb_generations = int(input("Number of generations: ")) # 30
-    q = float(input("Value of q : ")) # 0.00002
-
-    # Process the initial genome
-    start, end, barr, out, size = pos_out_genes(INITIAL_PARAMETERS, PARAM_FOLDER)
-    initial_expression = expression_simulation(INITIAL_PARAMETERS, "out.txt", start)
-    previous_fitness = compute_fitness(initial_expression, target_freqs)
-
-    # Simulate evolution
-    (accepted_fitnesses, proposed_fitnesses, accepted_status, all_types,
-     generation_numbers, final_expression) = evolution(start, end, barr, out, size,
-                                     initial_expression, previous_fitness, target_freqs, discret_step, q, inversion_proba, p_insertion, nb_generations, PARAMS)
-                                     
-    # Print and plot results
-    print("initial expression", initial_expression)
-    print("final expression", final_expression)
+    def _take_job(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending or self._closed,
+                                     self.poll_interval)
+            if not self._pending:
+                return None
+            job_id = self._pending.popleft()
+            # A job left the queue: submit can add one
+            self._condition.notify_all()
+            return job_id
+    
+    def _serve(self, connection):
+        # Job running on the worker, and whether the worker waits for one
+        job_id = None
+        is_idle = False
+        last_message = time.monotonic()
+        try:
+            while True:
+                if is_idle:
+                    job_id = self._take_job()
+                    if job_id is not None:
+                        kind, payload = self._jobs[job_id]
+                        connection.send(("job", job_id, kind, payload))
+                        is_idle = False
+                    elif self._closed:
+                        connection.send(("stop",))
+                        return
+                if connection.poll(0 if is_idle else self.poll_interval):
+                    message = connection.recv()
+                    last_message = time.monotonic()
+                    if message[0] == "request":
+                        is_idle = True
+                    elif message[0] in ("result", "error"):
+                        self._finish(*message)
+                        job_id = None
+                elif time.monotonic() - last_message > self.heartbeat_timeout:
+                    raise TimeoutError("no heartbeat from the worker")
+        except (EOFError, OSError):
+            # Lost worker, its job goes back to the queue
+            if job_id is not None:
+                self._retry(job_id, "lost", "worker lost")
+        finally:
+            connection.close()
+            with self._condition:
+                self.nb_workers -= 1
+    
+    def _finish(self, status, job_id, value):
+        if status == "error":
+            self._retry(job_id, "error", value)
+            return
+        with self._condition:
+            self._results[job_id] = ("result", value)
+            del self._jobs[job_id]
+            self._condition.notify_all()
+    
+    def _retry(self, job_id, reason, message):
+        with self._condition:
+            self.failures[reason] += 1
+            self._attempts[job_id] += 1
+            if self._attempts[job_id] < self.max_attempts:
+                self._pending.appendleft(job_id)
+            else:
+                self._results[job_id] = ("error", "job " + str(job_id)
+                                         + " failed " + str(self.max_attempts)
+                                         + " times, last error: " + message)
+                del self._jobs[job_id]
+            self._condition.notify_all()
+    
+    def submit(self, kind, payload):
+        """Add a job to the queue, waiting while it is full.
+        
+        Parameters
+        ----------
+        kind : str
+            "chain" or "simulation".
+        payload : dict or tuple
+            Options of run_job for a chain, (simulator, genome) for a
+            simulation, genome being a (genome_size, genes_start_pos,
+            genes_end_pos, barriers_pos) tuple.
+        
+        Returns
+        -------
+        job_id : int
+            Identifier of the job, to get its result.
+        """
+        
+        if kind not in self.JOB_KINDS:
+            raise ValueError("unknown job kind: " + str(kind))
+        with self._condition:
+            self._condition.wait_for(
+                    lambda: len(self._pending) < self.max_pending)
+            job_id = self._next_job
+            self._next_job += 1
+            self._jobs[job_id] = (kind, payload)
+            self._pending.append(job_id)
+            self._condition.notify_all()
+        return job_id
+    
+    def as_completed(self, job_ids, timeout=None):
+        """Yield the results of jobs as they complete.
+        
+        Parameters
+        ----------
+        job_ids : list of ints
+            Identifiers of the jobs (see submit).
+        timeout : float, optional
+            Maximal waiting time for each result, in seconds. No limit by
+            default.
+        
+        Yields
+        ------
+        job_id : int
+            Identifier of the completed job.
+        result
+            Summary of a chain (see run_job) or expression of a simulation.
+        
+        Note
+        ----
+        Raise a JobError if a job failed max_attempts times, and a
+        TimeoutError if no result comes within timeout.
+        """
+        
+        remaining = set(job_ids)
+        while remaining:
+            with self._condition:
+                if not self._condition.wait_for(
+                        lambda: not remaining.isdisjoint(self._results),
+                        timeout):
+                    raise TimeoutError("no result within " + str(timeout)
+                                       + " s")
+                job_id = min(remaining.intersection(self._results))
+                status, value = self._results.pop(job_id)
+            remaining.remove(job_id)
+            if status == "error":
+                raise JobError(value)
+            yield job_id, value
+    
+    def map(self, kind, payloads, timeout=None):
+        """Run jobs of the same kind and return their results in order.
+        
+        See submit and as_completed.
+        """
+        
+        job_ids = [self.submit(kind, payload) for payload in payloads]
+        results = dict(self.as_completed(job_ids, timeout))
+        return [results[job_id] for job_id in job_ids]
+    
+    def close(self):
+        """Stop the workers once they are idle, and stop listening."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        try:
+            # Wake the thread waiting for connections
+            multiprocessing.connection.Client(self.address,
+                                              authkey=self._authkey).close()
+        except OSError:
+            pass
+        self._accept_thread.join()
+        self._listener.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exception):
+        self.close()
+
+
+class Worker:
+    """
+    Runner of the jobs of a Coordinator, possibly on another host.
+    
+    The worker pulls one job at a time, runs it and sends back its result:
+    the summary of run_job for a chain job, and the expression for a
+    simulation job. Heartbeats are sent during long jobs. Paths of the jobs
+    (run_job folder, environment and output, simulator parameter files,
+    TwisTranscripT script) are relative to the working directory, root if
+    given. Simulation jobs run on their own genome files, in a sub-folder
+    named after the worker (see SimulatorBackend.isolated), so several
+    workers can share a host.
+    
+    Parameters
+    ----------
+    address : tuple
+        Host and port of the coordinator.
+    authkey : bytes
+        Key shared with the coordinator.
+    name : str, optional
+        Name of the worker. By default, the host name and process id.
+    root : str, optional
+        Working directory of the worker, where job paths are resolved. By
+        default, the current one.
+    staging_folder : str, optional
+        Folder where to write the genome files of simulation jobs, and of
+        chain jobs that do not give their own (see isolated_params).
+    heartbeat_interval : float, optional
+        Time between two heartbeats, in seconds. It must stay well below
+        the heartbeat_timeout of the coordinator.
+    connect_timeout : float, optional
+        Time during which connecting to a coordinator not started yet is
+        retried, in seconds.
+    seed : int or numpy.random.SeedSequence, optional
+        Seed of the simulations (see SimulatorBackend.seed). By default,
+        seeded from fresh entropy.
+    """
+    
+    def __init__(self, address, authkey, name=None, root=None,
+                 staging_folder=None, heartbeat_interval=5.,
+                 connect_timeout=30., seed=None):
+        self.address = address
+        self.name = name
+        self.root = root
+        self.staging_folder = staging_folder
+        self.heartbeat_interval = heartbeat_interval
+        self.connect_timeout = connect_timeout
+        self.seed = seed
+        self._authkey = authkey
+    
+    def _connect(self):
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                return multiprocessing.connection.Client(
+                        self.address, authkey=self._authkey)
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(min(1., self.connect_timeout))
+    
+    def _heartbeat(self, connection, lock, stopped):
+        while not stopped.wait(self.heartbeat_interval):
+            try:
+                with lock:
+                    connection.send(("heartbeat",))
+            except OSError:
+                return
+    
+    def run_chain(self, job):
+        """Run evolution with the options of job (see run_job), in the
+        staging folder of the worker unless the job gives one."""
+        if job["staging_folder"] is None:
+            job = dict(job, staging_folder=self.staging_folder)
+        return _run_sweep_job(job)
+    
+    def run_simulation(self, payload):
+        """Simulate a genome, from a (simulator, genome) tuple."""
+        simulator, genome = payload
+        simulator = simulator.isolated(self.name, self.staging_folder)
+        simulator.seed(self._seed_sequence.spawn(1)[0])
+        return simulator.simulate(*genome)
+    
+    def run(self):
+        """Run jobs until the coordinator stops or disappears.
+        
+        Returns
+        -------
+        nb_jobs : int
+            Number of jobs run.
+        """
+        
+        if self.root is not None:
+            os.chdir(self.root)
+        if self.name is None:
+            self.name = socket.gethostname() + "-" + str(os.getpid())
+        self._seed_sequence = self.seed
+        if not isinstance(self.seed, np.random.SeedSequence):
+            self._seed_sequence = np.random.SeedSequence(self.seed)
+        handlers = {"chain": self.run_chain,
+                    "simulation": self.run_simulation}
+        connection = self._connect()
+        # Heartbeats are sent from another thread, while jobs run
+        lock = threading.Lock()
+        stopped = threading.Event()
+        threading.Thread(target=self._heartbeat,
+                         args=(connection, lock, stopped),
+                         daemon=True).start()
+        nb_jobs = 0
+        try:
+            while True:
+                with lock:
+                    connection.send(("request",))
+                message = connection.recv()
+                if message[0] == "stop":
+                    return nb_jobs
+                _, job_id, kind, payload = message
+                try:
+                    answer = ("result", job_id, handlers[kind](payload))
+                except Exception as error:
+                    answer = ("error", job_id, repr(error))
+                with lock:
+                    connection.send(answer)
+                nb_jobs += 1
+        except (EOFError, OSError):
+            # The coordinator stopped
+            return nb_jobs
+        finally:
+            stopped.set()
+            connection.close()
+
+
+#=======================================================================
+#                   COMMAND LINE INTERFACE
+#=======================================================================
+# Options of a run, with their type and default value (recommended values
+# of the simulation parameters)
+RUN_OPTIONS = {"folder": (str, "TwisTranscripT/"),
+               "params": (str, "params.ini"),
+               "next_gen_params": (str, "params_nextGen.ini"),
+               "environment": (str, "environment.dat"),
+               "discret_step": (int, 60),
+               "inversion_proba": (float, 0.5),
+               "p_insertion": (float, 0.5),
+               "nb_generations": (int, 30),
+               "q": (float, 0.00002),
+               "n_speculative": (int, 1),
+               "checkpoint_interval": (int, 0),
+               "simulation_timeout": (float, None),
+               "max_attempts": (int, 3),
+               "max_replicates": (int, 1),
+               "replicate_batch": (int, 2),
+               "decision_z": (float, 2.),
+               "surrogate_warmup": (int, 0),
+               "seed": (int, None),
+               "staging_folder": (str, None),
+               "output": (str, "out.csv")}
+# Color map for final plotting
+COLORS = {"initial" : "black", "deletion" : "red", "insertion" : "green", "inversion" : "purple"}
+
+
+def read_config(filename, section="evolution"):
+    """
+    Read run options from a .ini file.
+    
+    Each option of RUN_OPTIONS can be given in the section, as a single
+    value or as a comma-separated list of values (for sweeps).
+    
+    Parameters
+    ----------
+    filename : str
+        Path and name of the configuration file.
+    section : str, optional
+        Section of the file holding the options.
+    
+    Returns
+    -------
+    options : dict
+        For each option found, the list of its values.
+    """
+    
+    config = configparser.ConfigParser()
+    with open(filename, "r") as config_file:
+        config.read_file(config_file)
+    options = {}
+    for name, value in config[section].items():
+        if name not in RUN_OPTIONS:
+            raise ValueError("Unknown option in " + filename + ": " + name)
+        option_type = RUN_OPTIONS[name][0]
+        options[name] = [option_type(x.strip()) for x in value.split(",")]
+    return options
+
+
+def run_job(job, observer=None, profile_file=None, keep_history=False):
+    """
+    Run evolution with given options, in its own files.
+    
+    Parameters
+    ----------
+    job : dict
+        Value of each option of RUN_OPTIONS, and "tag", the name of the
+        job. Unless tag is None, the genome files of the job are isolated
+        (see isolated_params), and its outputs are written in a tag
+        sub-folder of the output folder.
+    observer : callable, optional
+        Observer of the generations (see evolution).
+    profile_file : str, optional
+        File where to save the profile of the generation loop (see
+        evolution).
+    keep_history : bool, optional
+        If True, the results lists of evolution are filled. By default,
+        generations are only recorded in the result log, next to the
+        output csv file, so that memory use does not grow with the number
+        of generations.
+    
+    Returns
+    -------
+    summary : dict
+        Job options, with the final fitness, the number of accepted
+        mutations and the name of the output csv file.
+    results : tuple
+        Results of evolution.
+    """
+    
+    folder = os.path.join(job["folder"], "")
+    initial_parameters = os.path.join(folder, job["params"])
+    next_gen_parameters = os.path.join(folder, job["next_gen_params"])
+    if job["tag"] is None:
+        next_gen_folder = os.path.join(folder, "nextGen")
+        PARAMS = ([next_gen_parameters]
+                  + [os.path.join(next_gen_folder, name) for name in
+                     ["nextGen.gff", "nextGenTSS.dat", "nextGenTTS.dat",
+                      "nextGenProt.dat"]]
+                  + [[os.path.join(next_gen_folder, name) for name in
+                      ["last.gff", "lastTSS.dat", "lastTTS.dat",
+                       "lastProt.dat"]]])
+        output = job["output"]
+        if os.path.dirname(output):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+        simulator = InProcessSimulator(PARAMS[0], PARAMS[1:5])
+    else:
+        PARAMS = isolated_params(next_gen_parameters, job["tag"])
+        simulator = InProcessSimulator(PARAMS[0], PARAMS[1:5])
+        # The workers of the job are isolated inside its own sub-folder
+        simulator.tag = job["tag"]
+        output_folder = os.path.join(os.path.dirname(job["output"]),
+                                     job["tag"])
+        os.makedirs(output_folder, exist_ok=True)
+        output = os.path.join(output_folder, os.path.basename(job["output"]))
+    output_base = os.path.splitext(output)[0]
+    checkpoint_file = output_base + ".checkpoint"
+    
+    if (job["checkpoint_interval"] and os.path.exists(checkpoint_file)
+            and not _checkpoint_matches(load_checkpoint(checkpoint_file), job,
+                                        PARAMS)):
+        print("options of " + checkpoint_file + " differ from the job, "
+              "restarting the run")
+        os.remove(checkpoint_file)
+    if job["checkpoint_interval"] and os.path.exists(checkpoint_file):
+        results = resume(checkpoint_file, observer=observer,
+                         profile_file=profile_file)
+    else:
+        # The whole run is seeded by the job seed
+        rng = np.random.default_rng(job["seed"])
+        # Process the initial genome
+        target_freqs = target_expression(job["environment"])
+        start, end, barr, out, size = pos_out_genes(
+                initial_parameters, folder, output_base + ".genome.npz")
+        initial_simulator = InProcessSimulator(initial_parameters)
+        initial_simulator.seed(rng.bit_generator.seed_seq.spawn(1)[0])
+        initial_expression = initial_simulator.run(start)
+        previous_fitness = compute_fitness(initial_expression, target_freqs)
+        with ResultLog(output_base + ".log") as result_log:
+            results = evolution(
+                    start, end, barr, out, size, initial_expression,
+                    previous_fitness, target_freqs, job["discret_step"],
+                    job["q"], job["inversion_proba"], job["p_insertion"],
+                    job["nb_generations"], PARAMS, simulator,
+                    n_speculative=job["n_speculative"],
+                    staging_folder=job["staging_folder"],
+                    result_log=result_log,
+                    checkpoint_file=(checkpoint_file
+                                     if job["checkpoint_interval"] else None),
+                    checkpoint_interval=job["checkpoint_interval"] or 1,
+                    simulation_timeout=job["simulation_timeout"],
+                    max_attempts=job["max_attempts"],
+                    max_replicates=job["max_replicates"],
+                    replicate_batch=job["replicate_batch"],
+                    decision_z=job["decision_z"],
+                    surrogate=(SurrogateFitness(job["surrogate_warmup"])
+                               if job["surrogate_warmup"] else None),
+                    keep_history=keep_history, observer=observer,
+                    profile_file=profile_file, rng=rng)
+    result_log_to_csv(output_base + ".log", output)
+    # The summary is computed from the log, the history may not be kept
+    records = read_result_log(output_base + ".log")
+    nb_accepted = int(np.count_nonzero(records["accepted"])) - 1
+    summary = dict(job)
+    summary.update({"final_fitness": float(records["accepted_fitness"][-1]),
+                    "nb_accepted": nb_accepted, "output": output})
+    return summary, results
+
+
+def _checkpoint_matches(state, job, PARAMS):
+    # Whether a checkpoint continues the run described by job
+    arguments = state["arguments"]
+    if arguments["PARAMS"] != PARAMS:
+        return False
+    for name in ["discret_step", "q", "inversion_proba", "p_insertion",
+                 "nb_generations", "n_speculative", "simulation_timeout",
+                 "max_attempts", "max_replicates", "replicate_batch",
+                 "decision_z"]:
+        if arguments[name] != job[name]:
+            return False
+    surrogate = arguments["surrogate"]
+    if (surrogate.warmup if surrogate is not None else 0) != (
+            job["surrogate_warmup"]):
+        return False
+    if not np.array_equal(arguments["target_freqs"],
+                          target_expression(job["environment"])):
+        return False
+    return (job["seed"] is None
+            or state["rng"].bit_generator.seed_seq.entropy == job["seed"])
+
+
+def _run_sweep_job(job):
+    # Keep the generation messages of each job in its own folder
+    output_folder = os.path.join(os.path.dirname(job["output"]), job["tag"])
+    os.makedirs(output_folder, exist_ok=True)
+    with open(os.path.join(output_folder, "stdout.txt"), "w") as stdout:
+        with contextlib.redirect_stdout(stdout):
+            return run_job(job)[0]
+
+
+def expand_sweep(options):
+    """
+    List the jobs of a parameter sweep.
+    
+    Parameters
+    ----------
+    options : dict
+        For each option of RUN_OPTIONS, the list of its values. Missing
+        options take their default value.
+    
+    Returns
+    -------
+    jobs : list of dicts
+        One job per combination of option values (see run_job), each with
+        its own tag.
+    
+    >>> jobs = expand_sweep({"q": [0.1, 0.2], "seed": [1, 2, 3]})
+    >>> len(jobs), jobs[0]["tag"], jobs[-1]["q"], jobs[-1]["seed"]
+    (6, 'job0', 0.2, 3)
+    """
+    
+    names = list(RUN_OPTIONS)
+    values = [options.get(name, [RUN_OPTIONS[name][1]]) for name in names]
+    jobs = []
+    for k, combination in enumerate(itertools.product(*values)):
+        job = dict(zip(names, combination))
+        job["tag"] = "job" + str(k)
+        jobs.append(job)
+    return jobs
+
+
+def run_sweep(jobs, max_workers=None, coordinator=None):
+    """
+    Run jobs in a pool of processes.
+    
+    Parameters
+    ----------
+    jobs : list of dicts
+        Jobs to run (see expand_sweep).
+    max_workers : int, optional
+        Maximal number of jobs running at the same time. By default, the
+        number of processors.
+    coordinator : Coordinator, optional
+        If given, jobs are run by the workers of the coordinator, possibly
+        on other hosts, instead of local processes.
+    
+    Returns
+    -------
+    summaries : list of dicts
+        Summary of each job (see run_job), in the order of jobs.
+    
+    The workers of each job (here its speculative simulations) work in the
+    sub-folder of the job, with a stand-in for the simulation script:
+    
+    >>> import tempfile
+    >>> script = '''import os, sys
+    ... folder = os.path.dirname(sys.argv[1])
+    ... tss = [line.split("=")[1].strip() for line in open(sys.argv[1])
+    ...        if line.startswith("TSS")][0]
+    ... with open(os.path.join(folder, tss)) as tss_file:
+    ...     starts = [line.split()[2] for line in tss_file.readlines()[1:]]
+    ... for k, start in enumerate(starts):
+    ...     print(k, 1, 1, 1, start)
+    ... for k, start in enumerate(starts):
+    ...     print("Transcript ID %d : %d" % (k, 1 + int(start) % 7))
+    ... '''
+    >>> params = "[INPUTS]\\n" + "".join(
+    ...         key + " = gen/" + name + "\\n" for key, name in
+    ...         zip(GENOME_FILE_KEYS, ["genome.gff", "TSS.dat", "TTS.dat",
+    ...                                "prot.dat"]))
+    >>> cwd = os.getcwd()
+    >>> with tempfile.TemporaryDirectory() as folder:
+    ...     os.chdir(folder)
+    ...     try:
+    ...         os.makedirs("TwisTranscripT/gen")
+    ...         for name, content in [("start_simulation.py", script),
+    ...                               ("params.ini", params),
+    ...                               ("params_nextGen.ini", params)]:
+    ...             with open("TwisTranscripT/" + name, "w") as file:
+    ...                 _ = file.write(content)
+    ...         with open("environment.dat", "w") as file:
+    ...             _ = file.write("1 0.3\\n2 0.3\\n3 0.4\\n")
+    ...         update_files(3000, [100, 1100, 2100], [600, 1600, 2600],
+    ...                      [2900], *["TwisTranscripT/gen/" + name for name
+    ...                                in ["genome.gff", "TSS.dat",
+    ...                                    "TTS.dat", "prot.dat"]])
+    ...         jobs = expand_sweep({"n_speculative": [3], "seed": [1, 2],
+    ...                              "nb_generations": [6],
+    ...                              "output": ["sweep/out.csv"]})
+    ...         with contextlib.redirect_stdout(io.StringIO()):
+    ...             summaries = run_sweep(jobs, max_workers=2)
+    ...         workers = [sorted(name for name in os.listdir(
+    ...                 os.path.join("TwisTranscripT", job["tag"]))
+    ...                 if name.startswith("speculative")) for job in jobs]
+    ...         shared = os.path.exists("TwisTranscripT/speculative0")
+    ...     finally:
+    ...         os.chdir(cwd)
+    >>> workers[0]
+    ['speculative0', 'speculative1', 'speculative2']
+    >>> workers[0] == workers[1], shared
+    (True, False)
+    >>> [summary["tag"] for summary in summaries]
+    ['job0', 'job1']
+    """
+    
+    summaries = [None] * len(jobs)
+    if coordinator is not None:
+        job_ids = [coordinator.submit("chain", job) for job in jobs]
+        indices = dict(zip(job_ids, range(len(jobs))))
+        for job_id, summary in coordinator.as_completed(job_ids):
+            k = indices[job_id]
+            summaries[k] = summary
+            print(jobs[k]["tag"] + " done: final fitness",
+                  summary["final_fitness"])
+        return summaries
+    with ProcessPoolExecutor(max_workers) as executor:
+        futures = {executor.submit(_run_sweep_job, job): k
+                   for k, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            k = futures[future]
+            summaries[k] = future.result()
+            print(jobs[k]["tag"] + " done: final fitness",
+                  summaries[k]["final_fitness"])
+    return summaries
 
+
+def plot_results(accepted_fitnesses, proposed_fitnesses, all_types,
+                 generation_numbers, filename=None):
+    """
+    Plot the fitness of each generation, colored by event type.
+    
+    Requires matplotlib (plot extra).
+    
+    Parameters
+    ----------
+    accepted_fitnesses, proposed_fitnesses, all_types, generation_numbers
+        Results of evolution.
+    filename : str, optional
+        Image file where to save the plot. If given, the plot is drawn
+        without any display (headless); otherwise it is shown.
+    """
+    
+    import matplotlib
+    if filename is not None:
+        # Non-interactive backend, no display needed
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    plt.figure()
     plt.ylim(.9*min(proposed_fitnesses), 1.1*max(accepted_fitnesses))
     plt.plot(accepted_fitnesses, linestyle="--", markersize=0, color="k", zorder=1)
     plt.scatter(generation_numbers, accepted_fitnesses, alpha=1,
                 c=[COLORS[event_type] for event_type in all_types], zorder=2)
     plt.scatter(generation_numbers, proposed_fitnesses, marker="+",
                 c=[COLORS[event_type] for event_type in all_types])
-    plt.show()
-
-    # Save the results
-    if output_filename:
-        output_matrix = np.vstack((accepted_fitnesses,
-                                   proposed_fitnesses, accepted_status, all_types))
-        output_df = pd.DataFrame(data=output_matrix, columns=generation_numbers,
-                                 index=["system fitness", "proposed fitness",
-                                        "accepted", "event type"])
-        output_df.to_csv(output_filename)
+    if filename is None:
+        plt.show()
+    else:
+        plt.savefig(filename)
+        plt.close()
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+    
+    "run" simulates one evolution, "sweep" simulates one evolution per
+    combination of option values given in a configuration file (see
+    read_config) or on the command line as comma-separated lists. With
+    --listen, the sweep is run by "worker" processes, possibly on other
+    hosts, connecting to this address (see Coordinator and Worker). The
+    coordinator and its workers share the key given by the OURCODE_AUTHKEY
+    environment variable.
+    
+    Parameters
+    ----------
+    argv : list of str, optional
+        Command line arguments. By default, sys.argv[1:].
+    """
+    
+    parser = argparse.ArgumentParser(
+            prog="ourcode", description="Simulate the evolution of a genome "
+            "inside an environment.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="run one simulation")
+    run_parser.add_argument("--plot", action="store_true",
+                            help="plot the fitness of each generation")
+    run_parser.add_argument("--plot-file", default=None,
+                            help="save the plot in this file, without "
+                            "display")
+    run_parser.add_argument("--timings", action="store_true",
+                            help="print the duration of each stage of the "
+                            "generations")
+    run_parser.add_argument("--profile", default=None,
+                            help="profile the generations with cProfile and "
+                            "save the statistics in this file")
+    sweep_parser = subparsers.add_parser(
+            "sweep", help="run one simulation per combination of values")
+    sweep_parser.add_argument("--max-workers", type=int, default=None,
+                              help="maximal number of simultaneous jobs")
+    sweep_parser.add_argument("--summary", default=None,
+                              help="csv file summarizing the jobs")
+    sweep_parser.add_argument("--listen", default=None,
+                              help="host:port where workers get the jobs, "
+                              "instead of running them locally")
+    sweep_parser.add_argument("--heartbeat-timeout", type=float, default=30.,
+                              help="silence in seconds after which a "
+                              "worker is lost and its job requeued")
+    worker_parser = subparsers.add_parser(
+            "worker", help="run the jobs of a sweep coordinator")
+    worker_parser.add_argument("--coordinator", required=True,
+                               help="host:port of the coordinator")
+    worker_parser.add_argument("--root", default=None,
+                               help="folder where the job paths are "
+                               "resolved (default: current folder)")
+    worker_parser.add_argument("--name", default=None,
+                               help="worker name (default: host-pid)")
+    worker_parser.add_argument("--staging-folder", default=None,
+                               help="folder of the simulated genome files")
+    worker_parser.add_argument("--heartbeat-interval", type=float,
+                               default=5., help="seconds between heartbeats")
+    for subparser in [run_parser, sweep_parser]:
+        subparser.add_argument("--config", default=None,
+                               help=".ini file with an [evolution] section")
+        for name, (option_type, default) in RUN_OPTIONS.items():
+            subparser.add_argument("--" + name.replace("_", "-"), dest=name,
+                                   default=None)
+    arguments = parser.parse_args(argv)
+    
+    authkey = os.environ.get(AUTHKEY_VARIABLE)
+    if arguments.command == "worker" or (arguments.command == "sweep"
+                                         and arguments.listen is not None):
+        if not authkey:
+            parser.error("the " + AUTHKEY_VARIABLE + " environment variable "
+                         "must give the key shared by the coordinator and "
+                         "its workers")
+        authkey = authkey.encode()
+    if arguments.command == "worker":
+        worker = Worker(parse_address(arguments.coordinator), authkey,
+                        arguments.name, arguments.root,
+                        arguments.staging_folder, arguments.heartbeat_interval)
+        print("jobs run:", worker.run())
+        return
+    
+    options = {}
+    if arguments.config is not None:
+        options = read_config(arguments.config)
+    for name, (option_type, default) in RUN_OPTIONS.items():
+        value = getattr(arguments, name)
+        if value is not None:
+            options[name] = [option_type(x.strip())
+                             for x in value.split(",")]
+    
+    if arguments.command == "run":
+        jobs = expand_sweep(options)
+        if len(jobs) > 1:
+            parser.error("run takes a single value per option, use sweep")
+        jobs[0]["tag"] = None
+        timer = StageTimer() if arguments.timings else None
+        summary, results = run_job(jobs[0], timer, arguments.profile)
+        final_expression = results[5]
+        print("final expression", final_expression)
+        print("results saved in", summary["output"])
+        if timer is not None:
+            print("acceptance rate", timer.acceptance_rate())
+            print("failed simulations", timer.nb_failures)
+            print("simulations", timer.nb_simulations)
+            print("decisions per number of replicates",
+                  dict(sorted(timer.replicate_counts.items())))
+            if timer.nb_screenings:
+                print("surrogate", timer.surrogate_summary())
+            print("%-24s %8s %10s %10s %10s %10s" % (
+                    "stage", "count", "mean (ms)", "p50 (ms)", "p90 (ms)",
+                    "p99 (ms)"))
+            for stage, stats in timer.summary().items():
+                print("%-24s %8d %10.3f %10.3f %10.3f %10.3f" % (
+                        stage, stats["count"], 1e3 * stats["mean"],
+                        1e3 * stats["p50"], 1e3 * stats["p90"],
+                        1e3 * stats["p99"]))
+        if arguments.plot or arguments.plot_file is not None:
+            # The history is read back from the result log
+            records = read_result_log(os.path.splitext(summary["output"])[0]
+                                      + ".log")
+            (accepted_fitnesses, proposed_fitnesses, accepted_status,
+             all_types) = result_log_history(records)
+            plot_results(accepted_fitnesses, proposed_fitnesses, all_types,
+                         records["generation"], arguments.plot_file)
+    else:
+        if arguments.listen is None:
+            summaries = run_sweep(expand_sweep(options),
+                                  arguments.max_workers)
+        else:
+            with Coordinator(parse_address(arguments.listen), authkey,
+                             arguments.heartbeat_timeout) as coordinator:
+                summaries = run_sweep(expand_sweep(options),
+                                      coordinator=coordinator)
+        if arguments.summary is not None:
+            with open(arguments.summary, "w") as summary_file:
+                summary_file.write(",".join(summaries[0]) + "\n")
+                for summary in summaries:
+                    summary_file.write(",".join(str(summary[name]) for name
+                                                in summaries[0]) + "\n")
+
+
+if __name__=="__main__":
+    main()
@@ -11,4 +11,7 @@ setup(name='HandsOnDeployAPackage',
       url='https://github.com/draguar/HandsOn_DeployAPythonPackage',
       py_modules=['ourCode'],
       license_files = '../LICENSE',
-      install_requires = ['pandas>=1.3.4', 'matplotlib>=3.5.0'])
+      install_requires = ['numpy>=1.25'],
+      extras_require = {'plot': ['matplotlib>=3.5.0'],
+                        'table': ['pandas>=1.3.4']},
+      entry_points = {'console_scripts': ['ourcode = ourCode:main']})